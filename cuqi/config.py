@@ -12,3 +12,9 @@ MAX_STACK_SEARCH_DEPTH = 1000
 
 MIN_DIM_SPARSE = 75
 """ Minimum dimension to start storing Nd-arrays as sparse for N>2. The minimum dimension is defined as MIN_DIM_SPARSE^N. """
+
+MIN_DIM_MATRIX_FREE = 512**2
+""" Minimum total dimension of 2D Markov random field priors (LMRF and CMRF) from which the difference operator is applied matrix-free instead of assembling its sparse matrix. """
+
+BATCH_SIZE = 1000
+""" Maximum number of samples processed at once when vectorized operations are applied to cuqi.samples.Samples objects (bounds the memory used per batch)."""
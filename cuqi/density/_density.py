@@ -64,6 +64,16 @@ class Density(ABC):
         """ Spacing for the finite difference approximation of the logd gradient. """
         return self._FD_epsilon
 
+    @property
+    def FD_method(self):
+        """ Finite difference scheme for the approximation of the logd gradient. """
+        return self._FD_method
+
+    @property
+    def FD_workers(self):
+        """ Number of threads used to evaluate the logd for the finite difference approximation of the gradient. """
+        return self._FD_workers
+
     def logd(self, *args, **kwargs):
         """ Evaluates the un-normalized log density function given a set of parameters.
         
@@ -96,11 +106,38 @@ class Density(ABC):
         # Use FD approximation if requested
         if self.FD_enabled:
             return cuqi.utilities.approx_gradient(
-                self.logd, *args, **kwargs, epsilon=self.FD_epsilon)
+                self.logd, *args, **kwargs, epsilon=self.FD_epsilon,
+                method=self.FD_method, workers=self.FD_workers)
 
         # Otherwise use the implemented gradient
         return self._gradient(*args, **kwargs)
-   
+
+    def logd_and_gradient(self, *args, **kwargs):
+        """ Evaluates the un-normalized log density function and its gradient at x.
+
+        Returns the same as ``(self.logd(x), self.gradient(x))``, but allows
+        densities to share computations between the two, e.g. the forward
+        model evaluation of a likelihood.
+
+        """
+
+        # Use separate evaluations if keyword arguments need to be parsed
+        if len(kwargs) > 0:
+            return self.logd(*args, **kwargs), self.gradient(*args, **kwargs)
+
+        # Reuse the log density in the FD approximation if requested
+        if self.FD_enabled:
+            logd = self.logd(*args)
+            return logd, cuqi.utilities.approx_gradient(
+                self.logd, *args, epsilon=self.FD_epsilon, method=self.FD_method,
+                func_x=logd, workers=self.FD_workers)
+
+        return self._logd_and_gradient(*args)
+
+    def _logd_and_gradient(self, *args):
+        """ Returns the log density (including the constant) and its gradient. Subclasses can override this to share computations. """
+        return self.logd(*args), self._gradient(*args)
+
     @abstractmethod
     def _logd(self):
         pass
@@ -140,17 +177,25 @@ class Density(ABC):
         """
         return self._condition(*args, **kwargs)
 
-    def enable_FD(self, epsilon=1e-8):
+    def enable_FD(self, epsilon=1e-8, method="forward", workers=None):
         """ Enable finite difference approximation for logd gradient. Note
         that if enabled, the FD approximation will be used even if the 
-        _gradient method is implemented. """
+        _gradient method is implemented.
+
+        The scheme is given by `method` ("forward", "central" or "complex")
+        and the logd evaluations can be spread over `workers` threads, see
+        :func:`cuqi.utilities.approx_gradient`. """
         self._FD_enabled = True
         self._FD_epsilon = epsilon
+        self._FD_method = method
+        self._FD_workers = workers
 
     def disable_FD(self):
         """ Disable finite difference approximation for logd gradient. """
         self._FD_enabled = False
         self._FD_epsilon = None
+        self._FD_method = None
+        self._FD_workers = None
 
 
 class EvaluatedDensity(Density):
@@ -176,6 +221,10 @@ class EvaluatedDensity(Density):
         raise NotImplementedError(
             f"gradient is not implemented for {self.__class__.__name__}.")
 
+    def logd_and_gradient(self, *args, **kwargs):
+        raise NotImplementedError(
+            f"logd_and_gradient is not implemented for {self.__class__.__name__}.")
+
     def _gradient(self):
         raise NotImplementedError(
             f"_gradient is not implemented for {self.__class__.__name__}.")
@@ -7,6 +7,8 @@
 import numpy as np
 import scipy as sp
 import scipy.stats as sps
+import scipy.special
+import scipy.fft
 import warnings
 
 
@@ -90,6 +92,187 @@ def spectrum(x, nfft):
     return y, f
 
 
+# ===================================================================
+_MAX_ELEMENTS_IN_MEMORY = 10**7
+""" Maximum number of sample values (over all chains) processed at a time by compute_ess and compute_rhat. """
+
+def compute_ess(chains, method="bulk", prob=None, relative=False):
+    """ Compute the effective sample size (ESS) of each variable of one or more Markov chains.
+
+    The ESS is computed following Vehtari et al. (2021), https://arxiv.org/abs/1903.08008
+    (as in arviz.ess), using FFT-based autocovariances of all variables at once. The variables
+    are processed in blocks such that at most `_MAX_ELEMENTS_IN_MEMORY` sample values are held
+    in memory at a time.
+
+    Parameters
+    ----------
+    chains : ndarray or list of ndarray
+        Samples of a single chain as an array of shape (dim, Ns) or a list of such arrays, one for each chain.
+
+    method : str, default "bulk"
+        "bulk" (ESS of the rank normalized split chains), "tail" (minimum of the quantile ESS
+        of the probabilities `prob`), "mean" (ESS of the split chains) or "quantile" (ESS of
+        the quantile given by the probability `prob`).
+
+    prob : float or tuple of two floats, optional
+        Probability of the quantile for method "quantile" (required) or the two probabilities
+        for method "tail" (default (0.05, 0.95)).
+
+    relative : bool, default False
+        If True, the ESS is divided by the total number of samples in the chains.
+
+    Returns
+    -------
+    Numpy array with effective sample size for each variable.
+    """
+    if method == "bulk":
+        func = lambda x: _ess(_z_scale(_split_chains(x)), relative)
+    elif method == "mean":
+        func = lambda x: _ess(_split_chains(x), relative)
+    elif method == "tail":
+        if prob is None:
+            prob = (0.05, 0.95)
+        elif np.isscalar(prob):
+            prob = (prob, 1-prob)
+        func = lambda x: np.minimum(_ess_quantile(x, prob[0], relative),
+                                    _ess_quantile(x, prob[1], relative))
+    elif method == "quantile":
+        if prob is None:
+            raise ValueError("prob must be given when computing the ESS with method 'quantile'.")
+        func = lambda x: _ess_quantile(x, prob, relative)
+    else:
+        raise ValueError(f"Unknown ESS method '{method}'. Must be 'bulk', 'tail', 'mean' or 'quantile'.")
+    return _apply_to_variable_blocks(func, chains, min_chains=1)
+
+def compute_rhat(chains, method="rank"):
+    """ Compute the potential scale reduction factor (R-hat) of each variable of two or more Markov chains.
+
+    R-hat values close to 1 indicate that the chains have converged to the same distribution.
+    The default rank normalized split-R-hat follows Vehtari et al. (2021),
+    https://arxiv.org/abs/1903.08008 (as in arviz.rhat). The variables are processed in blocks
+    such that at most `_MAX_ELEMENTS_IN_MEMORY` sample values are held in memory at a time.
+
+    Parameters
+    ----------
+    chains : list of ndarray
+        Samples of each chain as arrays of shape (dim, Ns).
+
+    method : str, default "rank"
+        "rank" (maximum of the rank normalized split-R-hat of the samples and of the folded
+        samples), "split" (split-R-hat), "folded" (rank normalized split-R-hat of the folded
+        samples), "z_scale" (rank normalized split-R-hat) or "identity" (R-hat of the chains).
+
+    Returns
+    -------
+    Numpy array with R-hat value for each variable.
+    """
+    methods = {
+        "rank": lambda x: np.maximum(_rhat(_z_scale(_split_chains(x))), _rhat(_z_scale(_fold(_split_chains(x))))),
+        "split": lambda x: _rhat(_split_chains(x)),
+        "folded": lambda x: _rhat(_z_scale(_fold(_split_chains(x)))),
+        "z_scale": lambda x: _rhat(_z_scale(_split_chains(x))),
+        "identity": _rhat,
+    }
+    if method not in methods:
+        raise ValueError(f"Unknown R-hat method '{method}'. Must be one of {list(methods.keys())}.")
+    return _apply_to_variable_blocks(methods[method], chains, min_chains=2)
+
+def _apply_to_variable_blocks(func, chains, min_chains):
+    """ Apply `func`, mapping an array of shape (block, n_chains, Ns) to a value per variable, to blocks of variables of the chains. Variables with NaN values, or too few chains or samples, give NaN. """
+    if isinstance(chains, np.ndarray) and chains.ndim == 2:
+        chains = [chains]
+    chains = [np.asarray(chain) for chain in chains]
+    if any(chain.ndim != 2 or chain.shape != chains[0].shape for chain in chains):
+        raise ValueError("Chains must be arrays of the same shape (dim, Ns).")
+    dim, Ns = chains[0].shape
+    n_chains = len(chains)
+
+    out = np.full(dim, np.nan)
+    if n_chains < min_chains or Ns < 4:
+        return out
+
+    block = max(1, _MAX_ELEMENTS_IN_MEMORY//(n_chains*Ns))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, dim, block):
+            x = np.stack([chain[start:start+block] for chain in chains], axis=1).astype(float)
+            values = func(x)
+            values[np.isnan(x).any(axis=(1, 2))] = np.nan
+            out[start:start+block] = values
+    return out
+
+def _split_chains(x):
+    """ Split each chain of x (variables, chains, draws) in two halves. """
+    half = x.shape[-1]//2
+    return np.concatenate((x[..., :half], x[..., -half:]), axis=1)
+
+def _fold(x):
+    """ Absolute deviation of x (variables, chains, draws) from the median of each variable. """
+    median = np.median(x.reshape(len(x), -1), axis=-1)
+    return np.abs(x - median[:, None, None])
+
+def _z_scale(x):
+    """ Rank normalization (with Blom's offset) of x (variables, chains, draws) for each variable. """
+    size = x.shape[1]*x.shape[2]
+    rank = sps.rankdata(x.reshape(len(x), -1), method="average", axis=-1)
+    return sp.special.ndtri((rank - 3/8)/(size - 2*3/8 + 1)).reshape(x.shape) # Standard normal quantiles
+
+def _rhat(x):
+    """ R-hat of x (variables, chains, draws) for each variable. """
+    n = x.shape[-1]
+    between_chain_variance = n*np.var(np.mean(x, axis=-1), axis=-1, ddof=1)
+    within_chain_variance = np.mean(np.var(x, axis=-1, ddof=1), axis=-1)
+    return np.sqrt((between_chain_variance/within_chain_variance + n - 1)/n)
+
+def _autocovariance(x):
+    """ Autocovariance of x along the last axis for all lags computed with the FFT. """
+    n = x.shape[-1]
+    m = sp.fft.next_fast_len(2*n)
+    x = x - np.mean(x, axis=-1, keepdims=True)
+    fft_x = np.fft.rfft(x, n=m, axis=-1)
+    return np.fft.irfft(fft_x*np.conjugate(fft_x), n=m, axis=-1)[..., :n]/n
+
+def _ess(x, relative=False):
+    """ ESS of x (variables, chains, draws) for each variable using Geyer's initial monotone sequence of autocorrelations. """
+    d, m, n = x.shape
+    acov = _autocovariance(x)
+    mean_var = np.mean(acov[..., 0], axis=-1)*n/(n-1)
+    var_plus = mean_var*(n-1)/n
+    if m > 1:
+        var_plus = var_plus + np.var(np.mean(x, axis=-1), axis=-1, ddof=1)
+    rho = 1 - (mean_var[:, None] - np.mean(acov, axis=1))/var_plus[:, None]
+    rho[:, 0] = 1
+
+    # Geyer's initial positive sequence: Sum pairs of autocorrelations
+    # (rho_2k + rho_2k+1) while they are positive (and k < max_pairs)
+    max_pairs = max(0, -(-(n-2)//2) - 1)
+    pairs = rho[:, 0:2*max_pairs+2:2] + rho[:, 1:2*max_pairs+2:2]
+    num_pairs = np.sum(np.cumprod(pairs[:, :max_pairs] > 0, axis=1), axis=1)
+
+    # Geyer's initial monotone sequence: Pair sums are made non-increasing
+    monotone_pairs = np.minimum.accumulate(pairs[:, :max_pairs], axis=1)
+    pair_sum = np.sum(np.where(np.arange(max_pairs) < num_pairs[:, None], monotone_pairs, 0), axis=1)
+
+    # Add the first autocorrelation of the next pair if positive (or if the pair sum is not negative)
+    idx = np.arange(d)
+    rho_next = rho[idx, 2*num_pairs]
+    rho_next = np.where((rho_next > 0) | (pairs[idx, num_pairs] >= 0), rho_next, 0)
+
+    tau = -1 + 2*pair_sum + rho_next
+    tau = np.maximum(tau, 1/np.log10(m*n))
+    ess = (1 if relative else m*n)/tau
+    ess[np.isnan(rho).any(axis=1)] = np.nan
+
+    # Constant chains
+    constant = (np.max(x, axis=(1, 2)) - np.min(x, axis=(1, 2))) < np.finfo(float).resolution
+    ess[constant] = 1 if relative else m*n
+    return ess
+
+def _ess_quantile(x, prob, relative=False):
+    """ ESS of the quantile given by `prob` of x (variables, chains, draws) for each variable. """
+    quantile = np.quantile(x.reshape(len(x), -1), prob, axis=-1)
+    return _ess(_split_chains((x <= quantile[:, None, None]).astype(float)), relative)
+
+
 
 # ===================================================================
 # ===================================================================
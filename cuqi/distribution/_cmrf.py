@@ -2,6 +2,7 @@ import numpy as np
 import warnings
 from cuqi.geometry import _DefaultGeometry1D, Image2D, _get_identity_geometries
 from cuqi.distribution import Distribution
+from cuqi import config
 from cuqi.operator import FirstOrderFiniteDifference
 from cuqi.utilities import force_ndarray
 
@@ -71,7 +72,8 @@ class CMRF(Distribution):
         else: 
             num_nodes = self.dim
 
-        self._diff_op = FirstOrderFiniteDifference(num_nodes=num_nodes, bc_type=bc_type)
+        matrix_free = self._physical_dim == 2 and self.dim >= config.MIN_DIM_MATRIX_FREE
+        self._diff_op = FirstOrderFiniteDifference(num_nodes=num_nodes, bc_type=bc_type, matrix_free=matrix_free)
 
     @property
     def location(self):
@@ -93,8 +95,8 @@ class CMRF(Distribution):
             raise NotImplementedError("Gradient not implemented for distribution {} with geometry {}".format(self,self.geometry))
 
         if not callable(self.location): # for prior
-            diff = self._diff_op._matrix @ val
-            return (-2*diff/(diff**2+self.scale**2)) @ self._diff_op._matrix
+            diff = self._diff_op @ val
+            return self._diff_op.rmatvec(-2*diff/(diff**2+self.scale**2))
         else:
             warnings.warn('Gradient not implemented for {}'.format(type(self.location)))
 
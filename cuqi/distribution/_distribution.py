@@ -207,6 +207,14 @@ class Distribution(Density, ABC):
             f"gradient by calling the {self.__class__.__name__} method " +
             "enable_FD().")
 
+    def _conditional_logd_and_gradient(self, val, *args):
+        """ Returns the log density at val of the distribution conditioned on args and its gradient with respect to args.
+        
+        This is used by likelihoods. Subclasses can override this to share computations between the two.
+        
+        """
+        return self(*args).logd(val), self.gradient(val, *args)
+
     def sample(self,N=1,*args,**kwargs):
         """ Sample from the distribution. """
 
@@ -1,5 +1,7 @@
 import warnings
 import numbers
+import threading
+from copy import copy
 import numpy as np
 import numpy.linalg as nplinalg
 
@@ -9,7 +11,7 @@ import scipy.linalg as splinalg
 
 from cuqi import config
 from cuqi.geometry import _get_identity_geometries
-from cuqi.utilities import force_ndarray, sparse_cholesky, check_if_conditional_from_attr
+from cuqi.utilities import force_ndarray, sparse_cholesky, check_if_conditional_from_attr, _PreparedLinearSolver
 from cuqi.distribution import Distribution
 
 # We potentially allow the use of sksparse.cholmod for sparse Cholesky
@@ -94,6 +96,10 @@ class Gaussian(Distribution):
     def __init__(self, mean=None, cov=None, prec=None, sqrtcov=None, sqrtprec=None, is_symmetric=True, **kwargs):
         super().__init__(is_symmetric=is_symmetric, **kwargs)
 
+        # Cache of matrix factorizations. Shared with conditioned copies of the distribution such that
+        # e.g. repeatedly conditioning on a scalar hyperparameter (prec = d*P) does not refactorize P.
+        self._factorization_cache = _FactorizationCache()
+
         self.mean = mean
 
         # If everything is None we default to covariance as the mutable variables
@@ -147,7 +153,8 @@ class Gaussian(Distribution):
                 sparse_flag = True # do sparse computations
             else:
                 sparse_flag = False  # use numpy
-            prec, sqrtprec, logdet, rank = get_sqrtprec_from_cov(self.dim, value, sparse_flag)
+            prec, sqrtprec, logdet, rank = self._factorization_cache.get_sqrtprec(
+                'cov', get_sqrtprec_from_cov, self.dim, value, sparse_flag)
             self._prec = prec
             self._sqrtprec = sqrtprec
             self._logdet = logdet
@@ -172,7 +179,8 @@ class Gaussian(Distribution):
                 sparse_flag = True # do sparse computations
             else:
                 sparse_flag = False  # use numpy
-            sqrtprec, logdet, rank = get_sqrtprec_from_prec(self.dim, value, sparse_flag)
+            sqrtprec, logdet, rank = self._factorization_cache.get_sqrtprec(
+                'prec', get_sqrtprec_from_prec, self.dim, value, sparse_flag)
             self._sqrtprec = sqrtprec
             self._logdet = logdet
             self._rank = rank
@@ -196,7 +204,8 @@ class Gaussian(Distribution):
                 sparse_flag = True # do sparse computations
             else:
                 sparse_flag = False  # use numpy
-            prec, sqrtprec, logdet, rank = get_sqrtprec_from_sqrtcov(self.dim, value, sparse_flag)
+            prec, sqrtprec, logdet, rank = self._factorization_cache.get_sqrtprec(
+                'sqrtcov', get_sqrtprec_from_sqrtcov, self.dim, value, sparse_flag)
             self._prec = prec
             self._sqrtprec = sqrtprec
             self._logdet = logdet
@@ -219,7 +228,8 @@ class Gaussian(Distribution):
                 sparse_flag = True # do sparse computations
             else:
                 sparse_flag = False  # use numpy
-            sqrtprec, logdet, rank = get_sqrtprec_from_sqrtprec(self.dim, value, sparse_flag)
+            sqrtprec, logdet, rank = self._factorization_cache.get_sqrtprec(
+                'sqrtprec', get_sqrtprec_from_sqrtprec, self.dim, value, sparse_flag)
             self._sqrtprec = sqrtprec 
             self._logdet = logdet
             self._rank = rank
@@ -307,13 +317,50 @@ class Gaussian(Distribution):
             return -( self.prec @ (val - self.mean).T )
         elif hasattr(self.mean, "gradient"): # for likelihood
             model = self.mean
-            dev = val - model.forward(*args, **kwargs)
-            if isinstance(dev, numbers.Number):
-                dev = np.array([dev])
-            return model.gradient(self.prec @ dev, *args, **kwargs)
+            return self._model_gradient(val, model.forward(*args, **kwargs), *args, **kwargs)
         else:
             warnings.warn('Gradient not implemented for {}'.format(type(self.mean)))
 
+    def _logd_and_gradient(self, x):
+        # Share the application of sqrtprec to the deviation from the mean between logd and gradient
+        if self.is_cond or callable(self.mean) or self.logdet is None or \
+           not type(self.geometry) in _get_identity_geometries():
+            return super()._logd_and_gradient(x)
+
+        dev = x - self.mean
+        sqrtprec_dev = self.sqrtprec @ dev.T
+        logupdf = -0.5*np.sum(np.square(sqrtprec_dev), axis=0).flatten()
+        Z = -0.5*(self.rank*np.log(2*np.pi) + self.logdet.flatten())
+        return Z + logupdf + self._constant, -(self.sqrtprec.T @ sqrtprec_dev)
+
+    def _model_gradient(self, val, model_output, *args, **kwargs):
+        """ Gradient with respect to the model input given the model output (forward evaluation) at args """
+        dev = val - model_output
+        if isinstance(dev, numbers.Number):
+            dev = np.array([dev])
+        return self.mean.gradient(self.prec @ dev, *args, **kwargs)
+
+    def _conditional_logd_and_gradient(self, val, *args):
+        # Share the forward model evaluation between logd and gradient if the
+        # model is the only conditioning variable of the distribution
+        model = self.mean
+        if self.FD_enabled or len(args) != 1 or not hasattr(model, "gradient") or \
+           any(callable(getattr(self, var)) for var in self.get_mutable_variables() if var != "mean"):
+            return super()._conditional_logd_and_gradient(val, *args)
+
+        #Avoid complicated geometries that change the gradient.
+        if not type(self.geometry) in _get_identity_geometries() and \
+           not hasattr(self.geometry, 'gradient'):
+            raise NotImplementedError("Gradient not implemented for distribution {} with geometry {}".format(self,self.geometry))
+
+        model_output = model.forward(*args)
+
+        # Condition on the model output as in self(*args)
+        new_dist = self._make_copy()
+        new_dist.mean = model_output
+
+        return new_dist.logd(val), self._model_gradient(val, model_output, *args)
+
     def _sample(self, N=1, rng=None):
         """ Generate samples of the Gaussian distribution using
         `s = mean + pseudoinverse(sqrtprec)*e`,
@@ -325,23 +372,275 @@ class Gaussian(Distribution):
         else:
             e = np.random.randn(np.shape(self.sqrtprec)[0], N)
 
-        # Compute perturbation
-        if spa.issparse(self.sqrtprec): # do sparse
-            if (N == 1):
-                perturbation = spa.linalg.spsolve(self.sqrtprec, e)[:, None]
-            else:
-                perturbation = spa.linalg.spsolve(self.sqrtprec, e)
-        else:
-            if np.allclose(self.sqrtprec, np.tril(self.sqrtprec)): # matrix is triangular
-                perturbation = splinalg.solve_triangular(self.sqrtprec, e)
-            else:
-                perturbation = splinalg.solve(self.sqrtprec, e)
+        # Compute perturbation using a prepared (factorized) solver for sqrtprec
+        perturbation = self._get_sqrtprec_solver().solve(e)
 
         # Add mean
         s = self.mean[:, None] + perturbation
         return s
 
+    def _get_sqrtprec_solver(self):
+        """ Return a prepared solver for systems with sqrtprec. The solver is reused as long as sqrtprec is unchanged
+        and obtained from the factorization cache if sqrtprec is a scalar multiple of a previously factorized matrix. """
+        sqrtprec = self.sqrtprec
+        prepared = getattr(self, '_sqrtprec_solver', None)
+        if prepared is None or prepared[0] is not sqrtprec:
+            prepared = (sqrtprec, self._factorization_cache.get_solver(sqrtprec))
+            self._sqrtprec_solver = prepared
+        return prepared[1]
+
 # ======= Helper functions for Gaussian distribution =======
+class _SqrtprecSolver:
+    """ Prepared solver for linear systems `sqrtprec@x = e` (with one or more right-hand sides e).
+
+    The structure of sqrtprec is determined (and any factorization computed) once, such that each solve costs
+    O(n) for diagonal, O(n^2) for triangular or LU-factorized dense matrices and O(nnz) of the factors for
+    sparse matrices.
+
+    Parameters
+    ----------
+    sqrtprec : 2d-array or sparse matrix
+        The square root of the precision matrix.
+
+    scale : float
+        Solve with scale*sqrtprec instead of sqrtprec.
+
+    """
+
+    def __init__(self, sqrtprec, scale=1.0):
+        self.scale = scale
+        if isinstance(sqrtprec, spa.linalg.LinearOperator):
+            raise NotImplementedError("Sampling a Gaussian with sqrtprec given as a LinearOperator is not supported.")
+        self._solver = _PreparedLinearSolver(sqrtprec)
+
+    @property
+    def structure(self):
+        """ Detected structure of sqrtprec ('diagonal', 'lower', 'upper', 'dense' or 'sparse'). """
+        return self._solver.structure
+
+    def rescaled(self, scale):
+        """ Return a solver for scale*sqrtprec sharing the prepared factorization. """
+        solver = copy(self)
+        solver.scale = self.scale*scale
+        return solver
+
+    def solve(self, e):
+        """ Solve `scale*sqrtprec@x = e` for x. The right-hand side e can be a vector or a matrix (one system per column). """
+        x = self._solver.solve(e)
+        return x/self.scale if self.scale != 1 else x
+
+class _FactorizationCache:
+    """ Least recently used cache of the factorizations computed by the get_sqrtprec_from_* functions.
+
+    Entries are keyed by the kind of matrix ('cov', 'prec', 'sqrtcov' or 'sqrtprec') and the matrix itself up to a
+    scalar factor. If a matrix is a scalar multiple c*M of a cached matrix M, the factorization is obtained
+    analytically from the factorization of M (e.g. sqrt(c)*sqrtprec and logdet-rank*log(c) for prec=c*M) instead
+    of refactorizing. Only (dense or sparse) 2D matrices are cached, since scalars and vectors are cheap to handle.
+
+    A lookup compares a scale invariant fingerprint of the matrix (see :func:`_matrix_fingerprint`) with the
+    fingerprints of the cached matrices, and only a matching entry is confirmed by comparing the full matrices.
+    The copies of the cached matrices are bounded in total by `max_bytes`. The cache is shared by the copies
+    of a Gaussian and can be used from several threads.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of cached factorizations and sqrtprec solvers. The least recently used entry is evicted
+        first.
+
+    max_bytes : int
+        Maximum total size in bytes of the matrices stored in the cache. Matrices larger than this are not cached.
+
+    """
+
+    def __init__(self, maxsize=8, max_bytes=2**26):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = [] # (kind, sparse_flag, fingerprint, matrix, factorization or solver), most recently used last
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'] # Locks cannot be copied or pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def get_solver(self, sqrtprec):
+        """ Return a prepared :class:`_SqrtprecSolver` for sqrtprec, reusing the solver of a cached matrix if sqrtprec is a scalar multiple of it. """
+        if self.maxsize <= 0 or not _is_2d_matrix(sqrtprec):
+            return _SqrtprecSolver(sqrtprec)
+
+        fingerprint = _matrix_fingerprint(sqrtprec)
+        with self._lock:
+            match = self._lookup('solver', None, sqrtprec, fingerprint)
+        if match is not None:
+            solver, c = match
+            return solver.rescaled(c) if c != 1 else solver
+
+        solver = _SqrtprecSolver(sqrtprec)
+        self._insert('solver', None, sqrtprec, fingerprint, solver)
+        return solver
+
+    def get_sqrtprec(self, kind, compute, dim, value, sparse_flag):
+        """ Return the factorization `compute(dim, value, sparse_flag)` using the cache if possible. """
+        if self.maxsize <= 0 or not _is_2d_matrix(value) or value.shape[0] == 1:
+            return compute(dim, value, sparse_flag)
+
+        fingerprint = _matrix_fingerprint(value)
+        with self._lock:
+            match = self._lookup(kind, sparse_flag, value, fingerprint)
+            if match is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if match is not None:
+            factorization, c = match
+            return _rescale_factorization(kind, factorization, c, value)
+
+        # Factorize outside the lock such that other threads can use the cache meanwhile
+        factorization = compute(dim, value, sparse_flag)
+        self._insert(kind, sparse_flag, value, fingerprint, factorization)
+        return factorization
+
+    def _lookup(self, kind, sparse_flag, value, fingerprint):
+        """ Return (cached item, c) for the most recently used entry of the kind whose matrix M satisfies value = c*M, marking it as most recently used. Returns None if there is no such entry. """
+        entries = self._entries
+        if fingerprint is None:
+            return None
+        for idx in range(len(entries)-1, -1, -1):
+            entry_kind, entry_sparse_flag, entry_fingerprint, matrix, item = entries[idx]
+            if entry_kind != kind or entry_sparse_flag != sparse_flag:
+                continue
+            if not _fingerprints_match(fingerprint, entry_fingerprint):
+                continue
+            c = _scale_factor(value, matrix, entry_fingerprint[0][-1])
+            if c is None or (kind in ('cov', 'prec') and c <= 0):
+                continue
+            entries.append(entries.pop(idx))
+            return item, c
+        return None
+
+    def _insert(self, kind, sparse_flag, value, fingerprint, item):
+        """ Store a copy of the matrix value with its cached item and evict least recently used entries to stay within `maxsize` and `max_bytes`. """
+        if fingerprint is None or _matrix_nbytes(value) > self.max_bytes:
+            return
+        matrix = _copy_matrix(value)
+        with self._lock:
+            # Another thread may have cached the same matrix while item was computed
+            if self._lookup(kind, sparse_flag, value, fingerprint) is not None:
+                return
+            self._entries.append((kind, sparse_flag, fingerprint, matrix, item))
+            while len(self._entries) > self.maxsize or \
+                    sum(_matrix_nbytes(entry[3]) for entry in self._entries) > self.max_bytes:
+                self._entries.pop(0)
+
+def _copy_matrix(value):
+    """ Copy of a dense matrix or a csr copy (with sorted indices) of a sparse matrix, as stored in the factorization cache. """
+    if spa.issparse(value):
+        matrix = value.tocsr(copy=True)
+        matrix.sort_indices()
+        return matrix
+    return np.array(value)
+
+def _matrix_nbytes(matrix):
+    """ Number of bytes of a dense matrix or of the arrays of a sparse matrix. """
+    if spa.issparse(matrix):
+        matrix = matrix.tocsr()
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return np.asarray(matrix).nbytes
+
+_FINGERPRINT_SAMPLES = 16
+""" Number of (evenly spaced) entries of a matrix used in its fingerprint. """
+
+def _matrix_fingerprint(matrix):
+    """ Scale invariant fingerprint of a (dense or sparse) 2D matrix for cache lookups.
+
+    Returns a tuple (key, sample) where key holds the shape, the sparsity structure (number of non-zeros and
+    a hash of the index arrays for sparse matrices) and the index of the largest (absolute) entry (pivot), and
+    sample holds the sum and the sum of squares of the entries and a few entries, divided by (powers of) the
+    pivot value. Scalar multiples of a matrix have equal keys and (up to rounding) equal samples. Returns None
+    if the matrix is zero.
+    """
+    if spa.issparse(matrix):
+        matrix = matrix.tocsr()
+        if not matrix.has_sorted_indices:
+            matrix = matrix.sorted_indices()
+        structure = (matrix.nnz, hash(matrix.indptr.tobytes()), hash(matrix.indices.tobytes()))
+        data = matrix.data
+    else:
+        structure = ()
+        data = np.asarray(matrix).ravel()
+    pivot = _matrix_pivot(data)
+    if pivot is None:
+        return None
+    entries = data[np.linspace(0, data.size-1, min(_FINGERPRINT_SAMPLES, data.size)).astype(int)]
+    sample = np.concatenate([[np.sum(data)/data[pivot], np.dot(data, data)/data[pivot]**2], entries/data[pivot]])
+    return (tuple(matrix.shape), spa.issparse(matrix)) + structure + (pivot,), sample
+
+def _fingerprints_match(fingerprint, other):
+    """ Check if two fingerprints (see :func:`_matrix_fingerprint`) can belong to scalar multiples of the same matrix. The tolerance is loose since a match is confirmed by comparing the full matrices. """
+    return fingerprint[0] == other[0] and np.allclose(fingerprint[1], other[1], rtol=1e-8, atol=1e-8)
+
+def _is_2d_matrix(value):
+    """ Check if value is a dense 2D ndarray or a sparse matrix. """
+    return spa.issparse(value) or (isinstance(value, np.ndarray) and value.ndim == 2)
+
+def _matrix_pivot(data):
+    """ Index of the largest (absolute) entry of the data of a (dense or csr) matrix (see :func:`_matrix_fingerprint`). None if the matrix is zero. """
+    if data.size == 0:
+        return None
+    pivot = int(np.argmax(np.abs(data)))
+    return pivot if data[pivot] != 0 else None
+
+def _scale_factor(value, matrix, pivot):
+    """ Return c such that value = c*matrix (up to rounding), or None if value is not a scalar multiple of matrix. """
+    if value.shape != matrix.shape or spa.issparse(value) != spa.issparse(matrix):
+        return None
+    if spa.issparse(value):
+        value = value.tocsr()
+        if not value.has_sorted_indices:
+            value = value.sorted_indices()
+        if value.nnz != matrix.nnz or not (np.array_equal(value.indptr, matrix.indptr) and np.array_equal(value.indices, matrix.indices)):
+            return None
+        value, matrix = value.data, matrix.data
+    else:
+        value, matrix = value.ravel(), matrix.ravel()
+    c = value[pivot]/matrix[pivot]
+    if c == 0 or not np.isfinite(c):
+        return None
+    if not np.allclose(value, c*matrix, rtol=1e-12, atol=0):
+        return None
+    return c
+
+def _rescale_factorization(kind, factorization, c, value):
+    """ Factorization of c*M given the factorization of M (as returned by the get_sqrtprec_from_* functions). """
+    if c == 1 and kind != 'sqrtprec':
+        return factorization
+    if kind == 'cov':
+        prec, sqrtprec, logdet, rank = factorization
+        logdet = None if logdet is None else logdet + rank*np.log(c)
+        return prec/c, sqrtprec/np.sqrt(c), logdet, rank
+    if kind == 'prec':
+        sqrtprec, logdet, rank = factorization
+        logdet = None if logdet is None else logdet - rank*np.log(c)
+        return sqrtprec*np.sqrt(c), logdet, rank
+    if kind == 'sqrtcov':
+        prec, sqrtprec, logdet, rank = factorization
+        a = abs(c)
+        logdet = None if logdet is None else logdet + 2*rank*np.log(a)
+        return prec/a**2, sqrtprec/a, logdet, rank
+    if kind == 'sqrtprec':
+        sqrtprec, logdet, rank = factorization
+        logdet = None if logdet is None else logdet - 2*rank*np.log(abs(c))
+        # 2D matrices given as sqrtprec are stored as is (see get_sqrtprec_from_sqrtprec)
+        return value, logdet, rank
+    raise ValueError(f"Unknown matrix kind {kind}.")
+
 def get_sqrtprec_from_cov(dim, cov, sparse_flag):
     """ Compute square root of precision matrix from covariance matrix.
     
@@ -165,9 +165,13 @@ class GMRF(Distribution):
         self._prec = value
 
     def logpdf(self, x):
-        mean = self.mean
+        dev = x-self.mean
+        return self._logpdf_from_dev(dev, self._prec_op @ dev)
+
+    def _logpdf_from_dev(self, dev, prec_dev):
+        """ logpdf given the deviation from the mean and the precision operator applied to it """
         const = 0.5*(self._rank*(np.log(self.prec)-np.log(2*np.pi)) + self._logdet)
-        return const - 0.5*( self.prec*((x-mean).T @ (self._prec_op @ (x-mean))) )
+        return const - 0.5*( self.prec*(dev.T @ prec_dev) )
 
     def _gradient(self, x):
         #Avoid complicated geometries that change the gradient.
@@ -179,6 +183,15 @@ class GMRF(Distribution):
         else:
             NotImplementedError("Gradient not implemented for mean {}".format(type(self.mean)))
 
+    def _logd_and_gradient(self, x):
+        if self.is_cond or not type(self.geometry) in _get_identity_geometries():
+            return super()._logd_and_gradient(x)
+
+        # Share the precision operator application between logd and gradient
+        dev = x-self.mean
+        prec_dev = self._prec_op @ dev
+        return self._logpdf_from_dev(dev, prec_dev) + self._constant, -self.prec*prec_dev
+
     def _sample(self, N=1, rng=None):
         if (self._bc_type == 'zero'):
 
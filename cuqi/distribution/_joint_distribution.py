@@ -102,6 +102,18 @@ class JointDistribution:
 
         return logd
 
+    def logd_and_gradient(self, *args, **kwargs):
+        """ Evaluate the un-normalized log density function and its gradient.
+
+        Not available for a joint distribution of several parameters, since the densities do not provide
+        gradients with respect to their conditioning variables. Condition the joint distribution on all
+        but one parameter to obtain a density (e.g. a :class:`~cuqi.distribution.Posterior`) with a fused
+        log density and gradient evaluation.
+        """
+        raise NotImplementedError(
+            f"logd_and_gradient is not implemented for {self.__class__.__name__} of the parameters {self.get_parameter_names()}. "
+            "Condition on all but one parameter to obtain a density with a gradient.")
+
     def __call__(self, *args, **kwargs) -> JointDistribution:
         """ Condition the joint distribution on the given variables. """
         return self._condition(*args, **kwargs)
@@ -227,6 +239,17 @@ class JointDistribution:
         density._constant += self._sum_evaluated_densities()
         return density
 
+    def _restrict_to(self, par_name) -> JointDistribution:
+        """ Return a shallow copy of the joint distribution with only the densities that depend on the given parameter.
+
+        When conditioned on all other parameters this is, up to a constant, the full conditional distribution
+        of the parameter since the densities that do not depend on it are constant. The other parameters of the
+        returned joint distribution may not have a distribution, so it should only be used for conditioning.
+        """
+        new_joint = copy(self) # Shallow copy of self
+        new_joint._densities = [density for density in self._densities if par_name in density.get_parameter_names()]
+        return new_joint
+
     def _as_stacked(self) -> _StackedJointDistribution:
         """ Return a stacked JointDistribution with the same densities. """
         return _StackedJointDistribution(*self._densities)
@@ -373,7 +396,16 @@ class MultipleLikelihoodPosterior(JointDistribution, Distribution):
 
     def gradient(self, *args, **kwargs):
         """ Return the gradient of the un-normalized log density function. """
-        return sum(density.gradient(*args, **kwargs) for density in self._densities)      
+        return sum(density.gradient(*args, **kwargs) for density in self._densities)
+
+    def logd_and_gradient(self, *args, **kwargs):
+        """ Return the un-normalized log density function and its gradient sharing computations within each density. """
+        logd, gradient = 0, 0
+        for density in self._densities:
+            density_logd, density_gradient = density.logd_and_gradient(*args, **kwargs)
+            logd += density_logd
+            gradient += density_gradient
+        return logd, gradient
 
     def _sample(self, Ns=1):
         raise TypeError(f"{self.__class__.__name__} does not support direct sampling.")
@@ -1,5 +1,6 @@
 import numpy as np
 from cuqi.geometry import _DefaultGeometry1D, Image2D
+from cuqi import config
 from cuqi.operator import FirstOrderFiniteDifference
 from cuqi.distribution import Distribution
 from cuqi.utilities import force_ndarray
@@ -67,7 +68,8 @@ class LMRF(Distribution):
         else: 
             num_nodes = self.dim
 
-        self._diff_op = FirstOrderFiniteDifference(num_nodes=num_nodes, bc_type=bc_type)
+        matrix_free = self._physical_dim == 2 and self.dim >= config.MIN_DIM_MATRIX_FREE
+        self._diff_op = FirstOrderFiniteDifference(num_nodes=num_nodes, bc_type=bc_type, matrix_free=matrix_free)
 
     @property
     def location(self):
@@ -99,6 +99,16 @@ class Posterior(Distribution):
             
         return self.likelihood.gradient(x)+ self.prior.gradient(x)        
 
+    def _logd_and_gradient(self, x):
+        #Avoid complicated geometries that change the gradient.
+        if not type(self.geometry) in _get_identity_geometries() and\
+           not hasattr(self.geometry, 'gradient'):
+            raise NotImplementedError("Gradient not implemented for distribution {} with geometry {}".format(self,self.geometry))
+
+        logd_likelihood, gradient_likelihood = self.likelihood.logd_and_gradient(x)
+        logd_prior, gradient_prior = self.prior.logd_and_gradient(x)
+        return logd_likelihood + logd_prior + self._constant, gradient_likelihood + gradient_prior
+
     def _sample(self,N=1,rng=None):
         raise Exception("'Posterior.sample' is not defined. Sampling can be performed with the 'sampler' module.")
 
@@ -34,6 +34,10 @@ class Conjugate(Sampler):
     def _initialize(self):
         pass
 
+    def _update_target(self):
+        # The conjugate pair is of the same type for the new target, so only its target is updated
+        self._conjugatepair.target = self.target
+
     @Sampler.target.setter # Overwrite the target setter to set the conjugate pair
     def target(self, value):
         """ Set the target density. Runs validation of the target. """
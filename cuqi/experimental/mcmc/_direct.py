@@ -15,6 +15,9 @@ class Direct(Sampler):
     def _initialize(self):
         pass
 
+    def _update_target(self):
+        pass
+
     def validate_target(self):
         try:
             self.target.sample()
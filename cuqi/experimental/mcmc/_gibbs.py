@@ -1,9 +1,13 @@
 from cuqi.distribution import JointDistribution
 from cuqi.experimental.mcmc import Sampler
+from cuqi.experimental.mcmc._sampler import _ArraySampleStore, _MemmapSampleStore, _BatchHandler
 from cuqi.samples import Samples, JointSamples
-from cuqi.experimental.mcmc import NUTS
-from typing import Dict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
 import numpy as np
+import os
+import time
 import warnings
 
 try:
@@ -36,11 +40,13 @@ class HybridGibbs:
     Gelman et al. "Bayesian Data Analysis" (2014), Third Edition
     for more details.
 
-    In each Gibbs step, the corresponding sampler has the initial_point 
-    and initial_scale (if applicable) set to the value of the previous step
-    and the sampler is reinitialized. This means that the sampling is not 
-    fully stateful at this point. This means samplers like NUTS will lose
-    their internal state between Gibbs steps.
+    The samplers are stateful between Gibbs steps. When the value of a
+    variable changes, the targets of the samplers whose conditional depends
+    on it are updated in place using :meth:`Sampler.update_target`, which
+    keeps the state (e.g. the step size of NUTS) and history of the sampler.
+    The conditional of each variable only includes the densities that depend
+    on the variable, and it is only recomputed if one of the variables it is
+    conditioned on has changed since the last Gibbs step.
 
     Parameters
     ----------
@@ -58,6 +64,28 @@ class HybridGibbs:
         will call its step method in each Gibbs step.
         Default is 1 for all variables.
 
+    executor : str or concurrent.futures.Executor, *optional*
+        How to update conditionally independent variables within a Gibbs step.
+        The variables are grouped into consecutive blocks of variables whose
+        conditionals do not depend on each other (see :attr:`schedule`), e.g.
+        several hyperparameters that each only depend on x.
+        Can be "serial" (default), "thread" to update the variables of each
+        block concurrently on a thread pool, or an executor instance. Since the
+        samplers are updated in place, process pools are not supported. With
+        concurrent updates the samples are not reproducible from the seed.
+
+    max_workers : int, *optional*
+        Maximum number of threads if executor is "thread".
+
+    sample_store : str, *optional*
+        Path of a directory to store the samples in. If given, the samples of each
+        variable are written to a memory-mapped file `<sample_store>/<name>.dat`
+        instead of being kept in memory (see :class:`Sampler`).
+
+    overwrite_sample_store : bool, *optional*
+        If True, existing sample files in `sample_store` are replaced. Otherwise (default)
+        a FileExistsError is raised if a sample file exists.
+
     Example
     -------
     .. code-block:: python
@@ -103,7 +131,7 @@ class HybridGibbs:
             
     """
 
-    def __init__(self, target: JointDistribution, sampling_strategy: Dict[str, Sampler], num_sampling_steps: Dict[str, int] = None):
+    def __init__(self, target: JointDistribution, sampling_strategy: Dict[str, Sampler], num_sampling_steps: Dict[str, int] = None, executor="serial", max_workers=None, sample_store=None, overwrite_sample_store=False):
 
         # Store target and allow conditioning to reduce to a single density
         self.target = target() # Create a copy of target distribution (to avoid modifying the original)
@@ -117,6 +145,17 @@ class HybridGibbs:
         # Store parameter names
         self.par_names = self.target.get_parameter_names()
 
+        # Store how conditionally independent variables are updated
+        if not isinstance(executor, Executor) and executor not in ("serial", "thread"):
+            raise ValueError(f"Executor {executor} not recognized. Use 'serial', 'thread' or a concurrent.futures.Executor.")
+        self.executor = executor
+        self.max_workers = max_workers
+        self._pool = None
+
+        # Store location of samples on disk (if any)
+        self.sample_store = sample_store
+        self.overwrite_sample_store = overwrite_sample_store
+
         # Initialize sampler (after target is set)
         self._initialize()
 
@@ -132,6 +171,15 @@ class HybridGibbs:
         # Allocate samples
         self._allocate_samples()
 
+        # Restrict the target to the conditionals of each parameter
+        self._initialize_conditionals()
+
+        # Group conditionally independent parameters
+        self._initialize_schedule()
+
+        # Time spent updating each parameter
+        self._timings = {par_name: 0.0 for par_name in self.par_names}
+
         # Set targets
         self._set_targets()
 
@@ -149,7 +197,7 @@ class HybridGibbs:
         for sampler in self.samplers.values():
             sampler.validate_target()
 
-    def sample(self, Ns) -> 'HybridGibbs':
+    def sample(self, Ns, thin=1, batch_size=0, sample_path='./CUQI_samples/') -> 'HybridGibbs':
         """ Sample from the joint distribution using Gibbs sampling
 
         Parameters
@@ -157,13 +205,46 @@ class HybridGibbs:
         Ns : int
             The number of samples to draw.
 
+        thin : int, optional
+            Only every thin-th sample is stored, i.e. Ns//thin samples are stored.
+
+        batch_size : int, optional
+            The batch size for saving samples to disk. If 0, no batching is used. If positive, the samples
+            of each variable are saved to disk in batches of the specified size in `<sample_path>/<name>/`
+            (see :meth:`cuqi.samples.Samples.from_batches`).
+
+        sample_path : str, optional
+            The path to save the samples. If not specified, the samples are saved to the current working directory under a folder called 'CUQI_samples'.
+
         """
+        if not isinstance(thin, int) or thin < 1:
+            raise ValueError("thin must be a positive integer.")
 
-        for _ in tqdm(range(Ns), "Sample: "):
+        # Preallocate storage for the samples
+        self._reserve_samples(Ns//thin)
 
-            self.step()
+        # Initialize batch handlers
+        if batch_size > 0:
+            batch_handlers = {par_name: _BatchHandler(batch_size, os.path.join(sample_path, par_name)) for par_name in self.par_names}
 
-            self._store_samples()
+        with self._executor_pool():
+            for idx in tqdm(range(Ns), "Sample: "):
+
+                self.step()
+
+                if (idx + 1) % thin != 0:
+                    continue
+
+                self._store_samples()
+
+                if batch_size > 0:
+                    for par_name in self.par_names:
+                        batch_handlers[par_name].add_sample(self.current_samples[par_name])
+
+        # Write any remaining samples in the last (partial) batches to disk
+        if batch_size > 0:
+            for batch_handler in batch_handlers.values():
+                batch_handler.finalize()
 
         return self
 
@@ -182,70 +263,64 @@ class HybridGibbs:
 
         tune_interval = max(int(tune_freq * Nb), 1)
 
-        for idx in tqdm(range(Nb), "Warmup: "):
+        # Preallocate storage for the samples
+        self._reserve_samples(Nb)
+
+        with self._executor_pool():
+            for idx in tqdm(range(Nb), "Warmup: "):
 
-            self.step()
+                self.step()
 
-            # Tune the sampler at tuning intervals (matching behavior of Sampler class)
-            if (idx + 1) % tune_interval == 0:
-                self.tune(tune_interval, idx // tune_interval) 
-                
-            self._store_samples()
+                # Tune the sampler at tuning intervals (matching behavior of Sampler class)
+                if (idx + 1) % tune_interval == 0:
+                    self.tune(tune_interval, idx // tune_interval) 
+                    
+                self._store_samples()
 
         return self
 
     def get_samples(self) -> Dict[str, Samples]:
         samples_object = JointSamples()
         for par_name in self.par_names:
-            samples_array = np.array(self.samples[par_name]).T
+            store = self._samples[par_name]
+            if isinstance(store, _MemmapSampleStore):
+                samples_array = store.get_array().T # Read-only view of the file
+            else:
+                samples_array = np.array(store.get_array()).T
             samples_object[par_name] = Samples(samples_array, self.target.get_density(par_name).geometry)
         return samples_object
-    
-    def step(self):
-        """ Sequentially go through all parameters and sample them conditionally on each other """
-
-        # Sample from each conditional distribution
-        for par_name in self.par_names:
 
-            # Set target for current parameter
-            self._set_target(par_name)
+    @property
+    def samples(self) -> Dict[str, List[np.ndarray]]:
+        """ The stored samples as a dictionary with a list of samples for each parameter. The lists are
+        copies of the stored samples, use :meth:`get_samples` for the samples as :class:`~cuqi.samples.Samples`. """
+        return {par_name: list(np.array(store.get_array())) for par_name, store in self._samples.items()}
+    
+    @property
+    def schedule(self) -> List[List[str]]:
+        """ The order in which the parameters are updated in each Gibbs step. The parameters are grouped
+        into blocks of parameters that are conditionally independent given the others (their conditionals
+        do not depend on each other), which can be updated concurrently. """
+        return [block[:] for block in self._schedule]
 
-            # Get sampler
-            sampler = self.samplers[par_name]
+    def get_timings(self) -> Dict[str, float]:
+        """ Return the total wall-clock time in seconds spent updating each parameter (conditioning and sampling). """
+        return dict(self._timings)
 
-            # Instead of simply changing the target of the sampler, we reinitialize it.
-            # This is to ensure that all internal variables are set to match the new target.
-            # To return the sampler to the old state and history, we first extract the state and history
-            # before reinitializing the sampler and then set the state and history back to the sampler
+    def step(self):
+        """ Sequentially go through all parameters and sample them conditionally on each other """
 
-            # Extract state and history from sampler
-            if isinstance(sampler, NUTS): # Special case for NUTS as it is not playing nice with get_state and get_history
-                sampler.initial_point = sampler.current_point
+        # Sample from each conditional distribution.
+        # Parameters in the same block are conditionally independent, so they can be sampled concurrently.
+        for block in self._schedule:
+            if self._pool is None or len(block) == 1:
+                points = [self._sample_conditional(par_name) for par_name in block]
             else:
-                sampler_state = sampler.get_state()
-                sampler_history = sampler.get_history()
-
-            # Reinitialize sampler
-            sampler.reinitialize()
+                points = list(self._pool.map(self._sample_conditional, block))
 
-            # Set state and history back to sampler
-            if not isinstance(sampler, NUTS): # Again, special case for NUTS.
-                sampler.set_state(sampler_state)
-                sampler.set_history(sampler_history)
-
-            # Allow for multiple sampling steps in each Gibbs step
-            for _ in range(self.num_sampling_steps[par_name]):
-                # Sampling step
-                acc = sampler.step()
-
-                # Store acceptance rate in sampler (matching behavior of Sampler class Sample method)
-                sampler._acc.append(acc)
-
-            # Extract samples (Ensure even 1-dimensional samples are 1D arrays)
-            if isinstance(sampler.current_point, np.ndarray):
-                self.current_samples[par_name] = sampler.current_point.reshape(-1)
-            else:
-                self.current_samples[par_name] = sampler.current_point
+            # Extract samples
+            for par_name, point in zip(block, points):
+                self._set_current_sample(par_name, point)
 
     def tune(self, skip_len, update_count):
         """ Run a single tuning step on each of the samplers in the Gibbs sampling scheme
@@ -263,11 +338,58 @@ class HybridGibbs:
             self.samplers[par_name].tune(skip_len=skip_len, update_count=update_count)
 
     # ------------ Private methods ------------
+    def _sample_conditional(self, par_name):
+        """ Sample a parameter from its conditional distribution given the current samples and return the new point """
+        start_time = time.perf_counter()
+
+        # Update target for current parameter (if any of the variables it is conditioned on changed)
+        self._set_target(par_name)
+
+        # Get sampler
+        sampler = self.samplers[par_name]
+
+        # Allow for multiple sampling steps in each Gibbs step
+        for _ in range(self.num_sampling_steps[par_name]):
+            # Sampling step
+            acc = sampler.step()
+
+            # Store acceptance rate in sampler (matching behavior of Sampler class Sample method)
+            sampler._acc.append(acc)
+
+        self._timings[par_name] += time.perf_counter() - start_time
+        return sampler.current_point
+
+    def _initialize_schedule(self):
+        """ Group consecutive parameters whose conditionals do not depend on each other into blocks (keeping the order of the parameters) """
+        self._schedule = []
+        for par_name in self.par_names:
+            if self._schedule and not any(name in self._conditioning_variables[par_name] for name in self._schedule[-1]):
+                self._schedule[-1].append(par_name)
+            else:
+                self._schedule.append([par_name])
+
+    @contextmanager
+    def _executor_pool(self):
+        """ Provide the executor used to update conditionally independent parameters concurrently while sampling """
+        if self.executor == "serial":
+            yield
+        elif isinstance(self.executor, Executor):
+            self._pool = self.executor
+            try:
+                yield
+            finally:
+                self._pool = None
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                self._pool = pool
+                try:
+                    yield
+                finally:
+                    self._pool = None
+
     def _initialize_samplers(self):
         """ Initialize samplers """
         for sampler in self.samplers.values():
-            if isinstance(sampler, NUTS):
-                print(f'Warning: NUTS sampler is not fully stateful in HybridGibbs. Sampler will be reinitialized in each Gibbs step.')
             sampler.initialize()
 
     def _initialize_num_sampling_steps(self):
@@ -288,18 +410,58 @@ class HybridGibbs:
             self._set_target(par_name)
 
     def _set_target(self, par_name):
-        """ Set target conditional distribution for a single parameter using the current samples """
-        # Get all other conditional parameters other than the current parameter and update the target
+        """ Set target conditional distribution for a single parameter using the current samples.
+        The target is only updated if any of the parameters it is conditioned on changed since it was last set. """
+        conditioning_versions = {name: self._sample_versions[name] for name in self._conditioning_variables[par_name]}
+        if conditioning_versions == self._target_versions[par_name]:
+            return
+
+        # Condition on the other parameters the conditional depends on and update the target
         # This defines - from a joint p(x,y,z) - the conditional distribution p(x|y,z) or p(y|x,z) or p(z|x,y)
-        conditional_params = {par_name_: self.current_samples[par_name_] for par_name_ in self.par_names if par_name_ != par_name}
-        self.samplers[par_name].target = self.target(**conditional_params)
+        conditional_params = {name: self.current_samples[name] for name in self._conditioning_variables[par_name]}
+        self.samplers[par_name].update_target(self._conditionals[par_name](**conditional_params))
+        self._target_versions[par_name] = conditioning_versions
+
+    def _initialize_conditionals(self):
+        """ Restrict the target to the densities that depend on each parameter and find the parameters each conditional depends on """
+        self._conditionals = {}
+        self._conditioning_variables = {}
+        for par_name in self.par_names:
+            conditional = self.target._restrict_to(par_name)
+            dependencies = set().union(*[density.get_parameter_names() for density in conditional._densities])
+            self._conditionals[par_name] = conditional
+            self._conditioning_variables[par_name] = [name for name in self.par_names if name != par_name and name in dependencies]
+
+        # Versions count the changes of each parameter. The targets record the versions they are conditioned on.
+        self._sample_versions = {par_name: 0 for par_name in self.par_names}
+        self._target_versions = {par_name: None for par_name in self.par_names}
+
+    def _set_current_sample(self, par_name, value):
+        """ Set the current sample of a parameter (ensuring even 1-dimensional samples are 1D arrays) and register if it changed """
+        if isinstance(value, np.ndarray):
+            value = value.reshape(-1)
+        if not np.array_equal(value, self.current_samples[par_name]):
+            self._sample_versions[par_name] += 1
+        self.current_samples[par_name] = value
 
     def _allocate_samples(self):
-        """ Allocate memory for samples """
+        """ Allocate stores for the samples of each parameter (in memory or memory-mapped files on disk) """
+        if self.sample_store is not None:
+            os.makedirs(self.sample_store, exist_ok=True)
         samples = {}
         for par_name in self.par_names:
-            samples[par_name] = []
-        self.samples = samples
+            dim = self.target.get_density(par_name).dim
+            if self.sample_store is None:
+                samples[par_name] = _ArraySampleStore(dim)
+            else:
+                samples[par_name] = _MemmapSampleStore(os.path.join(self.sample_store, f"{par_name}.dat"), dim,
+                                                        overwrite=self.overwrite_sample_store)
+        self._samples = samples
+
+    def _reserve_samples(self, Ns):
+        """ Preallocate space for Ns additional samples of each parameter """
+        for store in self._samples.values():
+            store.reserve(len(store) + Ns)
 
     def _get_initial_points(self):
         """ Get initial points for each parameter """
@@ -315,4 +477,4 @@ class HybridGibbs:
     def _store_samples(self):
         """ Store current samples at index i of samples dict """
         for par_name in self.par_names:
-            self.samples[par_name].append(self.current_samples[par_name])
+            self._samples[par_name].append(self.current_samples[par_name])
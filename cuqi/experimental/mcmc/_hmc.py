@@ -1,5 +1,4 @@
 import numpy as np
-import numpy as np
 from cuqi.experimental.mcmc import Sampler
 from cuqi.array import CUQIarray
 from numbers import Number
@@ -192,6 +191,10 @@ class NUTS(Sampler):
         except:
             raise ValueError('Target must have logd and gradient methods.')
 
+    def _update_target(self):
+        # Keep the (adapted) step size and only update the target at the current point
+        self.current_target_logd, self.current_target_grad = self._nuts_target(self.current_point)
+
     def reinitialize(self):
         # Call the parent reset method
         super().reinitialize()
@@ -224,13 +227,15 @@ class NUTS(Sampler):
         Ham = logd_k - self._Kfun(r_k, 'eval') # Hamiltonian
 
         # slice variable
-        log_u = Ham - np.random.exponential(1, size=1)
+        log_u = (Ham - np.random.exponential(1, size=1)).item()
 
         # initialization
+        # (the leapfrog steps create new arrays, so the trajectory points are
+        # never modified in place and need not be copied)
         j, s, n = 0, 1, 1
-        point_minus, point_plus = point_k.copy(), point_k.copy()
-        grad_minus, grad_plus = grad_k.copy(), grad_k.copy()
-        r_minus, r_plus = r_k.copy(), r_k.copy()
+        point_minus, point_plus = point_k, point_k
+        grad_minus, grad_plus = grad_k, grad_k
+        r_minus, r_plus = r_k, r_k
 
         # run NUTS
         acc = 0
@@ -240,13 +245,13 @@ class NUTS(Sampler):
 
             # build tree: doubling procedure
             if (v == -1):
-                point_minus, r_minus, grad_minus, _, _, _, \
+                point_minus, r_minus, grad_minus, \
                     point_prime, logd_prime, grad_prime,\
                         n_prime, s_prime, alpha, n_alpha = \
                             self._BuildTree(point_minus, r_minus, grad_minus,
                                             Ham, log_u, v, j, self._epsilon)
             else:
-                _, _, _, point_plus, r_plus, grad_plus, \
+                point_plus, r_plus, grad_plus, \
                     point_prime, logd_prime, grad_prime,\
                         n_prime, s_prime, alpha, n_alpha = \
                             self._BuildTree(point_plus, r_plus, grad_plus,
@@ -258,14 +263,9 @@ class NUTS(Sampler):
                 (np.random.rand() <= alpha2) and \
                 (not np.isnan(logd_prime)) and \
                 (not np.isinf(logd_prime)):
-                self.current_point = point_prime.copy()
-                # copy if array, else assign if scalar
-                self.current_target_logd = (
-                        logd_prime.copy()
-                        if isinstance(logd_prime, np.ndarray)
-                        else logd_prime
-                    )
-                self.current_target_grad = grad_prime.copy()
+                self.current_point = point_prime
+                self.current_target_logd = logd_prime
+                self.current_target_grad = grad_prime
                 acc = 1
 
 
@@ -307,7 +307,7 @@ class NUTS(Sampler):
 
     #=========================================================================
     def _nuts_target(self, x): # returns logposterior tuple evaluation-gradient
-        return self.target.logd(x), self.target.gradient(x)
+        return self.target.logd_and_gradient(x)
 
     #=========================================================================
     # auxiliary standard Gaussian PDF: kinetic energy function
@@ -365,18 +365,33 @@ class NUTS(Sampler):
     #=========================================================================
     def _BuildTree(
             self, point_k, r, grad, Ham, log_u, v, j, epsilon, Delta_max=1000):
-        # Increment the number of tree nodes counter
-        self._num_tree_node += 1
+        """Build a tree of depth j by (up to) 2**j leapfrog steps in direction v.
+
+        This is an iterative version of the recursive BuildTree of Hoffman and
+        Gelman (2014). The leaves are computed one at a time and each subtree
+        waits in a slot for its level until its sibling is complete. Subtrees
+        are merged in the same order as in the recursion, so the same random
+        numbers are used.
+
+        Returns the edge of the tree in direction v (point, momentum and
+        gradient), the proposal (point, logd and gradient), the number of
+        points in the slice, the stopping indicator and the sum and number of
+        acceptance probabilities.
+        """
+        # Subtrees waiting for their sibling, one slot per level. A subtree is
+        # (first point, first momentum, proposal point, proposal logd,
+        # proposal gradient, n, s, alpha, n_alpha)
+        waiting = [None]*(j+1)
+        epsilon = v*epsilon
+
+        for k in range(2**j):
+            # Count the nodes of the recursion started by this leaf: the leaf
+            # and the subtrees of which it is the first leaf
+            self._num_tree_node += 1 + (j if k == 0 else (k & -k).bit_length()-1)
 
-        if (j == 0):     # base case
             # single leapfrog step in the direction v
-            point_prime, r_prime, logd_prime, grad_prime = self._Leapfrog(
-                point_k, r, grad, v*epsilon)
-            Ham_prime = logd_prime - self._Kfun(r_prime, 'eval') # Hamiltonian
-                                                                 # eval
-            n_prime = int(log_u <= Ham_prime)     # if particle is in the slice
-            s_prime = int(log_u < Delta_max + Ham_prime)     # check U-turn
-            #
+            point_k, r, logd, grad = self._Leapfrog(point_k, r, grad, epsilon)
+            Ham_prime = (logd - self._Kfun(r, 'eval')).item() # Hamiltonian eval (scalar)
             diff_Ham = Ham_prime - Ham
 
             # Compute the acceptance probability
@@ -384,56 +399,59 @@ class NUTS(Sampler):
             # written in a stable way to avoid overflow when computing
             # exp(diff_Ham) for large values of diff_Ham
             alpha_prime = 1 if diff_Ham > 0 else np.exp(diff_Ham)
-            n_alpha_prime = 1
-            #
-            point_minus, point_plus = point_prime, point_prime
-            r_minus, r_plus = r_prime, r_prime
-            grad_minus, grad_plus = grad_prime, grad_prime
-        else: 
-            # recursion: build the left/right subtrees
-            point_minus, r_minus, grad_minus, point_plus, r_plus, grad_plus, \
-                point_prime, logd_prime, grad_prime,\
-                    n_prime, s_prime, alpha_prime, n_alpha_prime = \
-                        self._BuildTree(point_k, r, grad,
-                                        Ham, log_u, v, j-1, epsilon)
-            if (s_prime == 1): # do only if the stopping criteria does not 
-                               # verify at the first subtree
-                if (v == -1):
-                    point_minus, r_minus, grad_minus, _, _, _, \
-                        point_2prime, logd_2prime, grad_2prime,\
-                            n_2prime, s_2prime, alpha_2prime, n_alpha_2prime = \
-                                self._BuildTree(point_minus, r_minus, grad_minus,
-                                                Ham, log_u, v, j-1, epsilon)
-                else:
-                    _, _, _, point_plus, r_plus, grad_plus, \
-                        point_2prime, logd_2prime, grad_2prime,\
-                            n_2prime, s_2prime, alpha_2prime, n_alpha_2prime = \
-                                self._BuildTree(point_plus, r_plus, grad_plus,
-                                                Ham, log_u, v, j-1, epsilon)
-
-                # Metropolis step
-                alpha2 = n_2prime / max(1, (n_prime + n_2prime))
-                if (np.random.rand() <= alpha2):
-                    point_prime = point_2prime.copy()
-                    # copy if array, else assign if scalar
-                    logd_prime = (
-                        logd_2prime.copy()
-                        if isinstance(logd_2prime, np.ndarray)
-                        else logd_2prime
-                    )
-                    grad_prime = grad_2prime.copy()
-
-                # update number of particles and stopping criterion
-                alpha_prime += alpha_2prime
-                n_alpha_prime += n_alpha_2prime
-                dpoints = point_plus - point_minus
-                s_prime = s_2prime *\
-                    int((dpoints@r_minus.T)>=0) * int((dpoints@r_plus.T)>=0)
-                n_prime += n_2prime
-
-        return point_minus, r_minus, grad_minus, point_plus, r_plus, grad_plus,\
-            point_prime, logd_prime, grad_prime,\
-                n_prime, s_prime, alpha_prime, n_alpha_prime
+            tree = (point_k, r, point_k, logd, grad,
+                    int(log_u <= Ham_prime), # if particle is in the slice
+                    int(log_u < Delta_max + Ham_prime), # check U-turn
+                    alpha_prime, 1)
+
+            # Merge with the waiting subtrees
+            level = 0
+            while level < j:
+                if waiting[level] is not None:
+                    # the tree is the second subtree at this level
+                    tree = self._MergeTrees(waiting[level], tree, point_k, r, v)
+                    waiting[level] = None
+                elif tree[6] == 1:
+                    # the tree is the first subtree, build its sibling next
+                    waiting[level] = tree
+                    break
+                # else the stopping criteria is verified at the first subtree
+                # so its sibling is not built
+                level += 1
+
+            if level == j:
+                break
+
+        return point_k, r, grad, tree[2], tree[3], tree[4],\
+            tree[5], tree[6], tree[7], tree[8]
+
+    def _MergeTrees(self, tree, tree_2, point_last, r_last, v):
+        """Merge subtree tree_2 (ending at point_last with momentum r_last) into the adjacent subtree tree built before it"""
+        point_first, r_first, point_prime, logd_prime, grad_prime,\
+            n_prime, _, alpha_prime, n_alpha_prime = tree
+        _, _, point_2prime, logd_2prime, grad_2prime,\
+            n_2prime, s_2prime, alpha_2prime, n_alpha_2prime = tree_2
+
+        # Metropolis step
+        alpha2 = n_2prime / max(1, (n_prime + n_2prime))
+        if (np.random.rand() <= alpha2):
+            point_prime, logd_prime, grad_prime = \
+                point_2prime, logd_2prime, grad_2prime
+
+        # update number of particles and stopping criterion
+        if v == 1:
+            point_minus, r_minus = point_first, r_first
+            point_plus, r_plus = point_last, r_last
+        else:
+            point_minus, r_minus = point_last, r_last
+            point_plus, r_plus = point_first, r_first
+        dpoints = point_plus - point_minus
+        s_prime = s_2prime *\
+            int((dpoints@r_minus.T)>=0) * int((dpoints@r_plus.T)>=0)
+
+        return point_first, r_first, point_prime, logd_prime, grad_prime,\
+            n_prime + n_2prime, s_prime, alpha_prime + alpha_2prime,\
+                n_alpha_prime + n_alpha_2prime
 
     #=========================================================================
     #======================== Diagnostic methods =============================
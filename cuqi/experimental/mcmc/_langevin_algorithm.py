@@ -71,8 +71,12 @@ class ULA(Sampler): # Refactor to Proposal-based sampler?
 
     def _initialize(self):
         self.scale = self.initial_scale
-        self.current_target_logd = self.target.logd(self.current_point)
-        self.current_target_grad = self.target.gradient(self.current_point)
+        self.current_target_logd, self.current_target_grad = \
+            self.target.logd_and_gradient(self.current_point)
+
+    def _update_target(self):
+        self.current_target_logd, self.current_target_grad = \
+            self.target.logd_and_gradient(self.current_point)
 
     def validate_target(self):
         try:
@@ -118,7 +122,7 @@ class ULA(Sampler): # Refactor to Proposal-based sampler?
         x_star = self.current_point + 0.5*self.scale*self.current_target_grad + xi
 
         # evaluate target
-        target_eval_star, target_grad_star = self.target.logd(x_star), self.target.gradient(x_star)
+        target_eval_star, target_grad_star = self.target.logd_and_gradient(x_star)
 
         # accept or reject proposal
         acc = self._accept_or_reject(x_star, target_eval_star, target_grad_star)
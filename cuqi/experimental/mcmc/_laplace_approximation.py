@@ -61,6 +61,9 @@ class UGLA(Sampler):
     def _initialize(self):
         self._precompute()
 
+    def _update_target(self):
+        self._precompute()
+
     @property
     def prior(self):
         return self.target.prior
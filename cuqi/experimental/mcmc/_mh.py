@@ -1,6 +1,8 @@
 import numpy as np
 import cuqi
 from cuqi.experimental.mcmc import ProposalBasedSampler
+from cuqi.experimental.mcmc._sampler import _batched_logd, _ensemble_initial_points, tqdm
+from cuqi.samples import Samples
 
 
 class MH(ProposalBasedSampler):
@@ -66,6 +68,61 @@ class MH(ProposalBasedSampler):
         
         return acc
 
+    def sample_ensemble(self, Ns, n_chains, initial_points=None):
+        """ Sample an ensemble of independent chains advanced simultaneously.
+
+        The chains are stored as a (dim, n_chains) array. In each step a proposal is drawn for all
+        chains at once, the target is evaluated on all proposals at once and the accept/reject is
+        done for all chains at once. For posteriors with Gaussian likelihood and prior and a
+        matrix-based linear model the target evaluation is a single matrix-matrix product.
+
+        The current scale of the sampler is used for all chains (e.g. as tuned by :meth:`warmup`).
+        The state and history of the sampler are not modified.
+
+        Parameters
+        ----------
+        Ns : int
+            The number of samples to draw in each chain.
+
+        n_chains : int
+            The number of chains in the ensemble.
+
+        initial_points : array-like, optional
+            Initial points of shape (dim, n_chains). If not given, all chains start at the current point of the sampler.
+
+        Returns
+        -------
+        List of :class:`cuqi.samples.Samples`, one for each chain.
+
+        """
+        self._ensure_initialized()
+
+        points = _ensemble_initial_points(self, n_chains, initial_points)
+        target_logds = _batched_logd(self.target, points)
+        samples = np.empty((self.dim, n_chains, Ns))
+        acc_count = np.zeros(n_chains)
+
+        pbar = tqdm(range(Ns), "Sample ensemble: ")
+        for idx in pbar:
+            # propose states for all chains
+            xi = np.reshape(self.proposal._sample(N=n_chains), (self.dim, n_chains))
+            points_star = points + self.scale*xi
+
+            # evaluate target for all chains
+            target_logds_star = _batched_logd(self.target, points_star)
+
+            # accept/reject for all chains
+            log_u = np.log(np.random.rand(n_chains))
+            acc = (log_u <= np.minimum(0, target_logds_star - target_logds)) & np.isfinite(target_logds_star)
+            points[:, acc] = points_star[:, acc]
+            target_logds[acc] = target_logds_star[acc]
+
+            samples[:, :, idx] = points
+            acc_count += acc
+            pbar.set_postfix_str(f"acc rate: {np.mean(acc_count)/(idx+1):.2%}")
+
+        return [Samples(samples[:, k, :], self.target.geometry) for k in range(n_chains)]
+
     def tune(self, skip_len, update_count):
         hat_acc = np.mean(self._acc[-skip_len:])
 
@@ -1,7 +1,9 @@
 import numpy as np
 import cuqi
 from cuqi.experimental.mcmc import Sampler
+from cuqi.experimental.mcmc._sampler import _batched_logd, _ensemble_initial_points, tqdm
 from cuqi.array import CUQIarray
+from cuqi.samples import Samples
 
 class PCN(Sampler):  # Refactor to Proposal-based sampler?
 
@@ -21,6 +23,9 @@ class PCN(Sampler):  # Refactor to Proposal-based sampler?
         self.lambd = self.scale
         self.star_acc = 0.44 #TODO: 0.234 # target acceptance rate
 
+    def _update_target(self):
+        self.current_likelihood_logd = self._loglikelihood(self.current_point)
+
     def validate_target(self):
         if not isinstance(self.target, cuqi.distribution.Posterior):
             raise ValueError(f"To initialize an object of type {self.__class__}, 'target' need to be of type 'cuqi.distribution.Posterior'.")
@@ -49,6 +54,61 @@ class PCN(Sampler):  # Refactor to Proposal-based sampler?
         
         return acc
 
+    def sample_ensemble(self, Ns, n_chains, initial_points=None):
+        """ Sample an ensemble of independent chains advanced simultaneously.
+
+        The chains are stored as a (dim, n_chains) array. In each step the prior is sampled for all
+        chains at once, the likelihood is evaluated on all proposals at once and the accept/reject is
+        done for all chains at once. For Gaussian likelihoods of matrix-based linear models the
+        likelihood evaluation is a single matrix-matrix product.
+
+        The current scale of the sampler is used for all chains (e.g. as tuned by :meth:`warmup`).
+        The state and history of the sampler are not modified.
+
+        Parameters
+        ----------
+        Ns : int
+            The number of samples to draw in each chain.
+
+        n_chains : int
+            The number of chains in the ensemble.
+
+        initial_points : array-like, optional
+            Initial points of shape (dim, n_chains). If not given, all chains start at the current point of the sampler.
+
+        Returns
+        -------
+        List of :class:`cuqi.samples.Samples`, one for each chain.
+
+        """
+        self._ensure_initialized()
+
+        points = _ensemble_initial_points(self, n_chains, initial_points)
+        likelihood_logds = _batched_logd(self.likelihood, points)
+        samples = np.empty((self.dim, n_chains, Ns))
+        acc_count = np.zeros(n_chains)
+
+        pbar = tqdm(range(Ns), "Sample ensemble: ")
+        for idx in pbar:
+            # propose states for all chains
+            xi = np.reshape(self.prior._sample(N=n_chains), (self.dim, n_chains))
+            points_star = np.sqrt(1-self.scale**2)*points + self.scale*xi
+
+            # evaluate likelihood for all chains
+            likelihood_logds_star = _batched_logd(self.likelihood, points_star)
+
+            # accept/reject for all chains
+            log_u = np.log(np.random.rand(n_chains))
+            acc = log_u <= np.minimum(0, likelihood_logds_star - likelihood_logds)
+            points[:, acc] = points_star[:, acc]
+            likelihood_logds[acc] = likelihood_logds_star[acc]
+
+            samples[:, :, idx] = points
+            acc_count += acc
+            pbar.set_postfix_str(f"acc rate: {np.mean(acc_count)/(idx+1):.2%}")
+
+        return [Samples(samples[:, k, :], self.target.geometry) for k in range(n_chains)]
+
     @property
     def prior(self):
         return self.target.prior
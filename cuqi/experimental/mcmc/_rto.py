@@ -3,7 +3,9 @@ from scipy.linalg.interpolative import estimate_spectral_norm
 from scipy.sparse.linalg import LinearOperator as scipyLinearOperator
 import numpy as np
 import cuqi
-from cuqi.solver import CGLS, FISTA
+from cuqi.solver import CGLS, PCGLS, FISTA
+from cuqi.utilities import _PreparedLinearSolver
+from cuqi.solver._solver import _incomplete_normal_factor, _NormalEquationsSolver
 from cuqi.experimental.mcmc import Sampler
 
 
@@ -36,6 +38,21 @@ class LinearRTO(Sampler):
     tol : float
         Tolerance of the inner CGLS solver. *Optional*.
 
+    preconditioner : str, ndarray or sparse matrix
+        (Right) preconditioner P of the inner least squares solver, which then becomes PCGLS. *Optional*.
+        A good preconditioner satisfies P^T@P ≈ M^T@M, where M is the stacked (whitened) system matrix.
+        Can be "prior" to use the square root of the prior precision, "incomplete" to use an incomplete
+        factorization of M^T@M or a square matrix. The preconditioner is factorized once and reused in
+        every step. If None (default), CGLS is used without preconditioning. Only used if solver is "cgls".
+
+    solver : str
+        Solver of the least squares problem in each step. *Optional*.
+        "cgls" (default) uses the iterative (P)CGLS solver warm-started at the current point.
+        "cholesky" factorizes the normal matrix M^T@M once (requires M to be assembled, so it is
+        intended for moderately sized problems) such that each step is two triangular solves.
+        The samples are then exact and independent, and :meth:`sample_block` can be used to
+        draw many samples at once.
+
     callback : callable, *Optional*
         If set this function will be called after every sample.
         The signature of the callback function is `callback(sample, sample_index)`,
@@ -43,16 +60,41 @@ class LinearRTO(Sampler):
         An example is shown in demos/demo31_callback.py.
         
     """
-    def __init__(self, target=None, initial_point=None, maxit=10, tol=1e-6, **kwargs):
+
+    _HISTORY_KEYS = Sampler._HISTORY_KEYS.union({'_num_iterations'})
+
+    def __init__(self, target=None, initial_point=None, maxit=10, tol=1e-6, preconditioner=None, solver="cgls", **kwargs):
 
         super().__init__(target=target, initial_point=initial_point, **kwargs)
 
         # Other parameters
         self.maxit = maxit
         self.tol = tol
+        self.preconditioner = preconditioner
+        self.solver = solver
 
     def _initialize(self):
         self._precompute()
+        self._direct_solver = self._prepare_direct_solver()
+        self._precond = self._prepare_preconditioner() if self._direct_solver is None else None
+        self._num_iterations = []
+
+    def _update_target(self):
+        operators = self._operators
+        self._precompute()
+        if not _same_operators(operators, self._operators):
+            self._update_operator()
+
+    def _update_operator(self):
+        """ Update the precomputations that depend on M after it has changed with the target.
+        The preconditioner only affects the convergence of the iterative solver and is kept. """
+        if self._direct_solver is not None:
+            self._direct_solver = self._prepare_direct_solver()
+
+    @property
+    def num_iterations(self):
+        """ Number of iterations of the inner least squares solver in each step. """
+        return np.array(self._num_iterations, dtype=int)
 
     @property
     def prior(self):
@@ -84,6 +126,7 @@ class LinearRTO(Sampler):
 
         # pre-computations
         self.n = self.prior.dim
+        self._operators = (L1, L2, [likelihood.model for likelihood in self.likelihoods])
         self.b_tild = np.hstack([L@likelihood.data for (L, likelihood) in zip(L1, self.likelihoods)]+ [L2mu]) 
 
         callability = [callable(likelihood.model) for likelihood in self.likelihoods]
@@ -112,13 +155,89 @@ class LinearRTO(Sampler):
         else:
             raise TypeError("All likelihoods need to be callable or none need to be callable.")
 
+    def _prepare_direct_solver(self):
+        """ Factorize the normal matrix once if the direct solver is requested. """
+        if self.solver.lower() == "cgls":
+            return None
+        if self.solver.lower() == "cholesky":
+            return _NormalEquationsSolver(self._assemble_M())
+        raise ValueError(f"Solver {self.solver} not recognized. Use 'cgls' or 'cholesky'.")
+
+    def _prepare_preconditioner(self):
+        """ Factorize the preconditioner once such that it can be reused in every step. """
+        if self.preconditioner is None:
+            return None
+        if isinstance(self.preconditioner, str):
+            if self.preconditioner.lower() == "prior":
+                P = self.prior.sqrtprec
+            elif self.preconditioner.lower() == "incomplete":
+                P = _incomplete_normal_factor(self._assemble_M())
+            else:
+                raise ValueError(f"Preconditioner {self.preconditioner} not recognized. Use 'prior', 'incomplete' or a matrix.")
+        else:
+            P = self.preconditioner
+        if np.shape(P) != (self.n, self.n):
+            raise ValueError(f"Preconditioner must be a square matrix of shape {(self.n, self.n)}.")
+        return _PreparedLinearSolver(P)
+
+    def _assemble_M(self):
+        """ Return the stacked matrix M, assembling it from the (linear) likelihood models if M is given as a function. """
+        if not callable(self.M):
+            return self.M
+        L1 = [likelihood.distribution.sqrtprec for likelihood in self.likelihoods]
+        return sp.sparse.vstack([sp.sparse.csr_matrix(L@likelihood.model.get_matrix()) for (L, likelihood) in zip(L1, self.likelihoods)]
+                                + [sp.sparse.csr_matrix(self.prior.sqrtprec)])
+
     def step(self):
         y = self.b_tild + np.random.randn(len(self.b_tild))
-        sim = CGLS(self.M, y, self.current_point, self.maxit, self.tol)            
-        self.current_point, _ = sim.solve()
+        if self._direct_solver is not None:
+            self.current_point = self._direct_solver.solve(y)
+            self._num_iterations.append(0)
+            return 1
+        if self._precond is None:
+            sim = CGLS(self.M, y, self.current_point, self.maxit, self.tol)
+        else:
+            sim = PCGLS(self.M, y, self.current_point, self._precond, self.maxit, self.tol)
+        self.current_point, num_iterations = sim.solve()
+        self._num_iterations.append(num_iterations)
         acc = 1
         return acc
 
+    def sample_block(self, Ns, block_size=None):
+        """ Draw Ns independent samples using block solves with the factorized normal matrix.
+
+        The perturbed right-hand sides of up to `block_size` samples are stacked as columns and solved
+        at once, which replaces Ns matrix-vector products and triangular solves by matrix-matrix ones.
+        The random numbers are drawn in the same order as in :meth:`sample`, so both give the same
+        samples for the same seed. Requires solver="cholesky". The state and history of the sampler
+        are not modified.
+
+        Parameters
+        ----------
+        Ns : int
+            The number of samples to draw.
+
+        block_size : int, optional
+            Maximum number of samples solved for at once. Defaults to :data:`cuqi.config.BATCH_SIZE`.
+
+        Returns
+        -------
+        :class:`cuqi.samples.Samples`
+
+        """
+        self._ensure_initialized()
+        if self._direct_solver is None:
+            raise ValueError("Block sampling requires the direct solver. Use solver='cholesky'.")
+        if block_size is None:
+            block_size = cuqi.config.BATCH_SIZE
+
+        samples = np.empty((self.dim, Ns))
+        for start in range(0, Ns, block_size):
+            end = min(start+block_size, Ns)
+            Y = self.b_tild[:, None] + np.random.randn(end-start, len(self.b_tild)).T
+            samples[:, start:end] = self._direct_solver.solve(Y)
+        return cuqi.samples.Samples(samples, geometry=self.geometry)
+
     def tune(self, skip_len, update_count):
         pass
     
@@ -202,6 +321,10 @@ class RegularizedLinearRTO(LinearRTO):
         super()._initialize()
         self._stepsize = self._choose_stepsize()
 
+    def _update_operator(self):
+        super()._update_operator()
+        self._stepsize = self._choose_stepsize()
+
     @property
     def proximal(self):
         return self.target.prior.proximal
@@ -237,6 +360,26 @@ class RegularizedLinearRTO(LinearRTO):
         y = self.b_tild + np.random.randn(len(self.b_tild))
         sim = FISTA(self.M, y, self.current_point, self.proximal,
                     maxit = self.maxit, stepsize = self._stepsize, abstol = self.abstol, adaptive = self.adaptive)         
-        self.current_point, _ = sim.solve()
+        self.current_point, num_iterations = sim.solve()
+        self._num_iterations.append(num_iterations)
         acc = 1
         return acc
+
+
+def _same_operators(operators, new_operators):
+    """ Check if the operators (likelihood square root precisions, prior square root precision and models) defining M are unchanged. """
+    L1, L2, models = operators
+    new_L1, new_L2, new_models = new_operators
+    return len(L1) == len(new_L1) and \
+        all(model is new_model for (model, new_model) in zip(models, new_models)) and \
+        all(_matrices_equal(L, new_L) for (L, new_L) in zip(L1 + [L2], new_L1 + [new_L2]))
+
+def _matrices_equal(A, B):
+    """ Check if two (dense or sparse) matrices are equal. """
+    if A is B:
+        return True
+    if sp.sparse.issparse(A) or sp.sparse.issparse(B):
+        if not (sp.sparse.issparse(A) and sp.sparse.issparse(B)) or A.shape != B.shape:
+            return False
+        return (A != B).nnz == 0
+    return np.array_equal(A, B)
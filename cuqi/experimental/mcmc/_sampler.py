@@ -3,6 +3,9 @@ import os
 import numpy as np
 import pickle as pkl
 import warnings
+from copy import copy, deepcopy
+from typing import List
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import cuqi
 from cuqi.samples import Samples
 
@@ -19,6 +22,7 @@ class Sampler(ABC):
     Provides a common interface for all samplers. The interface includes methods for sampling, warmup and getting the samples in an object oriented way.
 
     Samples are stored in a list to allow for dynamic growth of the sample set. Returning samples is done by creating a new Samples object from the list of samples.
+    Alternatively, if a `sample_store` path is given, samples are written to a memory-mapped file on disk and returned samples are read lazily from that file.
 
     The sampler maintains sets of state and history keys, which are used for features like checkpointing and resuming sampling.
 
@@ -43,7 +47,7 @@ class Sampler(ABC):
     _HISTORY_KEYS = {'_samples', '_acc'}
     """ Set of keys for the history dictionary. """
 
-    def __init__(self, target:cuqi.density.Density=None, initial_point=None, callback=None):
+    def __init__(self, target:cuqi.density.Density=None, initial_point=None, callback=None, sample_store=None, overwrite_sample_store=False):
         """ Initializer for abstract base class for all samplers.
 
         Any subclassing samplers should simply store input parameters as part of the __init__ method. 
@@ -62,11 +66,24 @@ class Sampler(ABC):
             A function that will be called after each sample is drawn. The function should take two arguments: the sample and the index of the sample.
             The sample is a 1D numpy array and the index is an integer. The callback function is useful for monitoring the sampler during sampling.
 
+        sample_store : str, optional
+            Path of a file to store the samples in. If given, samples are written to a preallocated memory-mapped
+            file (raw float64 array of shape (Ns, dim)) instead of being kept in memory, and :meth:`get_samples`
+            returns samples that are read lazily from the file. Checkpoints record the number of stored samples
+            such that sampling can be resumed (appending to the same file) after :meth:`load_checkpoint`.
+
+        overwrite_sample_store : bool, optional
+            If True, an existing `sample_store` file is replaced when the sampler is (re-)initialized. Otherwise
+            (default) initializing the sampler raises a FileExistsError if the file exists. Samples returned
+            earlier by :meth:`get_samples` remain valid when the file is replaced.
+
         """
 
         self.target = target
         self.initial_point = initial_point
         self.callback = callback
+        self.sample_store = sample_store
+        self.overwrite_sample_store = overwrite_sample_store
         self._is_initialized = False
 
     def initialize(self):
@@ -84,9 +101,10 @@ class Sampler(ABC):
 
         # State variables
         self.current_point = self.initial_point
+        self._initialize_state()
 
         # History variables
-        self._samples = []
+        self._samples = self._create_sample_store()
         self._acc = [ 1 ] # TODO. Check if we need to put 1 here.
 
         self._initialize() # Subclass specific initialization
@@ -95,6 +113,10 @@ class Sampler(ABC):
 
         self._is_initialized = True
 
+    def _initialize_state(self):
+        """ Set state variables (other than the current point) that are common to a family of samplers. Called during initialization before the history is allocated and before the subclass specific :meth:`_initialize`. """
+        pass
+
     # ------------ Abstract methods to be implemented by subclasses ------------
     @abstractmethod
     def step(self):
@@ -151,7 +173,10 @@ class Sampler(ABC):
 
     # ------------ Public methods ------------
     def get_samples(self) -> Samples:
-        """ Return the samples. The internal data-structure for the samples is a dynamic list so this creates a copy. """
+        """ Return the samples. The internal data-structure for the samples is a dynamic list so this creates a copy.
+        If the samples are stored in a memory-mapped file (see `sample_store`), the samples are not copied but read lazily from the file. """
+        if isinstance(self._samples, _MemmapSampleStore):
+            return Samples(self._samples.get_array().T, self.target.geometry)
         return Samples(np.array(self._samples).T, self.target.geometry)
     
     def reinitialize(self):
@@ -168,6 +193,43 @@ class Sampler(ABC):
         self._is_initialized = False
 
         self.initialize()
+
+    def update_target(self, target):
+        """ Update the target density while keeping the state and history of the sampler.
+
+        This is used when the target changes between steps, e.g. the conditional distributions in
+        :class:`HybridGibbs`. The new target is assumed to be of the same form as the current one
+        (e.g. the same conditional with new values of the conditioning variables), so it is only
+        validated if the sampler is not initialized yet. For an initialized sampler the quantities
+        that depend on the target are updated by :meth:`_update_target`, while precomputations
+        that remain valid are kept.
+
+        Parameters
+        ----------
+        target : cuqi.density.Density
+            The new target density.
+
+        """
+        if not self._is_initialized:
+            self.target = target
+            return
+        self._target = target
+        self._update_target()
+
+    def _update_target(self):
+        """ Update the target dependent quantities of an initialized sampler after the target has changed.
+        Defaults to re-initializing the sampler with the new target and restoring its state and history.
+        Samplers should override this with a cheaper update where possible. """
+        state = self.get_state()
+        history = self.get_history()
+        # The sample store is restored with the history, so no new store (file) is created
+        sample_store, self.sample_store = self.sample_store, None
+        try:
+            self.reinitialize()
+        finally:
+            self.sample_store = sample_store
+        self.set_state(state)
+        self.set_history(history)
     
     def save_checkpoint(self, path):
         """ Save the state of the sampler to a file. """
@@ -181,6 +243,11 @@ class Sampler(ABC):
             if isinstance(value, cuqi.array.CUQIarray):
                 state['state'][key] = value.to_numpy()
 
+        # Record where and how many samples are stored on disk such that sampling can be resumed
+        if isinstance(self._samples, _MemmapSampleStore):
+            self._samples.flush()
+            state['sample_store'] = {'path': self._samples.path, 'Ns': len(self._samples)}
+
         with open(path, 'wb') as handle:
             pkl.dump(state, handle, protocol=pkl.HIGHEST_PROTOCOL)
 
@@ -192,9 +259,15 @@ class Sampler(ABC):
         with open(path, 'rb') as handle:
             state = pkl.load(handle)
 
+        # Resume storing samples in the memory-mapped file (discarding samples stored after the checkpoint)
+        sample_store = state.pop('sample_store', None)
+        if sample_store is not None:
+            self.sample_store = sample_store['path']
+            self._samples = _MemmapSampleStore(sample_store['path'], self.dim, Ns=sample_store['Ns'])
+
         self.set_state(state)
 
-    def sample(self, Ns, batch_size=0, sample_path='./CUQI_samples/') -> 'Sampler':
+    def sample(self, Ns, batch_size=0, sample_path='./CUQI_samples/', store_samples=True, statistics=None) -> 'Sampler':
         """ Sample Ns samples from the target density.
 
         Parameters
@@ -208,6 +281,15 @@ class Sampler(ABC):
         sample_path : str, optional
             The path to save the samples. If not specified, the samples are saved to the current working directory under a folder called 'CUQI_samples'.
 
+        store_samples : bool, optional
+            If False, the samples and their acceptances are not stored by the sampler (and not returned by :meth:`get_samples`).
+            Useful together with `statistics` (or batching) to sample with memory independent of Ns.
+            The sample index passed to the callback is then the index of the sample within this call.
+
+        statistics : cuqi.samples.OnlineStatistics, optional
+            Online statistics that are updated with each sample, e.g. to compute the mean, credibility intervals
+            and effective sample size without storing the samples.
+
         """
 
         self._ensure_initialized()
@@ -217,25 +299,36 @@ class Sampler(ABC):
             batch_handler = _BatchHandler(batch_size, sample_path)
 
         # Draw samples
+        acc_sum = 0 # Running sum of the acceptance rates of this call
         pbar = tqdm(range(Ns), "Sample: ")
         for idx in pbar:
             
             # Perform one step of the sampler
             acc = self.step()
 
-            # Store samples
-            self._acc.append(acc)
-            self._samples.append(self.current_point)
+            # Store samples (and acceptances, which are otherwise only counted)
+            if store_samples:
+                self._acc.append(acc)
+                self._samples.append(self.current_point)
 
             # display acc rate at progress bar
-            pbar.set_postfix_str(f"acc rate: {np.mean(self._acc[-1-idx:]):.2%}")
+            acc_sum += np.mean(acc)
+            pbar.set_postfix_str(f"acc rate: {acc_sum/(idx+1):.2%}")
 
             # Add sample to batch
             if batch_size > 0:
                 batch_handler.add_sample(self.current_point)
 
+            # Update online statistics
+            if statistics is not None:
+                statistics.update(self.current_point)
+
             # Call callback function if specified            
-            self._call_callback(self.current_point, len(self._samples)-1)
+            self._call_callback(self.current_point, len(self._samples)-1 if store_samples else idx)
+
+        # Write any remaining samples in the last (partial) batch to disk
+        if batch_size > 0:
+            batch_handler.finalize()
                 
         return self
     
@@ -279,7 +372,117 @@ class Sampler(ABC):
             self._call_callback(self.current_point, len(self._samples)-1)
 
         return self
-    
+
+    def sample_chains(self, Ns, n_chains=4, Nb=0, tune_freq=0.1, executor="process", max_workers=None, seed=None, initial_points=None) -> List[Samples]:
+        """ Sample multiple independent chains of the target density in parallel.
+
+        Each chain is run by a fresh copy of this sampler (same target and parameters) that is
+        initialized, warmed up for Nb steps and then sampled for Ns steps. The sampler itself
+        is not modified.
+
+        With a process pool the sampler (and hence its target with read-only data such as the
+        forward matrix and the data vector) is sent once to each worker process and not once per
+        chain, and chains run serially share the target. Chains run in threads each use their own
+        deep copy of the target, since the target holds caches (e.g. of forward model outputs and
+        Gaussian factorizations) and assembled PDE state that must not be shared between threads.
+
+        Parameters
+        ----------
+        Ns : int
+            The number of samples to draw in each chain.
+
+        n_chains : int, optional
+            The number of chains to sample.
+
+        Nb : int, optional
+            The number of warmup (tuning) steps in each chain. Warmup samples are removed from the returned samples.
+
+        tune_freq : float, optional
+            The frequency of tuning during warmup. See :meth:`warmup`.
+
+        executor : str or concurrent.futures.Executor, optional
+            How to run the chains. Can be "process" (default), "thread", "serial" or an executor instance.
+            If the sampler cannot be pickled, "process" falls back to "thread" with a warning.
+
+        max_workers : int, optional
+            Maximum number of workers in the pool. Defaults to the default of the pool type.
+
+        seed : int, optional
+            Seed used to generate an independent seed for each chain. If None, the seed is drawn from
+            the global numpy random state, making the chains reproducible via `np.random.seed`.
+            The chain seeds are only used when the chains run serially or in worker processes (each with
+            their own global random state). Chains run serially restore the global random state of the caller
+            after seeding it for each chain. Chains run in threads share the global random state, which is
+            not reseeded, and are therefore not reproducible.
+
+        initial_points : list of array-like, optional
+            Initial point for each chain. If not given, each chain starts at an independent draw from the
+            prior of the target (or from the target itself if it is a distribution), such that the chains
+            start dispersed as required for a meaningful R-hat. For other targets the initial points must be given.
+
+        Returns
+        -------
+        List of :class:`cuqi.samples.Samples`, one for each chain, e.g. for use in :meth:`cuqi.samples.Samples.compute_rhat`.
+
+        Example
+        -------
+        .. code-block:: python
+
+            sampler = cuqi.experimental.mcmc.MH(target)
+            chains = sampler.sample_chains(Ns=1000, n_chains=4, Nb=500)
+            rhat = chains[0].compute_rhat(chains[1:])
+
+        """
+
+        if self.target is None:
+            raise ValueError("Cannot sample chains without a target density.")
+
+        if initial_points is not None and len(initial_points) != n_chains:
+            raise ValueError(f"Number of initial points ({len(initial_points)}) does not match number of chains ({n_chains}).")
+
+        if initial_points is None and _initial_point_distribution(self.target) is None:
+            raise ValueError("Dispersed initial points can only be drawn for a posterior or distribution target. Provide initial_points for each chain.")
+
+        if seed is None:
+            seed = np.random.randint(0, 2**31-1)
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_chains)]
+
+        if initial_points is None:
+            initial_points = [None]*n_chains
+
+        chain_args = [(Ns, Nb, tune_freq, seeds[i], initial_points[i]) for i in range(n_chains)]
+
+        if isinstance(executor, str) and executor == "process":
+            try:
+                sampler_bytes = pkl.dumps(self, protocol=pkl.HIGHEST_PROTOCOL)
+            except Exception as e:
+                warnings.warn(f"Sampler could not be pickled for a process pool ({e}). Falling back to a thread pool.")
+                executor = "thread"
+
+        if isinstance(executor, str):
+            if executor == "serial":
+                results = [_run_chain(self, *args) for args in chain_args]
+            elif executor == "thread":
+                # Threads share the global random state, so it is not reseeded per chain
+                chain_args = [args[:3] + (None,) + args[4:] for args in chain_args]
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    results = list(pool.map(lambda args: _run_chain(self, *args, copy_target=True), chain_args))
+            elif executor == "process":
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_chain_worker, initargs=(sampler_bytes,)) as pool:
+                    results = list(pool.map(_run_chain_in_worker, chain_args))
+            else:
+                raise ValueError(f"Executor {executor} not recognized. Use 'process', 'thread', 'serial' or a concurrent.futures.Executor.")
+        elif isinstance(executor, Executor):
+            in_threads = not isinstance(executor, ProcessPoolExecutor)
+            if in_threads:
+                chain_args = [args[:3] + (None,) + args[4:] for args in chain_args]
+            futures = [executor.submit(_run_chain, self, *args, copy_target=in_threads) for args in chain_args]
+            results = [future.result() for future in futures]
+        else:
+            raise TypeError("Executor must be a string or a concurrent.futures.Executor.")
+
+        return [Samples(result, self.target.geometry) for result in results]
+
     def get_state(self) -> dict:
         """ Return the state of the sampler. 
 
@@ -367,6 +570,12 @@ class Sampler(ABC):
                 raise ValueError(f"Key {key} not recognized in history dictionary of sampler {self.__class__.__name__}.")
 
     # ------------ Private methods ------------
+    def _create_sample_store(self):
+        """ Create the data-structure in which samples are stored. A list unless a `sample_store` path is given. """
+        if self.sample_store is None:
+            return []
+        return _MemmapSampleStore(self.sample_store, self.dim, overwrite=self.overwrite_sample_store)
+
     def _call_callback(self, sample, sample_index):
         """ Calls the callback function. Assumes input is sample and sample index"""
         if self.callback is not None:
@@ -442,37 +651,15 @@ class ProposalBasedSampler(Sampler, ABC):
         self.proposal = proposal
         self.initial_scale = scale
 
-    def initialize(self):
-        """ Initialize the sampler by setting and allocating the state and history before sampling starts. """
-
-        if self._is_initialized:
-            raise ValueError("Sampler is already initialized.")
-        
-        if self.target is None:
-            raise ValueError("Cannot initialize sampler without a target density.")
-        
-        # Default values
-        if self.initial_point is None:
-            self.initial_point = self._get_default_initial_point(self.dim)
-
+    def _initialize_state(self):
+        """ Set the default proposal, the scale and the target log density at the current point. """
         if self.proposal is None:
             self.proposal = self._default_proposal
-
-        # State variables
-        self.current_point = self.initial_point
         self.scale = self.initial_scale
-
         self.current_target_logd = self.target.logd(self.current_point)
 
-        # History variables
-        self._samples = []
-        self._acc = [ 1 ] # TODO. Check if we need to put 1 here.
-
-        self._initialize() # Subclass specific initialization
-
-        self._validate_initialization()
-
-        self._is_initialized = True
+    def _update_target(self):
+        self.current_target_logd = self.target.logd(self.current_point)
 
     @abstractmethod
     def validate_proposal(self):
@@ -497,6 +684,281 @@ class ProposalBasedSampler(Sampler, ABC):
             self.validate_proposal()
 
 
+def _batched_logd(density, X):
+    """ Evaluate the log density at each column of X (shape (dim, K)) and return an array of shape (K,).
+
+    Posteriors with Gaussian likelihoods of vectorized linear models and Gaussian priors are
+    evaluated in one shot by applying the model and the Gaussian log density to all columns at once. Any other density falls back to evaluating the
+    log density one column at a time.
+    """
+    if isinstance(density, cuqi.distribution.Posterior):
+        return _batched_logd(density.likelihood, X) + _batched_logd(density.prior, X)
+
+    identity_geometries = cuqi.geometry._get_identity_geometries()
+
+    # Gaussian distribution (e.g. prior). _logupdf broadcasts over rows of the input.
+    if type(density) is cuqi.distribution.Gaussian and not density.is_cond and\
+       type(density.geometry) in identity_geometries and density.logdet is not None:
+        return np.asarray(density.logd(X.T)).reshape(-1)
+
+    # Gaussian likelihood of a vectorized linear model. The model is applied to all columns of X at
+    # once and, by symmetry of the Gaussian, the likelihood of the data given mean model(x) equals
+    # the density of the Gaussian with mean at the data evaluated at model(x).
+    if isinstance(density, cuqi.likelihood.Likelihood):
+        distribution = density.distribution
+        model = density.model
+        if type(distribution) is cuqi.distribution.Gaussian and\
+           isinstance(model, cuqi.model.LinearModel) and model.vectorized and\
+           distribution.mean is model and distribution.get_conditioning_variables() == cuqi.utilities.get_non_default_args(model) and\
+           type(model.domain_geometry) in identity_geometries and type(model.range_geometry) in identity_geometries and\
+           distribution.logdet is not None:
+            data_centered = copy(distribution)
+            data_centered.mean = density.data
+            return np.asarray(data_centered.logd(np.asarray(model.forward(X)).T)).reshape(-1)
+
+    return np.array([np.ravel(density.logd(X[:, k]))[0] for k in range(X.shape[1])])
+
+def _ensemble_initial_points(sampler, n_chains, initial_points):
+    """ Return the initial points of an ensemble of chains as an array of shape (dim, n_chains). """
+    if initial_points is None:
+        sampler._ensure_initialized()
+        point = np.asarray(sampler.current_point, dtype=float).reshape(-1, 1)
+        return np.repeat(point, n_chains, axis=1)
+    initial_points = np.asarray(initial_points, dtype=float)
+    if initial_points.shape != (sampler.dim, n_chains):
+        raise ValueError(f"Initial points must have shape {(sampler.dim, n_chains)}, got {initial_points.shape}.")
+    return initial_points.copy()
+
+def _fresh_chain(sampler, copy_target=False):
+    """ Return an uninitialized shallow copy of the sampler that shares the target (and any other read-only attributes) with the original.
+    State and history are set (as new objects) when the copy is initialized. If copy_target is True, the copy uses a deep copy of the
+    target instead, e.g. for chains run in threads that must not share the caches of the target. """
+    chain = copy(sampler)
+    if copy_target:
+        chain._target = deepcopy(sampler.target)
+    chain._is_initialized = False
+    chain.sample_store = None # Chains are returned in memory and must not share a file
+    return chain
+
+def _initial_point_distribution(target):
+    """ Return the distribution that dispersed initial points of chains are drawn from (the prior of a posterior or
+    the target itself if it is a distribution), or None if there is no such distribution. """
+    if isinstance(target, cuqi.distribution.Posterior):
+        target = target.prior
+    if isinstance(target, cuqi.distribution.Distribution) and not target.is_cond:
+        return target
+    return None
+
+def _run_chain(sampler, Ns, Nb, tune_freq, seed, initial_point, copy_target=False):
+    """ Run a single chain using a fresh copy of the sampler (see _fresh_chain) and return the raw samples with warmup removed.
+    Unless seed is None, the global random state is seeded with seed for the chain and restored afterwards. If initial_point is None,
+    the chain starts at a draw from the distribution returned by _initial_point_distribution. """
+    if seed is None:
+        return _run_fresh_chain(sampler, Ns, Nb, tune_freq, initial_point, copy_target)
+    random_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return _run_fresh_chain(sampler, Ns, Nb, tune_freq, initial_point, copy_target)
+    finally:
+        np.random.set_state(random_state)
+
+def _run_fresh_chain(sampler, Ns, Nb, tune_freq, initial_point, copy_target):
+    chain = _fresh_chain(sampler, copy_target)
+    if initial_point is None:
+        try:
+            initial_point = np.asarray(_initial_point_distribution(chain.target).sample(), dtype=float).reshape(-1)
+        except NotImplementedError as e:
+            raise ValueError(f"Could not draw an initial point for the chain ({e}). Provide initial_points for each chain.")
+    chain.initial_point = initial_point
+    if Nb > 0:
+        chain.warmup(Nb, tune_freq=tune_freq)
+    chain.sample(Ns)
+    return chain.get_samples().samples[..., Nb:]
+
+_worker_sampler = None
+""" Sampler template shared by all chains run in a worker process. Set by _init_chain_worker. """
+
+def _init_chain_worker(sampler_bytes):
+    """ Initializer of worker processes. Unpickles the sampler once per worker. """
+    global _worker_sampler
+    _worker_sampler = pkl.loads(sampler_bytes)
+
+def _run_chain_in_worker(args):
+    """ Run a single chain in a worker process using the sampler set by _init_chain_worker. """
+    return _run_chain(_worker_sampler, *args)
+
+
+class _MemmapSampleStore:
+    """ Sample store that writes samples to a memory-mapped file on disk.
+
+    The samples are stored as a raw float64 array of shape (Ns, dim) in C order, i.e. one sample per row
+    such that appending a sample is a contiguous write. The file is preallocated and grown geometrically
+    (in multiples of `chunk_size` samples) as samples are appended. The stored samples can be read back
+    with `np.memmap(path, dtype=np.float64, mode='r', shape=(Ns, dim))`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to store the samples in.
+
+    dim : int
+        Dimension of each sample.
+
+    Ns : int, optional
+        Number of samples already stored in the file, e.g. when resuming from a checkpoint.
+        If 0 (default), a new file is created. Otherwise samples stored after the first Ns are
+        overwritten as new samples are appended.
+
+    chunk_size : int, optional
+        Number of samples to preallocate space for initially.
+
+    overwrite : bool, optional
+        If True and Ns is 0, an existing file at `path` is replaced by a new file. The existing file is
+        removed rather than truncated, so arrays returned by :meth:`get_array` that still map it remain
+        valid. If False (default), a FileExistsError is raised if the file exists.
+
+    """
+
+    def __init__(self, path, dim, Ns=0, chunk_size=1000, overwrite=False):
+        self.path = path
+        self.dim = int(dim)
+        self.chunk_size = max(int(chunk_size), 1)
+        self._Ns = int(Ns)
+        self._data = None
+
+        if self._Ns == 0:
+            if os.path.exists(path):
+                if not overwrite:
+                    raise FileExistsError(f"Sample store file {path} already exists. Pass overwrite=True to replace it.")
+                os.remove(path)
+            open(path, 'xb').close()
+        elif os.path.getsize(path) < self._Ns*self.dim*np.dtype(np.float64).itemsize:
+            raise ValueError(f"Sample store file {path} contains fewer than {self._Ns} samples of dimension {self.dim}.")
+
+        self._allocate(max(self._Ns, self.chunk_size))
+
+    def _allocate(self, capacity):
+        """ Grow the file to hold (at least) `capacity` samples and memory-map it. The file is never shrunk,
+        such that memory-mapped views of the stored samples remain valid. """
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+        row_size = self.dim*np.dtype(np.float64).itemsize
+        capacity = max(capacity, os.path.getsize(self.path)//row_size)
+        with open(self.path, 'r+b') as f:
+            f.truncate(capacity*row_size)
+        self._data = np.memmap(self.path, dtype=np.float64, mode='r+', shape=(capacity, self.dim))
+
+    @property
+    def capacity(self):
+        """ Number of samples the file currently has space for. """
+        return self._data.shape[0]
+
+    def reserve(self, Ns):
+        """ Preallocate space for (at least) Ns samples in total. """
+        if Ns > self.capacity:
+            self._allocate(Ns)
+
+    def append(self, sample):
+        """ Write a sample to the next row of the file, growing the file if it is full. """
+        if self._Ns >= self.capacity:
+            self._allocate(max(2*self.capacity, self._Ns+self.chunk_size))
+        self._data[self._Ns] = np.ravel(sample)
+        self._Ns += 1
+
+    def __len__(self):
+        return self._Ns
+
+    def __getitem__(self, index):
+        return self._data[:self._Ns][index]
+
+    def flush(self):
+        """ Write any pending changes to disk. """
+        self._data.flush()
+
+    def get_array(self):
+        """ Return a read-only memory-mapped view of the stored samples of shape (Ns, dim). Nothing is read into memory. """
+        self.flush()
+        array = self._data[:self._Ns]
+        array.flags.writeable = False
+        return array
+
+    def __getstate__(self):
+        """ Pickle only the location of the samples (not the samples themselves). """
+        if self._data is not None:
+            self.flush()
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if os.path.isfile(self.path):
+            self._allocate(max(self._Ns, self.chunk_size, os.path.getsize(self.path)//(self.dim*np.dtype(np.float64).itemsize)))
+
+class _ArraySampleStore:
+    """ Sample store that keeps samples in a preallocated in-memory array.
+
+    The samples are stored in an array of shape (capacity, dim) with one sample per row. Space can be
+    reserved up front (e.g. when the number of samples to draw is known) and otherwise the array is
+    grown geometrically, so appending does not build a list of arrays that must be copied at the end.
+
+    Parameters
+    ----------
+    dim : int
+        Dimension of each sample.
+
+    chunk_size : int, optional
+        Number of samples to allocate space for when growing an empty store.
+
+    """
+
+    def __init__(self, dim, chunk_size=1000):
+        self.dim = int(dim)
+        self.chunk_size = max(int(chunk_size), 1)
+        self._Ns = 0
+        self._data = np.empty((0, self.dim))
+
+    def _allocate(self, capacity):
+        """ Reallocate the array to hold `capacity` samples (keeping the stored samples). """
+        data = np.empty((capacity, self.dim))
+        data[:self._Ns] = self._data[:self._Ns]
+        self._data = data
+
+    @property
+    def capacity(self):
+        """ Number of samples the array currently has space for. """
+        return self._data.shape[0]
+
+    def reserve(self, Ns):
+        """ Preallocate space for (at least) Ns samples in total. """
+        if Ns > self.capacity:
+            self._allocate(Ns)
+
+    def append(self, sample):
+        """ Write a sample to the next row of the array, growing the array if it is full. """
+        if self._Ns >= self.capacity:
+            self._allocate(max(2*self.capacity, self._Ns+self.chunk_size))
+        self._data[self._Ns] = np.ravel(sample)
+        self._Ns += 1
+
+    def __len__(self):
+        return self._Ns
+
+    def __getitem__(self, index):
+        return self.get_array()[index]
+
+    def flush(self):
+        """ Nothing to flush for in-memory samples. """
+        pass
+
+    def get_array(self):
+        """ Return a read-only view (no copy) of the stored samples of shape (Ns, dim). """
+        view = self._data[:self._Ns].view()
+        view.flags.writeable = False
+        return view
+
+
 class _BatchHandler:
     """ Utility class to handle batching of samples. 
     
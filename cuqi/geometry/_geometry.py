@@ -1,10 +1,13 @@
 from abc import ABC, abstractmethod
 import numpy as np
-import numpy.matlib as matlib
 import matplotlib.pyplot as plt
 import math
+import os
+import hashlib
+import types
+import functools
+import scipy.linalg
 from scipy.fftpack import dst, idst
-import scipy.sparse as sparse
 import operator
 from functools import reduce
 import warnings
@@ -171,6 +174,11 @@ class Geometry(ABC):
 
         return self._plot_envelope(lo_values,hi_values, **kwargs)
 
+    # par2fun (and fun2par) of the geometry accept multiple inputs stacked
+    # along a trailing axis, see _has_batch_map.
+    _batch_par2fun = True
+    _batch_fun2par = False
+
     def par2fun(self, par):
         """The parameter to function map used to map parameters to function values in e.g. plotting."""
         return par
@@ -179,6 +187,38 @@ class Geometry(ABC):
         """The function to parameter map used to map function values back to parameters, if available."""
         raise NotImplementedError("fun2par is not implemented. Must be implemented specifically for each geometry.")
 
+    def _par2fun_batch(self, pars):
+        """Converts a block of parameter vectors of shape (par_dim, N) into a
+        block of function values of shape fun_shape+(N,). If :meth:`par2fun`
+        accepts multiple parameter vectors it is called once for the block,
+        otherwise the parameter vectors are converted one at a time."""
+        N = pars.shape[-1]
+        if _has_batch_map(self, "par2fun"):
+            funvals = np.asarray(self.par2fun(pars.reshape(self.par_shape+(N,))))
+            return funvals.reshape(tuple(self.fun_shape)+(N,))
+        funvals = None
+        for idx in range(N):
+            funval = np.asarray(self.par2fun(pars[:, idx]))
+            if funvals is None:
+                funvals = np.empty(funval.shape+(N,), dtype=funval.dtype)
+            funvals[..., idx] = funval
+        return funvals
+
+    def _fun2par_batch(self, funvals):
+        """Converts a block of N function values stacked along the trailing
+        axis into a block of parameter vectors of shape (par_dim, N). If
+        :meth:`fun2par` accepts multiple function values it is called once
+        for the block, otherwise the function values are converted one at a
+        time."""
+        funvals = np.asarray(funvals)
+        N = funvals.shape[-1]
+        if _has_batch_map(self, "fun2par"):
+            return np.asarray(self.fun2par(funvals)).reshape(self.par_dim, N)
+        pars = np.empty((self.par_dim, N))
+        for idx in range(N):
+            pars[:, idx] = self.fun2par(funvals[..., idx])
+        return pars
+
     def fun2vec(self, funvals):
         """Maps function values to a vector representation of the function values, if available."""
         if self.fun_is_array and len(self.fun_shape) == 1:
@@ -248,6 +288,18 @@ class Geometry(ABC):
         return True
 
 
+def _has_batch_map(geometry, name):
+    """Returns True if the map `name` ("par2fun" or "fun2par") of the geometry
+    accepts multiple inputs stacked along a trailing axis and returns the
+    outputs stacked the same way. This is declared by the class attribute
+    `_batch_par2fun` (or `_batch_fun2par`) of the class implementing the map,
+    such that subclasses overriding the map do not inherit the declaration."""
+    for cls in type(geometry).__mro__:
+        if name in vars(cls):
+            return vars(cls).get("_batch_"+name, False)
+    return False
+
+
 class _WrappedGeometry(Geometry):
     """A class that wraps a given geometry (emulates dynamic
     inheritance from the given geometry).
@@ -329,6 +381,8 @@ class Continuous(Geometry, ABC):
     def grid(self):
         return self._grid
     
+    _batch_fun2par = True
+
     def fun2par(self,funvals):
         return funvals
     
@@ -492,6 +546,9 @@ class Continuous2D(Continuous):
                 axis.set_ylabel(self.axis_labels[1])
             axis.set_aspect('equal')
 
+    _batch_par2fun = True
+    _batch_fun2par = True
+
     def par2fun(self, pars):
         """Converts a parameter vector or multiple parameter vectors into a 2D
          function value or multiple 2D function values."""
@@ -560,6 +617,9 @@ class Image2D(Geometry):
     def funvec_shape(self):
         return self.par_shape
 
+    _batch_par2fun = True
+    _batch_fun2par = True
+
     def par2fun(self, pars):
         # If geometry is only used for visualization, do nothing
         if self.visual_only: return pars
@@ -569,8 +629,10 @@ class Image2D(Geometry):
     def fun2par(self, funvals):
         # If geometry is only used for visualization, do nothing
         if self.visual_only: return funvals
-        # Else, convert image into parameter vector
-        return funvals.ravel(order=self.order) #Maybe use reshape((self.dim,), order=self.order)
+        # Else, convert image (or multiple images) into parameter vector(s)
+        pars = funvals.reshape((self.par_dim, -1), order=self.order)
+        # Return single parameter vector if only one image was given
+        return pars.squeeze(axis=1) if pars.shape[1] == 1 else pars
 
     def vec2fun(self, funvec):
         """Maps function vector representation, if available, to function values."""    
@@ -671,6 +733,8 @@ class Discrete(Geometry):
         tick_ids = np.linspace(0, len(self.variables)-1, n_ticks, dtype=int)
         plt.xticks(tick_ids, [self.variables[i] for i in tick_ids])
 
+    _batch_fun2par = True
+
     def fun2par(self,funvals):
         return funvals
 
@@ -859,6 +923,9 @@ class KLExpansion(Continuous1D):
         else:
             return self._num_modes
 
+    _batch_par2fun = True
+    _batch_fun2par = True
+
     # computes the real function out of expansion coefs
     def par2fun(self, p):
 
@@ -975,13 +1042,17 @@ class KLExpansion_Full(Continuous1D):
     def coefs(self):
         return self._coefs
 
-    # computes the real function out of expansion coefs
+    _batch_par2fun = True
+
+    # computes the real function out of expansion coefs (for a single or
+    # multiple parameter vectors stacked along the trailing axis)
     def par2fun(self,p):
-        freq = np.zeros(self.par_dim)
+        p = np.asarray(p)
+        freq = np.zeros((self.par_dim,)+p.shape[1:])
         m = len(p)
         freq[:m] = p
-        temp = freq*self.coefs
-        real = idst(temp)/2/np.pi
+        temp = (freq.T*self.coefs).T
+        real = idst(temp, axis=0)/2/np.pi
         return self.var*real
     
     def fun2par(self,funvals):
@@ -1009,8 +1080,23 @@ class CustomKL(Continuous1D):
         
     trunc_term : int, default 20% of the number of grid points
         The number of terms to truncate the KL expansion at.
+
+    cache_dir : str, optional
+        Directory in which the computed eigenpairs are stored. If given, the
+        eigenpairs are loaded from this directory when a CustomKL geometry with
+        the same grid, covariance function, standard deviation and truncation
+        is created again. The covariance function is identified by its code,
+        default arguments and the values of the variables it uses (e.g. a
+        correlation length). If these cannot be determined, the eigenpairs are
+        not cached.
+
+    Notes
+    -----
+    The covariance function is first called with arrays of points (evaluated
+    on a mesh of points at once). If this fails or does not return an array of
+    the same shape, it is called for each pair of points.
     """
-    def __init__(self, grid, mean=0, std=1.0, cov_func=None, trunc_term=None, axis_labels=None, **kwargs):
+    def __init__(self, grid, mean=0, std=1.0, cov_func=None, trunc_term=None, axis_labels=None, cache_dir=None, **kwargs):
         super().__init__(grid, axis_labels, **kwargs)
 
         if trunc_term is None:
@@ -1018,11 +1104,12 @@ class CustomKL(Continuous1D):
         self._trunc_term = trunc_term 
         if cov_func is None:
             # Identity covariance function
-            cov_func = lambda x,y: 1.0 if np.isclose(x,y,rtol=1e-10) else 0.0
+            cov_func = lambda x,y: np.isclose(x,y,rtol=1e-10).astype(float)
         
         #self.N = len(self.grid)
         self._mean = mean
         self._std = std
+        self._cache_dir = cache_dir
         self._compute_eigpairs( grid, cov_func, std, trunc_term, int(2*self.par_dim) )
 
     @property
@@ -1049,8 +1136,12 @@ class CustomKL(Continuous1D):
     def par_shape(self):
         return (self.trunc_term,)
 
+    _batch_par2fun = True
+
     def par2fun(self, p):
-        return self.mean + ((self.eigvec@np.diag(np.sqrt(self.eigval))) @ p)
+        p = np.asarray(p)
+        real = (self.eigvec*np.sqrt(self.eigval)) @ p
+        return (real.T + self.mean).T
     
     def fun2par(self,funvals):
         """The function to parameter map used to map function values back to parameters, if available."""
@@ -1066,7 +1157,6 @@ class CustomKL(Continuous1D):
         ### return eigenpairs of an arbitrary 1D correlation kernel
 
         # domain data    
-        n = xnod.size
         a = (xnod[-1] - xnod[0])/2     # scale
         
         # compute the Gauss-Legendre abscissas and weights
@@ -1076,48 +1166,50 @@ class CustomKL(Continuous1D):
         # transform nodes and weights to [0, L]
         xi_s = a*xi + a
         w_s = a*w
+        sqrt_w_s = np.sqrt(w_s)
         
-        # compute diagonal matrix 
-        D = sparse.spdiags(np.sqrt(w_s), 0, N_GL, N_GL).toarray()
-        S1 = matlib.repmat(np.sqrt(w_s).reshape(1, N_GL), N_GL, 1)
-        S2 = matlib.repmat(np.sqrt(w_s).reshape(N_GL, 1), 1, N_GL)
-        S = S1 * S2
-        
-        # compute covariance matrix 
-        Sigma_nu = np.zeros((N_GL, N_GL))
-        for i in range(N_GL):
-            for j in range(N_GL):
-                if i != j:
-                    Sigma_nu[i,j] = C_nu(xi_s[i], xi_s[j])
-                else:
-                    Sigma_nu[i,j] = sigma**2   # correct the diagonal term
-                      
-        # solve the eigenvalue problem
-        A = Sigma_nu * S                             # D_sqrt*Sigma_nu*D_sqrt
-        L, h = np.linalg.eig(A)                         # solve eigenvalue problem
-        # L, h = sp.sparse.linalg.eigsh(A, M, which='LM')   # np.linalg.eig(A)         
-        idx = np.argsort(-np.real(L))                  # index sorting descending
-        
-        # order the results
-        eigval = np.real(L[idx])
-        h = h[:,idx]
+        # Load the eigenpairs if they are cached on disk
+        cache_file = None
+        if self._cache_dir is not None:
+            kernel_key = _kernel_key(C_nu)
+            if kernel_key is None:
+                warnings.warn("The covariance function of CustomKL could not be identified, so the eigenpairs are not cached.")
+            else:
+                key = hashlib.sha256(kernel_key)
+                for array in [np.asarray(xnod, dtype=float), np.array([sigma, M, N_GL], dtype=float)]:
+                    key.update(np.ascontiguousarray(array).tobytes())
+                cache_file = os.path.join(self._cache_dir, f"CustomKL_{key.hexdigest()}.npz")
+                if os.path.isfile(cache_file):
+                    with np.load(cache_file) as cached:
+                        self._eigval, self._eigvec = cached["eigval"], cached["eigvec"]
+                    return
+
+        # compute covariance matrix (correct the diagonal term)
+        Sigma_nu = _evaluate_kernel(C_nu, xi_s, xi_s)
+        np.fill_diagonal(Sigma_nu, sigma**2)
+
+        # Nystrom's interpolation formula uses the covariance matrix on
+        # partition nodes and quadrature nodes
+        Sigma_nu_nodes = _evaluate_kernel(C_nu, xnod, xi_s)
+
+        # solve the symmetric eigenvalue problem for the M largest eigenvalues
+        A = Sigma_nu * np.outer(sqrt_w_s, sqrt_w_s)  # D_sqrt*Sigma_nu*D_sqrt
+        A = (A + A.T)/2                              # symmetrize (round-off)
+        eigval, h = scipy.linalg.eigh(A, subset_by_index=[N_GL-M, N_GL-1])
         
-        # take the M values
-        eigval = eigval[:M]
-        h = np.real(h[:,:M])
+        # order the results descending
+        eigval = eigval[::-1]
+        h = h[:, ::-1]
+
+        # fix the sign of the eigenvectors (largest entry positive)
+        h = h*np.sign(h[np.argmax(np.abs(h), axis=0), np.arange(M)])
         
         # replace for the actual eigenvectors
-        phi = np.linalg.solve(D, h)
+        phi = h/sqrt_w_s[:, np.newaxis]
         
         # Nystrom's interpolation formula
-        # recompute covariance matrix on partition nodes and quadrature nodes
-        Sigma_nu = np.zeros((n, N_GL))
-        for i in range(n):
-            for j in range(N_GL):
-                Sigma_nu[i,j] = C_nu(xnod[i], xi_s[j])
-                          
-        M1 = Sigma_nu * np.matlib.repmat(w_s.reshape(N_GL,1), 1, n).T
-        M2 = phi @ np.diag(1/eigval)
+        M1 = Sigma_nu_nodes * w_s
+        M2 = phi/eigval
         eigvec = M1 @ M2
 
         # normalize eigenvectors (not necessary) integrate to 1
@@ -1128,6 +1220,68 @@ class CustomKL(Continuous1D):
         self._eigval = eigval
         self._eigvec = eigvec
 
+        if cache_file is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            np.savez(cache_file, eigval=eigval, eigvec=eigvec)
+
+
+def _evaluate_kernel(C_nu, x, y):
+    """ Evaluate the covariance kernel C_nu(x[i], y[j]) for all pairs of points. The kernel is evaluated on a mesh of points at once if it supports array input. """
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    try:
+        K = np.asarray(C_nu(X, Y), dtype=float)
+        if K.shape == X.shape:
+            return K
+    except Exception:
+        pass
+    return np.vectorize(C_nu, otypes=[float])(X, Y)
+
+
+def _kernel_key(C_nu):
+    """ Bytes identifying the covariance kernel C_nu by its code, default arguments and the values of the variables it uses. Returns None if the kernel cannot be identified this way. """
+    try:
+        return repr(_kernel_key_parts(C_nu, depth=0)).encode()
+    except TypeError:
+        return None
+
+def _kernel_key_parts(value, depth):
+    if depth > 10:
+        raise TypeError("Kernel references are nested too deeply to be identified.")
+    depth += 1
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        return (type(value).__name__, repr(value))
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.dtype.str, value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, (tuple, list)):
+        return (type(value).__name__, tuple(_kernel_key_parts(v, depth) for v in value))
+    if isinstance(value, dict):
+        return ("dict", tuple((repr(k), _kernel_key_parts(v, depth)) for k, v in sorted(value.items(), key=lambda item: repr(item[0]))))
+    if isinstance(value, type(np)):
+        return ("module", value.__name__)
+    if isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+        return ("builtin", getattr(value, "__module__", None), value.__name__)
+    if isinstance(value, types.CodeType):
+        return ("code", value.co_code, value.co_names, tuple(_kernel_key_parts(c, depth) for c in value.co_consts))
+    if isinstance(value, functools.partial):
+        return ("partial", _kernel_key_parts(value.func, depth), _kernel_key_parts(value.args, depth), _kernel_key_parts(value.keywords, depth))
+    if isinstance(value, types.FunctionType):
+        code = value.__code__
+        closure = tuple(cell.cell_contents for cell in value.__closure__ or ())
+        global_names = sorted(_code_names(code) & value.__globals__.keys())
+        global_values = {name: value.__globals__[name] for name in global_names}
+        return ("function", _kernel_key_parts(code, depth), _kernel_key_parts(value.__defaults__, depth),
+                _kernel_key_parts(value.__kwdefaults__, depth), _kernel_key_parts(closure, depth),
+                _kernel_key_parts(global_values, depth))
+    raise TypeError(f"Cannot identify kernel component of type {type(value).__name__}.")
+
+def _code_names(code):
+    """ Global and attribute names used by a code object, including nested code objects (e.g. inner lambdas). """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
 
 class StepExpansion(Continuous1D):
     '''
@@ -1187,6 +1341,9 @@ class StepExpansion(Continuous1D):
         """Number of equidistant steps."""
         return self._n_steps
 
+    _batch_par2fun = True
+    _batch_fun2par = True
+
     def par2fun(self, p):
 
         # Reshape the parameter vector
@@ -53,6 +53,16 @@ class Likelihood(Density):
         """ Return FD_epsilon of the likelihood from the underlying distribution """
         return self.distribution.FD_epsilon
 
+    @property
+    def FD_method(self):
+        """ Return FD_method of the likelihood from the underlying distribution """
+        return self.distribution.FD_method
+
+    @property
+    def FD_workers(self):
+        """ Return FD_workers of the likelihood from the underlying distribution """
+        return self.distribution.FD_workers
+
     @property
     def _constant(self):
         return self.distribution._constant
@@ -65,6 +75,11 @@ class Likelihood(Density):
         """Return gradient of the log-likelihood function at given value"""
         return self.distribution.gradient(self.data, *args, **kwargs)
 
+    def _logd_and_gradient(self, *args):
+        """Return the log-likelihood function and its gradient at given value"""
+        logd, grad = self.distribution._conditional_logd_and_gradient(self.data, *args)
+        return logd + self._constant, grad
+
     @property
     def dim(self):
         """ Return dimension of likelihood """
@@ -135,9 +150,9 @@ class Likelihood(Density):
     def __call__(self, *args, **kwargs) -> Union[Likelihood, EvaluatedDensity]:
         return super().__call__(*args, **kwargs)
 
-    def enable_FD(self, epsilon=1e-8):
+    def enable_FD(self, epsilon=1e-8, method="forward", workers=None):
         """ Call enable_FD of the underlying distribution """
-        self.distribution.enable_FD(epsilon)
+        self.distribution.enable_FD(epsilon, method, workers)
 
     def disable_FD(self):
         """ Call disable_FD of the underlying distribution """
@@ -199,6 +214,10 @@ class UserDefinedLikelihood(object):
         """Return gradient of likelihood function"""
         return self.gradient_func(*args, **kwargs)
 
+    def logd_and_gradient(self, *args, **kwargs):
+        """Return value and gradient of likelihood function"""
+        return self.logd(*args, **kwargs), self.gradient(*args, **kwargs)
+
     def get_parameter_names(self):
         """Return parameter names of likelihood"""
         return get_non_default_args(self.logpdf_func)
@@ -8,7 +8,8 @@ from cuqi.array import CUQIarray
 from cuqi.geometry import Geometry, _DefaultGeometry1D, _DefaultGeometry2D, _get_identity_geometries
 import cuqi
 import matplotlib.pyplot as plt
-from copy import copy
+from copy import copy, deepcopy
+from collections import OrderedDict, namedtuple
 
 class Model(object):
     """Generic model defined by a forward operator.
@@ -41,6 +42,15 @@ class Model(object):
         automatically and thus the gradient function should not be specified when the Jacobian
         function is specified.
 
+    vectorized : bool, default False
+        If True, the forward function is assumed to accept a block of inputs
+        stacked along a trailing axis, i.e. a (domain_dim, N) array for 1D
+        geometries, and to return the corresponding block of outputs. This is
+        used when the model is applied to a :class:`~cuqi.samples.Samples`
+        object, such that the samples are pushed through the forward function
+        in batches (of size at most :attr:`cuqi.config.BATCH_SIZE`) rather than
+        one at a time.
+
 
     :ivar range_geometry: The geometry representing the range.
     :ivar domain_geometry: The geometry representing the domain.
@@ -94,7 +104,7 @@ class Model(object):
         model = Model(forward, range_geometry=1, domain_geometry=2, gradient=gradient)
 
     """
-    def __init__(self, forward, range_geometry, domain_geometry, gradient=None, jacobian=None):
+    def __init__(self, forward, range_geometry, domain_geometry, gradient=None, jacobian=None, vectorized=False):
 
         #Check if input is callable
         if callable(forward) is not True:
@@ -146,6 +156,49 @@ class Model(object):
         # Store non_default_args of the forward operator for faster caching when checking for those arguments.
         self._non_default_args = cuqi.utilities.get_non_default_args(self._forward_func)
 
+        # Store if the forward function can be applied to blocks of inputs
+        self._vectorized = vectorized
+
+        # Cache of forward outputs (disabled by default, see enable_cache)
+        self._forward_cache = None
+
+    @property
+    def vectorized(self):
+        """ If True, the model operators accept blocks of inputs stacked along a trailing axis. """
+        return self._vectorized
+
+    def enable_cache(self, maxsize=1):
+        """ Enable caching of the forward model outputs.
+
+        The outputs of :meth:`forward` are stored for the `maxsize` most
+        recently used inputs, such that repeated evaluations at the same input
+        (e.g. the log density and gradient of a likelihood at the same point)
+        do not evaluate the forward function again. This is useful for
+        expensive forward models, e.g. PDE-based models.
+
+        The cache assumes that the forward function is deterministic and not
+        modified while the cache is enabled. Calling this method clears the
+        cache. Statistics are available via :meth:`cache_info`.
+
+        Parameters
+        ----------
+        maxsize : int, default 1
+            The maximum number of forward outputs to store.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer.")
+        self._forward_cache = _ForwardCache(maxsize)
+
+    def disable_cache(self):
+        """ Disable (and clear) the cache of forward model outputs. """
+        self._forward_cache = None
+
+    def cache_info(self):
+        """ Return the number of hits and misses, the maximum size and the current size of the forward cache, or None if the cache is disabled. """
+        if self._forward_cache is None:
+            return None
+        return self._forward_cache.info()
+
     @property
     def domain_dim(self):
         """
@@ -265,18 +318,12 @@ class Model(object):
         ndarray or cuqi.array.CUQIarray
             The output of the function `func` converted to parameters.
         """ 
-        # If input x is Samples we apply func for each sample
-        # TODO: Check if this can be done all-at-once for computational speed-up
+        # If input x is Samples we apply func to the samples
         if isinstance(x,Samples):
-            out = np.zeros((func_range_geometry.par_dim, x.Ns))
-            # Recursively apply func to each sample
-            for idx, item in enumerate(x):
-                out[:,idx] = self._apply_func(func,
-                                              func_range_geometry,
-                                              func_domain_geometry,
-                                              item, is_par=True,
-                                              **kwargs)
-            return Samples(out, geometry=func_range_geometry)
+            return self._apply_func_to_samples(func,
+                                               func_range_geometry,
+                                               func_domain_geometry,
+                                               x, **kwargs)
         
         # store if input x is CUQIarray
         is_CUQIarray = type(x) is CUQIarray
@@ -289,6 +336,34 @@ class Model(object):
         return self._2par(out, func_range_geometry, 
                                     to_CUQIarray=is_CUQIarray)
 
+    def _apply_func_to_samples(self, func, func_range_geometry, func_domain_geometry, samples, **kwargs):
+        """ Private function that applies the given function `func` to each sample in `samples` and stores the result in a preallocated array. If the model is vectorized, `func` is applied to batches of samples (of size at most :attr:`cuqi.config.BATCH_SIZE`) at once. Otherwise `func` is applied to one sample at a time.
+
+        Returns
+        -------
+        cuqi.samples.Samples
+            The output of `func` for each sample, represented as parameters.
+        """
+        out = np.empty((func_range_geometry.par_dim, samples.Ns))
+
+        if not self._vectorized or isinstance(samples.samples, list):
+            for idx, item in enumerate(samples):
+                out[:,idx] = self._apply_func(func,
+                                              func_range_geometry,
+                                              func_domain_geometry,
+                                              item, is_par=True,
+                                              **kwargs)
+            return Samples(out, geometry=func_range_geometry)
+
+        batch_size = max(int(cuqi.config.BATCH_SIZE), 1)
+        for start in range(0, samples.Ns, batch_size):
+            end = min(start+batch_size, samples.Ns)
+            pars = samples.samples[:, start:end]
+            funvals = func_domain_geometry._par2fun_batch(pars)
+            out[:, start:end] = func_range_geometry._fun2par_batch(
+                func(funvals, **kwargs))
+        return Samples(out, geometry=func_range_geometry)
+
     def _parse_args_add_to_kwargs(self, *args, **kwargs):
         """ Private function that parses the input arguments of the model and adds them as keyword arguments matching the non default arguments of the forward function. """
 
@@ -352,10 +427,16 @@ class Model(object):
             return new_model
 
         # Else we apply the forward operator
-        return self._apply_func(self._forward_func,
-                                self.range_geometry,
-                                self.domain_geometry,
-                                x, is_par)
+        apply_forward = lambda: self._apply_func(self._forward_func,
+                                                 self.range_geometry,
+                                                 self.domain_geometry,
+                                                 x, is_par)
+
+        # Reuse the output if the forward operator has been applied to x
+        if self._forward_cache is not None:
+            return self._forward_cache.get(x, is_par, apply_forward, self._get_forward_state)
+
+        return apply_forward()
 
     def __call__(self, *args, **kwargs):
         return self.forward(*args, **kwargs)
@@ -410,6 +491,12 @@ class Model(object):
         # Check for other errors that may prevent computing the gradient
         self._check_gradient_can_be_computed(direction, wrt)
 
+        # Continue from the state of the forward evaluation at wrt if it is cached
+        if self._forward_cache is not None:
+            state = self._forward_cache.get_state(wrt, is_wrt_par)
+            if state is not None:
+                self._set_forward_state(state)
+
         wrt = self._2fun(wrt, self.domain_geometry, is_par=is_wrt_par)
 
         # Store if the input direction is CUQIarray
@@ -464,12 +551,88 @@ class Model(object):
             raise NotImplementedError("Gradient not implemented for model {} with domain geometry {}".format(self,self.domain_geometry))
 
 
+    def _get_forward_state(self):
+        """ Return the state of the model after a forward evaluation that the gradient at the same input can reuse (None if the model has no such state). """
+        return None
+
+    def _set_forward_state(self, state):
+        """ Restore a state returned by :meth:`_get_forward_state`. """
+        pass
+
+    def __copy__(self):
+        # The copy has its own (empty) forward cache
+        new_model = self.__class__.__new__(self.__class__)
+        new_model.__dict__.update(self.__dict__)
+        new_model._forward_cache = self._new_forward_cache()
+        return new_model
+
+    def __deepcopy__(self, memo):
+        new_model = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new_model
+        for name, value in self.__dict__.items():
+            new_model.__dict__[name] = self._new_forward_cache() if name == "_forward_cache" else deepcopy(value, memo)
+        return new_model
+
+    def _new_forward_cache(self):
+        """ Return an empty forward cache with the same size as the cache of the model (or None if caching is disabled). """
+        forward_cache = self.__dict__.get("_forward_cache")
+        return None if forward_cache is None else _ForwardCache(forward_cache.maxsize)
+
     def __len__(self):
         return self.range_dim
 
     def __repr__(self) -> str:
         return "CUQI {}: {} -> {}.\n    Forward parameters: {}.".format(self.__class__.__name__,self.domain_geometry,self.range_geometry,cuqi.utilities.get_non_default_args(self))
     
+class _ForwardCache:
+    """ Least recently used cache of forward model outputs keyed by the value of the input. """
+
+    CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, x, is_par, compute, get_state=None):
+        """ Return (a copy of) the cached output for input x or compute (and cache) it by calling `compute()`.
+        If given, `get_state()` is called after computing the output and its result is cached with the output, see :meth:`get_state`. """
+        key = self._key(x, is_par)
+        if key is None: # Input that cannot be cached, e.g. Samples
+            return compute()
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            output = compute()
+            self._entries[key] = (output, get_state() if get_state is not None else None)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        # Return a copy such that the cached output cannot be modified in-place
+        return copy(self._entries[key][0])
+
+    def get_state(self, x, is_par):
+        """ Return the state cached with the output for input x, or None if x is not cached. """
+        entry = self._entries.get(self._key(x, is_par))
+        return None if entry is None else entry[1]
+
+    def info(self):
+        return self.CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    @staticmethod
+    def _key(x, is_par):
+        """ Return a hashable key of the value of x (or None if x is not a numeric array or scalar). """
+        if isinstance(x, Samples) or not isinstance(x, (np.ndarray, np.number, int, float)):
+            return None
+        value = np.asarray(x)
+        if value.dtype.kind not in "biufc":
+            return None
+        return (is_par, getattr(x, "is_par", None), type(x), value.dtype.str, value.shape, value.tobytes())
+
 class LinearModel(Model):
     """Model based on a Linear forward operator.
 
@@ -486,6 +649,9 @@ class LinearModel(Model):
     domain_geometry : integer or cuqi.geometry.Geometry (optional)
         If integer is given, a cuqi.geometry._DefaultGeometry is created with dimension of the integer.
 
+    vectorized : bool (optional)
+        If True, the forward and adjoint functions are assumed to accept blocks of inputs stacked along a trailing axis. See :class:`~cuqi.model.Model`. Defaults to True if a matrix is passed as forward and False otherwise.
+
 
     :ivar range_geometry: The geometry representing the range.
     :ivar domain_geometry: The geometry representing the domain.
@@ -536,11 +702,11 @@ class LinearModel(Model):
     """
     # Linear forward model with forward and adjoint (transpose).
     
-    def __init__(self,forward,adjoint=None,range_geometry=None,domain_geometry=None):
+    def __init__(self,forward,adjoint=None,range_geometry=None,domain_geometry=None,vectorized=None):
         #Assume forward is matrix if not callable (TODO: add more checks)
         if not callable(forward):      
-            forward_func = lambda x: self._matrix@x
-            adjoint_func = lambda y: self._matrix.T@y
+            forward_func = self._matrix_forward
+            adjoint_func = self._matrix_adjoint
             matrix = forward
         else:
             forward_func = forward
@@ -558,8 +724,12 @@ class LinearModel(Model):
             if domain_geometry is None:
                 domain_geometry = _DefaultGeometry1D(grid=matrix.shape[1])  
 
+        # Matrix-vector products are naturally applied to blocks of inputs
+        if vectorized is None:
+            vectorized = matrix is not None
+
         #Initialize Model class
-        super().__init__(forward_func,range_geometry,domain_geometry)
+        super().__init__(forward_func,range_geometry,domain_geometry,vectorized=vectorized)
 
         #Add adjoint
         self._adjoint_func = adjoint_func
@@ -568,12 +738,23 @@ class LinearModel(Model):
         self._matrix = matrix
 
         #Add gradient
-        self._gradient_func = lambda direction, wrt: self._adjoint_func(direction)
+        self._gradient_func = self._adjoint_gradient
 
         # if matrix is not None: 
         #     assert(self.range_dim  == matrix.shape[0]), "The parameter 'forward' dimensions are inconsistent with the parameter 'range_geometry'"
         #     assert(self.domain_dim == matrix.shape[1]), "The parameter 'forward' dimensions are inconsistent with parameter 'domain_geometry'"
 
+    # Forward, adjoint and gradient are defined as methods (rather than lambdas)
+    # such that linear models can be pickled, e.g. to sample chains in parallel.
+    def _matrix_forward(self, x):
+        return self._matrix@x
+
+    def _matrix_adjoint(self, y):
+        return self._matrix.T@y
+
+    def _adjoint_gradient(self, direction, wrt):
+        return self._adjoint_func(direction)
+
     def adjoint(self, y, is_par=True):
         """ Adjoint of the model.
         
@@ -647,16 +828,19 @@ class PDEModel(Model):
     domain_geometry : integer or cuqi.geometry.Geometry (optional)
         If integer is given, a cuqi.geometry._DefaultGeometry is created with dimension of the integer.
 
+    vectorized : bool, default False
+        If True, the PDE assemble, solve and observe methods are assumed to accept blocks of parameters stacked along a trailing axis. See :class:`~cuqi.model.Model`.
+
 
     :ivar range_geometry: The geometry representing the range.
     :ivar domain_geometry: The geometry representing the domain.
     """
-    def __init__(self, PDE: cuqi.pde.PDE, range_geometry, domain_geometry):
+    def __init__(self, PDE: cuqi.pde.PDE, range_geometry, domain_geometry, vectorized=False):
 
         if not isinstance(PDE, cuqi.pde.PDE):
             raise ValueError("PDE needs to be a cuqi PDE.")
 
-        super().__init__(self._forward_func, range_geometry, domain_geometry, gradient=self._gradient_func)
+        super().__init__(self._forward_func, range_geometry, domain_geometry, gradient=self._gradient_func, vectorized=vectorized)
 
         self.pde = PDE
 
@@ -670,6 +854,12 @@ class PDEModel(Model):
 
         return obs
     
+    def _get_forward_state(self):
+        return self.pde._get_assembly_state()
+
+    def _set_forward_state(self, state):
+        self.pde._set_assembly_state(state)
+
     def _gradient_func(self, direction, wrt):
         """ Compute direction-Jacobian product (gradient) of the model. """
         if hasattr(self.pde, "gradient_wrt_parameter"):
@@ -1,5 +1,10 @@
+from collections import OrderedDict
 import numpy as np
-from scipy.sparse import spdiags, eye, kron, vstack
+from scipy.sparse import spdiags, eye, kron, vstack, issparse, csr_matrix
+
+# Cache of assembled operator matrices shared between operators (see _cached_matrix)
+_MATRIX_CACHE = OrderedDict()
+_MATRIX_CACHE_SIZE = 16
 
 # ========== Operator class ===========
 class Operator(object):
@@ -12,34 +17,46 @@ class Operator(object):
         pass
 
     def __matmul__(self, vec):
-        return self._matrix@vec
+        return self.matvec(vec)
 
     def __rmatmul__(self, vec):
-        return vec@self._matrix
+        return vec@self._get_matrix()
 
     def __add__(self, val):
-        return self._matrix+val
+        return self._get_matrix()+val
 
     def __radd__(self, val):
         return self.__add__(val)
 
     def __mul__(self, val):
-        return self._matrix*val
+        return self._get_matrix()*val
 
     def __rmul__(self, val):
         return self.__mul__(val)
 
     @property
     def T(self):
-        return self._matrix.T
+        return self.get_matrix().T
 
     @property
     def shape(self):
-        return self._matrix.shape
+        return self._get_matrix().shape
 
     def get_matrix(self):
         return self._matrix
 
+    def _get_matrix(self):
+        """ Return the matrix without copying it. The matrix may be shared with other operators and must not be modified. """
+        return self._matrix
+
+    def matvec(self, vec):
+        """ Apply the operator to vec (a vector or the columns of a matrix). """
+        return self._get_matrix()@vec
+
+    def rmatvec(self, vec):
+        """ Apply the transpose of the operator to vec (a vector or the columns of a matrix). """
+        return self._get_matrix().T@vec
+
 class FirstOrderFiniteDifference(Operator):
     """
     First order finite difference differential operator for 1D and 2D grids. 
@@ -57,9 +74,14 @@ class FirstOrderFiniteDifference(Operator):
 
         dx : int or float
             The grid spacing (length between two consecutive nodes). 
+
+        matrix_free: bool
+            If True, the 2D operator is applied (in :meth:`matvec` and :meth:`rmatvec`) by applying the 1D operator along each axis of the grid instead of assembling the sparse matrix of the 2D operator. The matrix is then only assembled if requested by :meth:`get_matrix`. This avoids the assembly time and memory for large 2D grids. Default is False.
+
+    The assembled matrices are cached and shared by operators with the same number of nodes, boundary condition type and grid spacing. :meth:`get_matrix` returns a copy of the shared matrix, which can be modified freely.
     """
 
-    def __init__(self, num_nodes, bc_type= 'periodic', dx=None):	
+    def __init__(self, num_nodes, bc_type= 'periodic', dx=None, matrix_free=False):	
 
         if isinstance(num_nodes, (int,np.integer)):
             self._num_nodes = (num_nodes,)
@@ -81,7 +103,14 @@ class FirstOrderFiniteDifference(Operator):
             self._dx = dx #TODO: check dx is a scalar value
         else:
             raise NotImplementedError('Specifying dx for a 2D operator is not implemented')
-        self._create_diff_matrix()
+
+        # Validate the boundary condition type (and assemble the 1D operator)
+        self._get_matrix_1D()
+
+        self._matrix_free = matrix_free and self.physical_dim == 2
+        self._matrix = None
+        if not self._matrix_free:
+            self._matrix = self._get_matrix()
 
 
     @property
@@ -100,16 +129,102 @@ class FirstOrderFiniteDifference(Operator):
     def dim(self):
         return np.prod(self.num_nodes)
 
+    @property
+    def shape(self):
+        num_rows_1D = self._get_matrix_1D().shape[0]
+        if self.physical_dim == 2:
+            N = self.num_nodes[0]
+            return (2*num_rows_1D*N, N*N)
+        return (num_rows_1D, self.num_nodes[0])
+
+    def get_matrix(self):
+        return self._get_matrix().copy()
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            key = (type(self).__name__, self.num_nodes, self.bc_type, self._dx)
+            return _cached_matrix(key, self._create_diff_matrix)
+        return self._matrix
+
+    def _get_matrix_1D(self):
+        """ Return the (cached) matrix of the 1D operator (scaled by the grid spacing) """
+        key = (type(self).__name__, (self.num_nodes[0],), self.bc_type, self._dx)
+        return _cached_matrix(key, self._create_diff_matrix_1D)
+
+    def matvec(self, vec):
+        if not self._matrix_free or not isinstance(vec, np.ndarray):
+            return super().matvec(vec)
+
+        # Apply the 1D operator along each axis of the grid, see _create_diff_matrix
+        N = self.num_nodes[0]
+        X = vec.reshape(N, N, -1)
+        Ds_X = self._apply_1D(X, axis=1)
+        Dt_X = self._apply_1D(X, axis=0)
+        out = np.concatenate([Ds_X.reshape(-1, X.shape[2]), Dt_X.reshape(-1, X.shape[2])])
+        return out.reshape((out.shape[0],) + vec.shape[1:])
+
+    def rmatvec(self, vec):
+        if not self._matrix_free or not isinstance(vec, np.ndarray):
+            return super().rmatvec(vec)
+
+        N = self.num_nodes[0]
+        M = self._get_matrix_1D().shape[0]
+        Y = vec.reshape(2*M*N, -1)
+        Ys = Y[:M*N].reshape(N, M, -1)
+        Yt = Y[M*N:].reshape(M, N, -1)
+        out = self._apply_1D(Ys, axis=1, transpose=True) + self._apply_1D(Yt, axis=0, transpose=True)
+        return out.reshape((N*N,) + vec.shape[1:])
+
+    def _apply_1D(self, X, axis, transpose=False):
+        """ Apply the 1D operator (or its transpose) along axis of X using its finite difference stencil """
+        X = np.moveaxis(X, axis, 0)
+        diff = np.diff(X, axis=0)
+        bc_type = self.bc_type
+        if bc_type == 'none':
+            out = X.copy()
+        elif not transpose:
+            if bc_type == 'zero':
+                out = np.concatenate([X[:1], diff, -X[-1:]])
+            elif bc_type == 'periodic':
+                out = np.concatenate([X[:1]-X[-1:], diff, X[:1]-X[-1:]])
+            elif bc_type == 'neumann':
+                out = diff
+            elif bc_type == 'backward':
+                out = np.concatenate([X[:1], -diff])
+        else:
+            if bc_type == 'zero':
+                out = -diff
+            elif bc_type == 'periodic':
+                out = -diff
+                out[0] += X[-1]
+                out[-1] -= X[0]
+            elif bc_type == 'neumann':
+                out = np.concatenate([-X[:1], -diff, X[-1:]])
+            elif bc_type == 'backward':
+                out = np.concatenate([diff, -X[-1:]])
+                out[0] += 2*X[0]
+        return np.moveaxis(out/self._dx, 0, axis)
 
     def _create_diff_matrix(self):
-        if self.physical_dim == 2:
+        D = self._get_matrix_1D()
+
+        # structure matrix
+        if (self.physical_dim == 1):
+            return D
+
+        elif (self.physical_dim == 2):
             assert(self.num_nodes[0] == self.num_nodes[1]), "The case in which self.num_nodes[0] != self.num_nodes[1] is not handled."
-            N = self.num_nodes[0]
-        elif self.physical_dim == 1:
-            N = self.num_nodes[0]
+            I = eye(self.num_nodes[0], dtype=int)
+            Ds = kron(I, D)
+            Dt = kron(D, I)
+            return vstack([Ds, Dt])
+
         else:
             raise Exception("Cannot define N")
 
+    def _create_diff_matrix_1D(self):
+        N = self.num_nodes[0]
+
         # finite difference matrix
         one_vec = np.ones(N)
         diags = np.vstack([-one_vec, one_vec])
@@ -133,16 +248,8 @@ class FirstOrderFiniteDifference(Operator):
         else:
             raise ValueError(f"Unknown boundary type {self.bc_type}")
 
-        # structure matrix
-        if (self.physical_dim == 1):
-            self._matrix = Dmat/self._dx
+        return Dmat/self._dx
 
-        elif (self.physical_dim == 2):            
-            I = eye(N, dtype=int)
-            Ds = kron(I, Dmat)
-            Dt = kron(Dmat, I)
-            self._matrix = vstack([Ds, Dt])
-        
 class SecondOrderFiniteDifference(FirstOrderFiniteDifference):
     """
     Second order finite difference differential operator for 1D and 2D grids. 
@@ -165,14 +272,13 @@ class SecondOrderFiniteDifference(FirstOrderFiniteDifference):
             The grid spacing (length between two consecutive nodes). 
     """
 
-    def _create_diff_matrix(self):
-        if self.physical_dim == 2:
-            assert(self.num_nodes[0] == self.num_nodes[1]), "The case in which self.num_nodes[0] != self.num_nodes[1] is not handled."
-            N = self.num_nodes[0]
-        elif self.physical_dim == 1:
-            N = self.num_nodes[0]
-        else:
-            raise Exception("Cannot define N")
+    def _apply_1D(self, X, axis, transpose=False):
+        """ Apply the 1D operator (or its transpose) along axis of X using its (cached) sparse matrix """
+        D = self._get_matrix_1D()
+        return _apply_along_axis(D.T if transpose else D, X, axis)
+
+    def _create_diff_matrix_1D(self):
+        N = self.num_nodes[0]
 
         # finite difference matrix
         one_vec = np.ones(N)
@@ -193,15 +299,7 @@ class SecondOrderFiniteDifference(FirstOrderFiniteDifference):
         else:
             raise ValueError(f"Unknown boundary type {self.bc_type}")
 
-        # structure matrix
-        if (self.physical_dim == 1):
-            self._matrix = Dmat/self._dx**2
-
-        elif (self.physical_dim == 2):            
-            I = eye(N, dtype=int)
-            Ds = kron(I, Dmat)
-            Dt = kron(Dmat, I)
-            self._matrix = vstack([Ds, Dt])
+        return Dmat/self._dx**2
 
 
 class PrecisionFiniteDifference(Operator):
@@ -224,17 +322,25 @@ class PrecisionFiniteDifference(Operator):
             | Order 0: Identity operator.
             | Order 1: First order finite difference operator. 1D precision has a banded diagonal structure with [-1, 2, -1].
             | Order 2: Second order finite difference operator. 1D precision has a banded diagonal structure with [1, -4,  6, -4, 1].
+
+        matrix_free: bool
+            If True, the precision operator is applied as D^T(Dx) with the matrix-free finite difference operator D (see :class:`FirstOrderFiniteDifference`) and the precision matrix is only assembled if requested by :meth:`get_matrix`. Default is False.
+
+    The assembled matrices are cached and shared by operators with the same number of nodes, boundary condition type and order. :meth:`get_matrix` returns a copy of the shared matrix, which can be modified freely.
     """
-    def __init__(self, num_nodes , bc_type= 'periodic', order =1):
+    def __init__(self, num_nodes , bc_type= 'periodic', order =1, matrix_free=False):
         if order == 0:
-            self._diff_op = FirstOrderFiniteDifference(num_nodes, "none") # Special case that is idendity operator
+            self._diff_op = FirstOrderFiniteDifference(num_nodes, "none", matrix_free=matrix_free) # Special case that is idendity operator
         elif order == 1:
-            self._diff_op = FirstOrderFiniteDifference(num_nodes, bc_type=bc_type)
+            self._diff_op = FirstOrderFiniteDifference(num_nodes, bc_type=bc_type, matrix_free=matrix_free)
         elif order == 2:
-            self._diff_op = SecondOrderFiniteDifference(num_nodes, bc_type=bc_type)
+            self._diff_op = SecondOrderFiniteDifference(num_nodes, bc_type=bc_type, matrix_free=matrix_free)
         else:
             raise NotImplementedError
-        self._create_prec_matrix()
+        self._order = order
+        self._matrix = None
+        if not self._diff_op._matrix_free:
+            self._matrix = self._get_matrix()
 
     @property
     def physical_dim(self):
@@ -252,10 +358,59 @@ class PrecisionFiniteDifference(Operator):
     def dim(self):
         return self._diff_op.dim
 
+    @property
+    def shape(self):
+        return (self.dim, self.dim)
+
+    def get_matrix(self):
+        return self._get_matrix().copy()
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            key = (type(self).__name__, self.num_nodes, self.bc_type, self._order)
+            return _cached_matrix(key, self._create_prec_matrix)
+        return self._matrix
+
+    def matvec(self, vec):
+        if not self._diff_op._matrix_free or not isinstance(vec, np.ndarray):
+            return super().matvec(vec)
+        return self._diff_op.rmatvec(self._diff_op.matvec(vec))
+
+    def rmatvec(self, vec):
+        return self.matvec(vec) # The precision operator is symmetric
+
     def _create_prec_matrix(self):
         if self.physical_dim == 1 or self.physical_dim == 2:
-            self._matrix = (self._diff_op.T @ self._diff_op).tocsc()
+            D = self._diff_op._get_matrix()
+            return (D.T @ D).tocsc()
         else:
             raise NotImplementedError
 
 
+def _cached_matrix(key, create_matrix):
+    """ Return the matrix cached for key, or create it with `create_matrix()` and cache it. The most recently used matrices are kept in the cache.
+    The cached matrix is shared by all callers and must not be modified, see :meth:`Operator.get_matrix` for a modifiable copy. """
+    if key in _MATRIX_CACHE:
+        _MATRIX_CACHE.move_to_end(key)
+        return _MATRIX_CACHE[key]
+
+    matrix = _canonical_matrix(create_matrix())
+    _MATRIX_CACHE[key] = matrix
+    if len(_MATRIX_CACHE) > _MATRIX_CACHE_SIZE:
+        _MATRIX_CACHE.popitem(last=False)
+    return matrix
+
+def _canonical_matrix(matrix):
+    """ Return the sparse matrix in CSR or CSC format with canonical (sorted, unique) indices """
+    if not issparse(matrix) or matrix.format not in ("csr", "csc"):
+        matrix = csr_matrix(matrix)
+    matrix.sum_duplicates() # Sorts the indices once, such that products with the shared matrix never modify it
+    return matrix
+
+def _apply_along_axis(A, X, axis):
+    """ Apply the (sparse) matrix A to the 3D array X along axis (0 or 1) """
+    X = np.moveaxis(X, axis, 0)
+    out = A@X.reshape(X.shape[0], -1)
+    return np.moveaxis(out.reshape((A.shape[0],) + X.shape[1:]), 0, axis)
+
+
@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from math import comb
 import scipy
+import scipy.sparse.linalg
 from inspect import getsource
 from scipy.interpolate import interp1d
 import numpy as np
@@ -23,6 +26,9 @@ class PDE(ABC):
         The grid on which the observed solution should be interpolated (currently only supported for 1D problems).  
     """
 
+    # Attributes set by assemble (and solve) that describe the PDE assembled at a parameter, see _get_assembly_state
+    _ASSEMBLY_ATTRIBUTES = ()
+
     def __init__(self, PDE_form, grid_sol=None, grid_obs=None, observation_map=None):
         self.PDE_form = PDE_form
         self.grid_sol = grid_sol
@@ -33,6 +39,15 @@ class PDE(ABC):
     def assemble(self,parameter):
         pass
 
+    def _get_assembly_state(self):
+        """Return the state of the assembled PDE (e.g. operators and factorizations), which can be restored by :meth:`_set_assembly_state` to continue with the PDE assembled at the same parameter"""
+        return {name: getattr(self, name) for name in self._ASSEMBLY_ATTRIBUTES if hasattr(self, name)}
+
+    def _set_assembly_state(self, state):
+        """Restore a state of the assembled PDE returned by :meth:`_get_assembly_state`"""
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @abstractmethod
     def solve(self):
         pass
@@ -124,6 +139,11 @@ class LinearPDE(PDE):
         self._linalg_solve = linalg_solve
         self._linalg_solve_kwargs = linalg_solve_kwargs
 
+    @property
+    def _uses_direct_solver(self):
+        """Returns True if `linalg_solve` is one of the default direct solvers without keyword arguments, which can then be replaced by a (reusable) factorization"""
+        return self._linalg_solve in (scipy.linalg.solve, scipy.sparse.linalg.spsolve) and not self._linalg_solve_kwargs
+
     def _solve_linear_system(self, A, b, linalg_solve, kwargs):
         """Helper function that solves the linear system `A*x=b` using the provided solve method `linalg_solve` and its keyword arguments `kwargs`. It then returns the output in the format: `solution`, `info`"""
         returned_values = linalg_solve(A, b, **kwargs)
@@ -144,6 +164,12 @@ class SteadyStateLinearPDE(LinearPDE):
     PDE_form : callable function
         Callable function with signature `PDE_form(parameter)` where `parameter` is the Bayesian parameter. The function returns a tuple with the discretized differential operator A and right-hand-side b. The types of A and b are determined by what the method :meth:`linalg_solve` accepts as first and second parameters, respectively. 
 
+    factorize : bool, optional
+        If True, the linear system is solved by an LU factorization of the (dense or sparse) differential operator instead of :meth:`linalg_solve` (`linalg_solve_kwargs` are then not used). The factorization is reused by repeated solves and adjoint solves (see :meth:`solve_adjoint`) with the same assembled operator. If None (default), the operator is factorized if `linalg_solve` is one of the direct solvers :meth:`scipy.linalg.solve` (the default) or :meth:`scipy.sparse.linalg.spsolve` and no `linalg_solve_kwargs` are given.
+
+    factorization_cache_size : int, optional
+        Number of factorizations to keep across assemblies, i.e. the number of most recently assembled parameters whose factorizations are reused if the PDE is assembled with the same parameter again (e.g. when an MCMC proposal is rejected). The factorizations are identified by the parameter value only, so if `PDE_form` can return a different operator when it is called with the same parameter (e.g. because it depends on other state), set this to 0 to disable caching across assemblies. Default is 2.
+
     kwargs: 
         See :class:`~cuqi.pde.LinearPDE` for the remaining keyword arguments. 
 
@@ -152,20 +178,53 @@ class SteadyStateLinearPDE(LinearPDE):
     See demo demos/demo24_fwd_poisson.py for an illustration on how to use SteadyStateLinearPDE with varying solver choices. And demos demos/demo25_fwd_poisson_2D.py and demos/demo26_fwd_poisson_mixedBC.py for examples with mixed (Dirichlet and Neumann) boundary conditions problems. demos/demo25_fwd_poisson_2D.py also illustrates how to observe on a specific boundary, for example.
     """
 
-    def __init__(self, PDE_form, **kwargs):
+    _ASSEMBLY_ATTRIBUTES = ("diff_op", "rhs", "_parameter_key", "_factorization")
+
+    def __init__(self, PDE_form, factorize=None, factorization_cache_size=2, **kwargs):
         super().__init__(PDE_form, **kwargs)
 
+        if factorize is None:
+            factorize = self._uses_direct_solver
+        self.factorize = factorize
+        self._factorizations = _FactorizationLRU(factorization_cache_size)
+
     def assemble(self, parameter):
         """Assembles differential operator and rhs according to PDE_form"""
         self.diff_op, self.rhs = self.PDE_form(parameter)
+        self._parameter_key = _parameter_key(parameter)
+        self._factorization = None # Factorization of diff_op (computed when first needed)
 
     def solve(self):
         """Solve the PDE and returns the solution and an information variable `info` which is a tuple of all variables returned by the function `linalg_solve` after the solution."""
         if not hasattr(self, "diff_op") or not hasattr(self, "rhs"):
             raise Exception("PDE is not assembled.")
 
+        if self.factorize:
+            return self._get_factorization().solve(self.rhs), None
+
         return self._solve_linear_system(self.diff_op, self.rhs, self._linalg_solve, self._linalg_solve_kwargs)
 
+    def solve_adjoint(self, rhs):
+        """Solve the adjoint system `A^T*x=rhs` with the assembled differential operator A and return the solution x. If the PDE is factorized, the factorization of A from :meth:`solve` is reused. Intended for adjoint-based gradients (e.g. in `gradient_wrt_parameter`)."""
+        if not hasattr(self, "diff_op"):
+            raise Exception("PDE is not assembled.")
+
+        if self.factorize:
+            return self._get_factorization().solve(rhs, trans=True)
+
+        solution, _ = self._solve_linear_system(self.diff_op.T, rhs, self._linalg_solve, self._linalg_solve_kwargs)
+        return solution
+
+    def _get_factorization(self):
+        """Return the factorization of the assembled differential operator, reusing a cached factorization for the same parameter (if caching is enabled)."""
+        if self._factorization is None:
+            compute = lambda: _LUFactorization(self.diff_op)
+            if self._parameter_key is None or self._factorizations.maxsize <= 0:
+                self._factorization = compute()
+            else:
+                self._factorization = self._factorizations.get(self._parameter_key, compute)
+        return self._factorization
+
 
     def observe(self, solution):
             
@@ -180,7 +239,7 @@ class SteadyStateLinearPDE(LinearPDE):
         return solution_obs
         
 class TimeDependentLinearPDE(LinearPDE):
-    """Time Dependent Linear PDE with fixed time stepping using Euler method (backward or forward).
+    """Time Dependent Linear PDE with fixed time stepping using Euler method (backward or forward) or the Crank-Nicolson method.
     
     Parameters
     -----------   
@@ -194,7 +253,28 @@ class TimeDependentLinearPDE(LinearPDE):
         If passed as an array_like, it is an array of the times at which the solution is observed. If passed as a string it can be set to `final` to observe at the final time step, or `all` to observe at all time steps. Default is `final`.
 
     method: str
-        Time stepping method. Currently two options are available `forward_euler` and  `backward_euler`.
+        Time stepping method. Currently three options are available `forward_euler`, `backward_euler` and `crank_nicolson`.
+
+    time_invariant: bool
+        If True, the differential operator and the source term are assumed to be independent of time. `PDE_form` is then only evaluated once per assembly (at the initial time) and the time stepping matrices are built once (as sparse matrices if the operator is sparse or has few non-zeros). For the implicit methods (`backward_euler` and `crank_nicolson`) the stepping matrix is factorized once for each distinct time step size (i.e. once for uniform time steps) if `factorize` is True. Default is False.
+
+    factorize: bool, optional
+        If True, the stepping matrix of the implicit methods is LU-factorized (dense or sparse) instead of solving the linear systems with :meth:`linalg_solve` (`linalg_solve_kwargs` are then not used). If `time_invariant` is True, the factorization is reused in all time steps of the same size. If None (default), the stepping matrix is factorized if `linalg_solve` is one of the direct solvers :meth:`scipy.linalg.solve` (the default) or :meth:`scipy.sparse.linalg.spsolve` and no `linalg_solve_kwargs` are given.
+
+    store_only_observed: bool
+        If True, :meth:`solve` only stores the solution at the observation times `time_obs` (which must then be a subset of `time_steps`) instead of at all time steps. This reduces the memory from O(N*len(time_steps)) to O(N*len(time_obs)) for N solution nodes. Default is False.
+
+    initial_condition_gradient: callable function, optional
+        Callable function with signature `initial_condition_gradient(direction, parameter)` that returns the gradient (direction-Jacobian product) of the initial condition with respect to the parameter. E.g. `lambda direction, parameter: direction` if the parameter is the initial condition. Used by :meth:`gradient_wrt_parameter`. If None, the initial condition is assumed to be independent of the parameter.
+
+    source_term_gradient: callable function, optional
+        Callable function with signature `source_term_gradient(direction, parameter, t)` that returns the gradient (direction-Jacobian product) of the source term at time `t` with respect to the parameter. If None, the source term is assumed to be independent of the parameter.
+
+    diff_op_gradient: callable function, optional
+        Callable function with signature `diff_op_gradient(direction, parameter, t, u)` that returns the gradient (direction-Jacobian product) of `differential_operator@u` at time `t` with respect to the parameter for a fixed state `u`. If None, the differential operator is assumed to be independent of the parameter.
+
+    num_checkpoints: int, optional
+        Maximum number of time states stored by :meth:`gradient_wrt_parameter` if `diff_op_gradient` is given (the adjoint equations need the states in reverse order). The other states are recomputed from the stored states using binomial checkpointing. If None (default), all states are stored.
 
     kwargs: 
         See :class:`~cuqi.pde.LinearPDE` for the remaining keyword arguments 
@@ -204,11 +284,26 @@ class TimeDependentLinearPDE(LinearPDE):
     See demos/demo34_TimeDependentLinearPDE.py for 1D heat and 1D wave equations.
     """
 
-    def __init__(self, PDE_form, time_steps, time_obs='final', method='forward_euler', **kwargs):
+    _THETA = {'forward_euler': 0, 'backward_euler': 1, 'crank_nicolson': 0.5} # Weight of the implicit part of each time stepping method
+
+    _ASSEMBLY_ATTRIBUTES = ("_parameter", "_assembled_parameter_key", "_assembled_time", "diff_op", "rhs",
+                            "initial_condition", "_diff_op_internal", "_stepping_matrices")
+
+    def __init__(self, PDE_form, time_steps, time_obs='final', method='forward_euler', time_invariant=False, factorize=None, store_only_observed=False,
+                 initial_condition_gradient=None, source_term_gradient=None, diff_op_gradient=None, num_checkpoints=None, **kwargs):
         super().__init__(PDE_form, **kwargs)
 
+        self.initial_condition_gradient = initial_condition_gradient
+        self.source_term_gradient = source_term_gradient
+        self.diff_op_gradient = diff_op_gradient
+        self.num_checkpoints = num_checkpoints
+
         self.time_steps = time_steps
         self.method = method
+        self.time_invariant = time_invariant
+        if factorize is None:
+            factorize = self._uses_direct_solver
+        self.factorize = factorize
 
         # Set time_obs
         if time_obs is None:
@@ -223,52 +318,268 @@ class TimeDependentLinearPDE(LinearPDE):
                                  +"to `final` or `all`")
         self._time_obs = time_obs
 
+        self.store_only_observed = store_only_observed
+        if store_only_observed:
+            # Indices of the time steps at which the solution is observed
+            matches = np.isclose(np.asarray(time_obs)[:, None], np.asarray(time_steps)[None, :], rtol=1e-12, atol=0)
+            if not np.all(matches.any(axis=1)):
+                raise ValueError("time_obs must be a subset of time_steps "
+                                 +"if store_only_observed is True")
+            self._time_obs_indices = np.argmax(matches, axis=1)
+
     @property
     def method(self):
         return self._method
 
     @method.setter
     def method(self, value):
-        if value.lower() != 'forward_euler' and value.lower() != 'backward_euler':
+        if value.lower() not in self._THETA:
             raise ValueError(
-                "method can be set to either `forward_euler` or `backward_euler`")
+                "method can be set to either `forward_euler`, `backward_euler` or `crank_nicolson`")
         self._method = value
 
     def assemble(self, parameter):
         """Assemble PDE"""
         self._parameter = parameter
+        self._assembled_parameter_key = _parameter_key(parameter)
+        self._assembled_time = None
+        if self.time_invariant:
+            self.assemble_step(self.time_steps[0])
+            self._diff_op_internal = _sparsify(self.diff_op)
+            self._stepping_matrices = [] # List of (dt, stepping matrix) of the implicit part
 
     def assemble_step(self, t):
         """Assemble time step at time t"""
         self.diff_op, self.rhs, self.initial_condition = self.PDE_form(self._parameter, t)
+        self._assembled_time = t
 
     def solve(self):
-        """Solve PDE by time-stepping"""
+        """Solve PDE by time-stepping.
+
+        With the weight theta of the implicit part (0 for `forward_euler`, 1 for `backward_euler` and 1/2 for `crank_nicolson`), each time step from t to t+dt solves
+        (I - theta*dt*A(t+dt))*u(t+dt) = (I + (1-theta)*dt*A(t))*u(t) + dt*((1-theta)*f(t) + theta*f(t+dt)),
+        where A is the differential operator and f is the source term.
+        """
+        if not hasattr(self, "_parameter"):
+            raise Exception("PDE is not assembled.")
+
         # initialize time-dependent solution
-        self.assemble_step(self.time_steps[0])
-        u = np.empty((len(self.initial_condition), len(self.time_steps)))
-        u[:, 0] = self.initial_condition
-
-        if self.method == 'forward_euler':
-            for idx, t in enumerate(self.time_steps[:-1]):
-                dt = self.time_steps[idx+1] - t
-                self.assemble_step(t)
-                u_pre = u[:, idx]
-                u[:, idx+1] = (dt*self.diff_op + np.eye(len(u_pre)))@u_pre + dt*self.rhs  # from u at time t, gives u at t+dt
-            info = None
+        u_current = self._initial_state()
+        if self.store_only_observed:
+            u = np.empty((len(u_current), len(self._time_obs_indices)))
+        else:
+            u = np.empty((len(u_current), len(self.time_steps)))
+        self._store_time_step(u, 0, u_current)
 
-        if self.method == 'backward_euler':
-            for idx, t in enumerate(self.time_steps[1:]):
-                dt = t - self.time_steps[idx]
-                self.assemble_step(t)
-                u_pre = u[:, idx]
-                A = np.eye(len(u_pre)) - dt*self.diff_op
-                # from u at time t-dt, gives u at t
-                u[:, idx+1], info = self._solve_linear_system(
-                    A, u_pre + dt*self.rhs, self._linalg_solve, self._linalg_solve_kwargs)
+        info = None
+        for idx in range(len(self.time_steps)-1):
+            u_current, info = self._step(idx, u_current)
+            self._store_time_step(u, idx+1, u_current)
 
         return u, info
 
+    def gradient_wrt_parameter(self, direction, wrt):
+        """Compute the gradient (direction-Jacobian product) of the observed solution with respect to the parameter `wrt` using the discrete adjoint of the time stepping method.
+
+        The gradient requires at least one of `initial_condition_gradient`, `source_term_gradient` and `diff_op_gradient` (see the class documentation), the parts of the PDE form without a provided gradient are assumed to be independent of the parameter. It is not supported if an `observation_map` is set.
+
+        The adjoint equations are solved backward in time with the same (factorized) stepping matrices as :meth:`solve`, so if the differential operator is independent of the parameter a gradient costs about one solve of the PDE. Otherwise, the forward states are also needed and are recomputed from at most `num_checkpoints` stored states (binomial checkpointing).
+        """
+        if self.observation_map is not None:
+            raise NotImplementedError("Gradient is not implemented for TimeDependentLinearPDE with an observation_map.")
+        if self.initial_condition_gradient is None and self.source_term_gradient is None and self.diff_op_gradient is None:
+            raise NotImplementedError("Gradient is not implemented for this TimeDependentLinearPDE. Provide at least one of initial_condition_gradient, source_term_gradient and diff_op_gradient.")
+
+        # Reuse the assembly (and factorizations) if the PDE is assembled at wrt
+        key = _parameter_key(wrt)
+        if key is None or key != getattr(self, "_assembled_parameter_key", None):
+            self.assemble(wrt)
+
+        theta = self._THETA[self.method.lower()]
+        time_steps = self.time_steps
+        num_steps = len(time_steps)-1
+        weights = self._observe_adjoint(direction)
+        u_initial = self._initial_state()
+
+        # Forward states in reverse order (only needed for the gradient of the differential operator)
+        if self.diff_op_gradient is not None:
+            states = self._states_in_reverse(u_initial)
+            u_n = next(states)
+
+        grad = 0
+        adjoint_next = None # Adjoint state of time step n+1
+        for n in range(num_steps, -1, -1):
+            # Right-hand side of the adjoint equation of time step n
+            rhs = np.array(weights.get(n, np.zeros(len(u_initial))), dtype=float)
+            if n < num_steps:
+                rhs += adjoint_next
+                if theta < 1:
+                    dt = time_steps[n+1] - time_steps[n]
+                    rhs += (1-theta)*dt*np.ravel(self._explicit_operator(time_steps[n]).T@adjoint_next)
+
+            if n == 0:
+                break
+
+            # Adjoint state of time step n
+            dt = time_steps[n] - time_steps[n-1]
+            if theta > 0:
+                self._assemble_at(time_steps[n])
+                adjoint, _ = self._solve_implicit_step(rhs, theta*dt, trans=True)
+            else:
+                adjoint = rhs
+
+            # Contributions of the time step from n-1 to n
+            if self.diff_op_gradient is not None:
+                u_prev = next(states)
+            for t, weight in [(time_steps[n], theta), (time_steps[n-1], 1-theta)]:
+                if weight == 0:
+                    continue
+                if self.source_term_gradient is not None:
+                    grad = grad + weight*dt*self.source_term_gradient(adjoint, wrt, t)
+                if self.diff_op_gradient is not None:
+                    u = u_n if t == time_steps[n] else u_prev
+                    grad = grad + weight*dt*self.diff_op_gradient(adjoint, wrt, t, u)
+
+            if self.diff_op_gradient is not None:
+                u_n = u_prev
+            adjoint_next = adjoint
+
+        if self.initial_condition_gradient is not None:
+            grad = grad + self.initial_condition_gradient(rhs, wrt)
+        return grad
+
+    def _assemble_at(self, t):
+        """Make sure the time step at time t is assembled (the time invariant PDE is assembled once)"""
+        if not self.time_invariant and self._assembled_time != t:
+            self.assemble_step(t)
+
+    def _initial_state(self):
+        """Return the initial condition as an array"""
+        self._assemble_at(self.time_steps[0])
+        return np.asarray(self.initial_condition, dtype=float)
+
+    def _explicit_operator(self, t):
+        """Return the differential operator at time t for matrix-vector products"""
+        if self.time_invariant:
+            return self._diff_op_internal
+        self._assemble_at(t)
+        return self.diff_op
+
+    def _step(self, idx, u_current):
+        """Advance the solution u_current from time step idx to idx+1 and return the solution and info"""
+        theta = self._THETA[self.method.lower()]
+        dt = self.time_steps[idx+1] - self.time_steps[idx]
+
+        # Explicit part with operator and source term at time t
+        b = u_current
+        if theta < 1:
+            diff_op = self._explicit_operator(self.time_steps[idx])
+            # (ravel in case the operator is a numpy matrix)
+            b = b + (1-theta)*dt*(np.ravel(diff_op@u_current) + self.rhs)
+        if theta == 0:
+            return b, None
+
+        # Implicit part with operator and source term at time t+dt
+        self._assemble_at(self.time_steps[idx+1])
+        return self._solve_implicit_step(b + theta*dt*self.rhs, theta*dt)
+
+    def _states_in_reverse(self, u_initial):
+        """Yield the states of all time steps in reverse order. At most `num_checkpoints` states are stored at once and the other states are recomputed from the stored ones using binomial checkpointing (Griewank and Walther, 2000)."""
+        num_steps = len(self.time_steps)-1
+
+        def advance(u, start, stop):
+            for idx in range(start, stop):
+                u, _ = self._step(idx, u)
+            return u
+
+        def reverse(u_start, start, stop, num_checkpoints):
+            # Yield the states of time steps stop, stop-1, ..., start+1 given the state at time step start
+            if stop - start == 1:
+                yield advance(u_start, start, stop)
+            elif num_checkpoints == 0:
+                for idx in range(stop, start, -1):
+                    yield advance(u_start, start, idx)
+            else:
+                # Checkpoint the state after binomial(num_checkpoints+r-1, num_checkpoints) steps
+                # where r is the smallest number of recomputations that can reverse the steps
+                r = 1
+                while comb(num_checkpoints+r, num_checkpoints) < stop - start:
+                    r += 1
+                mid = start + comb(num_checkpoints+r-1, num_checkpoints)
+                u_mid = advance(u_start, start, mid)
+                yield from reverse(u_mid, mid, stop, num_checkpoints-1)
+                yield u_mid
+                if mid - 1 > start:
+                    yield from reverse(u_start, start, mid-1, num_checkpoints)
+
+        if self.num_checkpoints is None or self.num_checkpoints >= num_steps:
+            states = [u_initial]
+            for idx in range(num_steps):
+                states.append(self._step(idx, states[-1])[0])
+            yield from reversed(states)
+        else:
+            yield from reverse(u_initial, 0, num_steps, self.num_checkpoints)
+            yield u_initial
+
+    def _store_time_step(self, u, idx, u_current):
+        """Store the solution `u_current` at time step idx in u (if it is stored)"""
+        if not self.store_only_observed:
+            u[:, idx] = u_current
+        elif idx in self._time_obs_indices:
+            u[:, self._time_obs_indices == idx] = u_current[:, None]
+
+    def _solve_implicit_step(self, b, dt_implicit, trans=False):
+        """Solve (I - dt_implicit*A)*x = b (or the transposed system if trans is True) for the currently assembled operator A and return the solution and info"""
+        if self.time_invariant:
+            A = self._time_invariant_stepping_matrix(dt_implicit)
+        else:
+            diff_op = self.diff_op
+            if getattr(self, "_identity", None) is None or self._identity.shape != diff_op.shape \
+                    or scipy.sparse.issparse(self._identity) != scipy.sparse.issparse(diff_op):
+                self._identity = _identity_like(diff_op)
+            A = self._identity - dt_implicit*diff_op
+            if self.factorize:
+                A = _LUFactorization(A)
+
+        if isinstance(A, _LUFactorization):
+            return A.solve(b, trans=trans), None
+        return self._solve_linear_system(A.T if trans else A, b, self._linalg_solve, self._linalg_solve_kwargs)
+
+    def _time_invariant_stepping_matrix(self, dt_implicit):
+        """Return I - dt_implicit*A for the time invariant operator A (as a factorization if `factorize` is True). The matrices are built once and reused for time steps of the same size (up to round-off)."""
+        for dt, stepping_matrix in self._stepping_matrices:
+            if np.isclose(dt, dt_implicit, rtol=1e-10, atol=0):
+                return stepping_matrix
+
+        if self.factorize:
+            diff_op = self._diff_op_internal
+            stepping_matrix = _LUFactorization(_identity_like(diff_op) - dt_implicit*diff_op)
+        else:
+            # The matrix is passed to linalg_solve so keep the type of the assembled operator
+            stepping_matrix = _identity_like(self.diff_op) - dt_implicit*self.diff_op
+        self._stepping_matrices.append((dt_implicit, stepping_matrix))
+        return stepping_matrix
+
+    def _observe_adjoint(self, direction):
+        """Apply the transpose of the (linear) observation of the solution to direction. Returns a dictionary with the non-zero columns of the result indexed by time step."""
+        num_obs_times = len(self._time_obs)
+        direction = np.asarray(direction, dtype=float).reshape(-1, num_obs_times)
+
+        if self.grids_equal and np.all(self.time_steps[-1:] == self._time_obs):
+            return {len(self.time_steps)-1: direction[:, -1]}
+
+        if not self.grids_equal:
+            direction = _interpolation_matrix(self.grid_sol, self.grid_obs).T@direction
+
+        if self.store_only_observed:
+            weights = {}
+            for k, idx in enumerate(self._time_obs_indices):
+                weights[idx] = weights.get(idx, 0) + direction[:, k]
+            return weights
+
+        weights = direction@_interpolation_matrix(self.time_steps, self._time_obs)
+        return {idx: weights[:, idx] for idx in range(len(self.time_steps))}
+
     def observe(self, solution):
 
         # If observation grid is the same as solution grid and observation time
@@ -276,6 +587,11 @@ class TimeDependentLinearPDE(LinearPDE):
         if self.grids_equal and np.all(self.time_steps[-1:] == self._time_obs):
             solution_obs = solution[..., -1]
 
+        # Solution is only stored at the observation times so no need to
+        # interpolate in time
+        elif self.store_only_observed and self.grids_equal:
+            solution_obs = solution
+
         # Interpolate solution in time and space to the observation
         # time and space
         else:
@@ -289,10 +605,15 @@ class TimeDependentLinearPDE(LinearPDE):
                                  "time_obs as None.")
             
             # Interpolate solution in space and time to the observation
-            # time and space
-            solution_obs = scipy.interpolate.RectBivariateSpline(
-                self.grid_sol, self.time_steps, solution)(self.grid_obs,
-                                                          self._time_obs)
+            # time and space (only in space if the solution is only stored
+            # at the observation times)
+            if self.store_only_observed:
+                solution_obs = scipy.interpolate.make_interp_spline(
+                    self.grid_sol, solution, k=3, axis=0)(self.grid_obs)
+            else:
+                solution_obs = scipy.interpolate.RectBivariateSpline(
+                    self.grid_sol, self.time_steps, solution)(self.grid_obs,
+                                                              self._time_obs)
 
         # Apply observation map
         if self.observation_map is not None:
@@ -303,3 +624,76 @@ class TimeDependentLinearPDE(LinearPDE):
             solution_obs = solution_obs.squeeze()
 
         return solution_obs
+
+
+class _LUFactorization:
+    """LU factorization of a dense or sparse square matrix A for repeated solves with A and its transpose."""
+
+    def __init__(self, A):
+        self.sparse = scipy.sparse.issparse(A)
+        if self.sparse:
+            self._lu = scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(A))
+        else:
+            self._lu = scipy.linalg.lu_factor(np.asarray(A))
+
+    def solve(self, b, trans=False):
+        """Solve A*x=b (or A^T*x=b if trans is True) for one or more right-hand sides b."""
+        b = np.asarray(b)
+        if self.sparse:
+            return self._lu.solve(b.astype(np.result_type(b, float), copy=False), trans="T" if trans else "N")
+        return scipy.linalg.lu_solve(self._lu, b, trans=1 if trans else 0)
+
+
+class _FactorizationLRU:
+    """Least recently used cache of factorizations keyed by the parameter the operator was assembled with."""
+
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """Return the cached factorization for key or compute (and cache) it by calling `compute()`."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        factorization = compute()
+        if self.maxsize > 0:
+            self._entries[key] = factorization
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return factorization
+
+
+def _parameter_key(parameter):
+    """Return a hashable key of the value of a parameter or None if the parameter is not a numeric array."""
+    try:
+        value = np.asarray(parameter)
+    except Exception:
+        return None
+    if value.dtype.kind not in "biuf":
+        return None
+    return (value.dtype.str, value.shape, value.tobytes())
+
+
+def _sparsify(A, max_density=0.1):
+    """Return A as a sparse CSR matrix if it is a dense array with at most a fraction max_density of non-zeros, otherwise return A unchanged."""
+    if isinstance(A, np.ndarray) and A.ndim == 2 and np.count_nonzero(A) <= max_density*A.size:
+        return scipy.sparse.csr_matrix(A)
+    return A
+
+
+def _identity_like(A):
+    """Return an identity matrix of the same shape and (sparse or dense) type as the square matrix A"""
+    if scipy.sparse.issparse(A):
+        return scipy.sparse.identity(A.shape[0], format="csr")
+    return np.eye(A.shape[0])
+
+
+def _interpolation_matrix(grid, points):
+    """Return the matrix that maps values on grid to their cubic spline interpolation at points (the spline interpolation used by :meth:`TimeDependentLinearPDE.observe`)"""
+    return scipy.interpolate.make_interp_spline(grid, np.eye(len(grid)), k=3, axis=0)(points)
@@ -751,19 +751,22 @@ class BayesianProblem(object):
             display info messages? (True or False).
         """
         
-        # Get the function to minimize (negative log-likelihood or negative log-posterior)
-        def func(x): return -density.logd(x)
-
         # Initial value if not given
         if x0 is None:
             x0 = np.ones(self.model.domain_dim)
 
-        # Get the gradient (if available)
+        # Get the function to minimize (negative log-likelihood or negative log-posterior)
+        # If the gradient is available the function returns it together with the
+        # function value to share computations (e.g. forward model evaluations)
         try: 
-            density.gradient(x0)
-            def gradfunc(x): return -density.gradient(x)
+            density.logd_and_gradient(x0)
+            def func(x):
+                logd, gradient = density.logd_and_gradient(x)
+                return -logd, -gradient
+            gradfunc = True
             if disp: print("Optimizing with exact gradients")
         except (NotImplementedError, AttributeError):
+            def func(x): return -density.logd(x)
             gradfunc = None
             if disp: print("Optimizing with approximate gradients.") 
 
@@ -1 +1,2 @@
 from ._samples import Samples, JointSamples
+from ._online_statistics import OnlineStatistics
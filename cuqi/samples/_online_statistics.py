@@ -0,0 +1,204 @@
+import numpy as np
+
+
+class OnlineStatistics(object):
+    """
+    Pointwise statistics of samples computed online, i.e. updated one sample at a time without storing the samples.
+
+    The mean and variance are computed with Welford's algorithm. The median and credibility interval are
+    estimated with the P² algorithm (Jain and Chlamtac, 1985), which tracks five markers per quantile.
+    The effective sample size is estimated from running autocovariances up to `max_lag`.
+    The memory used is O(dim*max_lag), independent of the number of samples.
+
+    The object can be passed as `statistics` to :meth:`cuqi.experimental.mcmc.Sampler.sample`
+    (possibly with `store_samples=False`), or be used as a sampler callback since calling it
+    with (sample, sample_index) updates the statistics.
+
+    Parameters
+    ----------
+    dim : int
+        Dimension of the samples.
+
+    percent : float, default 95
+        Percent of the credibility interval returned by :meth:`compute_ci`.
+
+    max_lag : int, default 100
+        Maximum lag of the autocovariances used to estimate the effective sample size.
+
+    Example
+    -------
+    .. code-block:: python
+
+        stats = cuqi.samples.OnlineStatistics(sampler.dim)
+        sampler.warmup(1000).sample(100000, store_samples=False, statistics=stats)
+        mean, std, ci, ess = stats.mean(), stats.std(), stats.compute_ci(), stats.compute_ess()
+
+    """
+    def __init__(self, dim, percent=95, max_lag=100):
+        self.dim = dim
+        self.percent = percent
+        self.max_lag = max_lag
+
+        self._Ns = 0
+        self._mean = np.zeros(dim)
+        self._M2 = np.zeros(dim)
+
+        lb = (100-percent)/2
+        self._quantiles = _P2Quantiles([0.5, lb/100, 1-lb/100], dim)
+
+        # Running sums for the autocovariance at lag k: sum_t x_t*x_{t-k}, sum_t x_t and sum_t x_{t-k} (t>=k)
+        self._lagged = np.zeros((2*(max_lag+1), dim)) # Last max_lag+1 samples (stored twice in a circular buffer)
+        self._sum_products = np.zeros((max_lag+1, dim))
+        self._sum_leading = np.zeros((max_lag+1, dim))
+        self._sum_lagging = np.zeros((max_lag+1, dim))
+
+    @property
+    def Ns(self):
+        """Return number of samples the statistics are computed from"""
+        return self._Ns
+
+    def update(self, sample):
+        """ Update the statistics with a new sample. """
+        x = np.asarray(sample, dtype=float).reshape(self.dim)
+        self._Ns += 1
+
+        # Welford update of mean and sum of squared deviations
+        delta = x - self._mean
+        self._mean += delta/self._Ns
+        self._M2 += delta*(x - self._mean)
+
+        self._quantiles.update(x)
+
+        # Autocovariance sums for the lags available so far
+        # The buffer holds each sample twice such that the last max_lag+1 samples
+        # (most recent first) are a contiguous slice
+        L = self.max_lag+1
+        pos = (-self._Ns) % L
+        self._lagged[pos] = x
+        self._lagged[pos+L] = x
+        lagged = self._lagged[pos:pos+L]
+        K = min(self._Ns, L)
+        self._sum_products[:K] += x*lagged[:K]
+        self._sum_leading[:K] += x
+        self._sum_lagging[:K] += lagged[:K]
+
+    def __call__(self, sample, sample_index=None):
+        """ Update the statistics with a new sample. Allows the object to be used as a sampler callback. """
+        self.update(sample)
+
+    def _raise_error_if_empty(self):
+        if self._Ns == 0:
+            raise ValueError("Cannot compute statistics before any samples have been added.")
+
+    def mean(self):
+        """Compute mean of the samples."""
+        self._raise_error_if_empty()
+        return self._mean.copy()
+
+    def variance(self):
+        """Compute pointwise variance of the samples"""
+        self._raise_error_if_empty()
+        return self._M2/self._Ns
+
+    def std(self):
+        """Compute pointwise standard deviation of the samples"""
+        return np.sqrt(self.variance())
+
+    def median(self):
+        """Estimate pointwise median of the samples"""
+        self._raise_error_if_empty()
+        return self._quantiles.values()[0]
+
+    def compute_ci(self):
+        """Estimate pointwise credibility intervals (with the percent given at initialization) of the samples."""
+        self._raise_error_if_empty()
+        return self._quantiles.values()[1:]
+
+    def compute_autocovariance(self):
+        """ Compute the pointwise autocovariance of the samples for lags 0, ..., min(max_lag, Ns-1) as an array of shape (lags, dim). """
+        self._raise_error_if_empty()
+        K = min(self._Ns, self.max_lag+1)
+        m = self._mean
+        n_k = (self._Ns - np.arange(K))[:, None]
+        return (self._sum_products[:K] - m*(self._sum_leading[:K] + self._sum_lagging[:K]) + n_k*m**2)/self._Ns
+
+    def compute_ess(self):
+        """ Estimate the pointwise effective sample size using Geyer's initial positive sequence of autocorrelations (truncated at max_lag). """
+        autocov = self.compute_autocovariance()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho = autocov/autocov[0]
+
+        # Sum pairs of autocorrelations (rho_2m + rho_2m+1) while they are positive
+        num_pairs = rho.shape[0]//2
+        pairs = rho[:2*num_pairs:2] + rho[1:2*num_pairs:2]
+        positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+        tau = -1 + 2*np.sum(np.where(positive, pairs, 0), axis=0)
+        tau = np.maximum(tau, 1/np.log10(max(self._Ns, 10))) # Guard against (near) zero tau as arviz does
+
+        ess = self._Ns/tau
+        ess[~np.isfinite(ess)] = self._Ns # Constant chains
+        return ess
+
+    def __repr__(self) -> str:
+        return "CUQIpy OnlineStatistics:\n" + \
+               "------------------------\n\n" + \
+               "Ns (number of samples):\n {}\n\n".format(self.Ns) + \
+               "Dimension:\n {}\n\n".format(self.dim)
+
+
+class _P2Quantiles(object):
+    """ Pointwise estimates of the p-quantiles for each p in `probabilities` using the P² algorithm (Jain and Chlamtac, 1985), vectorized over quantiles and dimensions. """
+
+    def __init__(self, probabilities, dim):
+        p = np.repeat(np.asarray(probabilities, dtype=float), dim) # (Q*dim,)
+        self.probabilities = probabilities
+        self.dim = dim
+        self._initial = [] # First five observations
+        self._q = None # Marker heights (5, Q*dim)
+        self._n = None # Marker positions (5, Q*dim)
+        self._desired = np.array([np.ones_like(p), 1+2*p, 1+4*p, 3+2*p, 5*np.ones_like(p)])
+        self._increment = np.array([np.zeros_like(p), p/2, p, (1+p)/2, np.ones_like(p)])
+
+    def update(self, x):
+        if self._q is None:
+            self._initial.append(x.copy())
+            if len(self._initial) == 5:
+                self._q = np.tile(np.sort(np.array(self._initial), axis=0), (1, len(self.probabilities)))
+                self._n = np.tile(np.arange(1, 6, dtype=float)[:, None], (1, self._q.shape[1]))
+                self._initial = None
+            return
+
+        q, n = self._q, self._n
+        x = np.tile(x, len(self.probabilities))
+
+        # Find cell k such that q_k <= x < q_k+1 and adjust extreme markers
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+
+        # Increment positions of markers above k and the desired positions
+        n[1:] += np.arange(1, 5)[:, None] > k
+        self._desired += self._increment
+
+        # Adjust heights of the three middle markers if needed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(1, 4):
+                d = self._desired[i] - n[i]
+                adjust = ((d >= 1) & (n[i+1]-n[i] > 1)) | ((d <= -1) & (n[i-1]-n[i] < -1))
+                if not adjust.any():
+                    continue
+                d = np.sign(d)
+                parabolic = q[i] + d/(n[i+1]-n[i-1])*(
+                    (n[i]-n[i-1]+d)*(q[i+1]-q[i])/(n[i+1]-n[i]) +
+                    (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                use_parabolic = (q[i-1] < parabolic) & (parabolic < q[i+1])
+                up = d > 0
+                linear = q[i] + d*(np.where(up, q[i+1], q[i-1])-q[i])/(np.where(up, n[i+1], n[i-1])-n[i])
+                q[i] = np.where(adjust, np.where(use_parabolic, parabolic, linear), q[i])
+                n[i] += np.where(adjust, d, 0)
+
+    def values(self):
+        """ Return the quantile estimates as an array of shape (Q, dim). """
+        if self._q is None:
+            return np.percentile(np.array(self._initial), 100*np.asarray(self.probabilities), axis=0)
+        return self._q[2].reshape(len(self.probabilities), self.dim).copy()
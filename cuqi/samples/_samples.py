@@ -1,10 +1,16 @@
+import os
+import re
+import zipfile
+import tempfile
 import numpy as np
+import cuqi
 import matplotlib.pyplot as plt
-from cuqi.diagnostics import Geweke
+from cuqi.diagnostics import Geweke, compute_ess, compute_rhat
 from cuqi.geometry import _DefaultGeometry1D, Continuous2D, Image2D
 from cuqi.array import CUQIarray
 from cuqi.utilities import force_ndarray
 from copy import copy
+from abc import ABC, abstractmethod
 from numbers import Number
 
 try:
@@ -43,6 +49,52 @@ class Samples(object):
         self.samples = samples
         self.is_vec = is_vec
 
+    @classmethod
+    def from_batches(cls, path, geometry=None):
+        """ Create a Samples object from sample batches stored on disk.
+
+        The batches are the `batch_XXXX.npz` files written when sampling with a batch size,
+        e.g. :meth:`cuqi.experimental.mcmc.Sampler.sample` with `batch_size>0`.
+
+        The batches are not loaded into memory when the Samples object is created. Instead the
+        returned object is a lazily concatenated view over the batches: :meth:`burnthin` only
+        updates the view and :meth:`mean`, :meth:`variance`, :meth:`std`, :meth:`median` and
+        :meth:`compute_ci` are computed by loading one batch at a time. Accessing the `samples`
+        attribute (e.g. for plotting) loads and concatenates all (selected) samples.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory containing the batch files.
+
+        geometry : cuqi.geometry.Geometry, default None
+            Geometry of the samples.
+
+        Example
+        -------
+        .. code-block:: python
+
+            sampler.sample(100000, batch_size=1000, sample_path='./CUQI_samples/')
+            samples = cuqi.samples.Samples.from_batches('./CUQI_samples/')
+            mean = samples.burnthin(1000).mean()
+
+        """
+        files = []
+        for file in os.listdir(path):
+            match = re.fullmatch(r"batch_(\d+)\.npz", file)
+            if match:
+                files.append((int(match.group(1)), os.path.join(path, file)))
+        if len(files) == 0:
+            raise ValueError(f"No sample batches (batch_XXXX.npz files) found in {path}.")
+        files = [file for _, file in sorted(files)]
+
+        shapes = [_read_npz_array_shape(file, "samples") for file in files]
+        dim = int(np.prod(shapes[0][1:]))
+        if any(int(np.prod(shape[1:])) != dim for shape in shapes):
+            raise ValueError(f"Sample batches in {path} do not have the same dimension.")
+
+        return _BatchedSamples(files, [shape[0] for shape in shapes], dim, geometry=geometry)
+
     def _sub_samples(self, indices):
         """Returns a new Samples object with the samples indexed by indices."""
         sub_samples = self.samples[..., indices]
@@ -63,6 +115,11 @@ class Samples(object):
             for i in range(self.Ns):
                 yield self.samples[..., i]
 
+    def _iter_chunks(self, size):
+        """Yield the samples in chunks of at most `size` samples stacked along the last axis."""
+        for start in range(0, self.Ns, size):
+            yield self.samples[..., start:start+size]
+
     @property
     def shape(self):
         """Returns the shape of samples."""
@@ -94,7 +151,9 @@ class Samples(object):
 
     @property
     def funvals(self):
-        """Returns a new Samples object of sample function values. If samples are already function values, the Samples object itself is returned.""" 
+        """Returns a new Samples object of sample function values. If samples are already function values, the Samples object itself is returned.
+
+        Function values of parameter samples (with array-valued functions) are evaluated lazily: they are converted in chunks of at most :attr:`cuqi.config.BATCH_SIZE` samples and moments such as :meth:`mean` and :meth:`variance` are accumulated one chunk at a time without storing the values. The values are only stored (in memory, or in a temporary file for large sets) when percentiles (e.g. :meth:`compute_ci`) are computed or the `samples` attribute is accessed.""" 
 
         # Return self if the samples are function values
         # i.e. not parameters or vector representations
@@ -108,6 +167,12 @@ class Samples(object):
         else:
             convert = self.geometry.vec2fun
 
+        # Function values of parameter samples are converted lazily (on
+        # access or one chunk at a time when computing statistics)
+        if self.geometry.fun_is_array and self.is_par and \
+                not isinstance(self.samples, list):
+            return _FunvalsSamples(self)
+
         # Convert the samples to function values
         
         # If the function representation is an array, return funvals samples
@@ -166,10 +231,18 @@ class Samples(object):
             convert = \
                 lambda vec: self.geometry.fun2par(self.geometry.vec2fun(vec))
             
-        # Convert the samples to parameter values
+        # Convert the samples to parameter values (function values are
+        # converted in chunks of at most cuqi.config.BATCH_SIZE samples)
         parameters = np.empty((self.geometry.par_dim, self.Ns))
-        for i, value in enumerate(self):
-            parameters[:, i] = convert(value)
+        if not self.is_vec and self.geometry.fun_is_array:
+            start = 0
+            for chunk in self._iter_chunks(max(int(cuqi.config.BATCH_SIZE), 1)):
+                end = start+chunk.shape[-1]
+                parameters[:, start:end] = self.geometry._fun2par_batch(chunk)
+                start = end
+        else:
+            for i, value in enumerate(self):
+                parameters[:, i] = convert(value)
 
         # Create and return a new Samples object of parameters
         return Samples(parameters, is_par=True, is_vec=True,
@@ -753,20 +826,18 @@ class Samples(object):
     def compute_ess(self, **kwargs):
         """ Compute effective sample size (ESS) of samples.
         
-        Any remaining keyword arguments will be passed to the arviz computing tool.
-        See https://arviz-devs.github.io/arviz/api/generated/arviz.ess.html.
+        The ESS is computed for all variables at once (without arviz) following
+        Vehtari et al. (2021), see :func:`cuqi.diagnostics.compute_ess`.
+
+        Any remaining keyword arguments (`method`, `prob` and `relative`) will be passed
+        to :func:`cuqi.diagnostics.compute_ess`.
 
         Returns
         -------
         Numpy array with effective sample size for each variable.
         """
-        _check_for_arviz()
-        ESS_xarray = arviz.ess(self.to_arviz_inferencedata(), **kwargs)
-        ESS_items = ESS_xarray.items()
-        ESS = np.empty(len(ESS_items))
-        for i, (key, value) in enumerate(ESS_items):
-            ESS[i] = value.to_numpy()
-        return ESS
+        self._raise_error_if_not_vec(self.compute_ess.__name__)
+        return compute_ess(self.samples, **kwargs)
 
     def compute_rhat(self, chains, **kwargs):
         """ Compute rhat value of samples given list of cuqi.samples.Samples objects (chains) to compare with.
@@ -779,8 +850,9 @@ class Samples(object):
             List of cuqi.samples.Samples objects each representing a single MCMC chain to compare with.
             Each Samples object must have the same geometry as the original Samples object.
 
-        Any remaining keyword arguments will be passed to the arviz computing tool.
-        See https://arviz-devs.github.io/arviz/api/generated/arviz.rhat.html.
+        Any remaining keyword arguments (`method`) will be passed to :func:`cuqi.diagnostics.compute_rhat`.
+        By default the rank normalized split-R-hat of Vehtari et al. (2021) is computed for all
+        variables at once (without arviz).
 
         Returns
         -------
@@ -801,29 +873,10 @@ class Samples(object):
 
         if len(self.samples.shape) != 2:
             raise TypeError("Raw samples within each chain must have len(shape)==2, i.e. (variable, draws) structure.")
-        
-        # Get variable names from geometry
-        variables = np.array(self.geometry.variables) #Convert to np array for better slicing
-        variables = variables.flatten()
 
-        # Construct full samples for all chains
-        samples = np.empty((self.samples.shape[0], n_chains+1, self.samples.shape[1]))
-        samples[:,0,:] = self.samples
-        for i, chain in enumerate(chains):
-            samples[:,i+1,:] = chain.samples
-
-        # Construct inference data structure
-        datadict =  dict(zip(variables,samples))
-
-        # Compute rhat
-        _check_for_arviz()
-        RHAT_xarray = arviz.rhat(datadict, **kwargs)
-
-        # Convert to numpy array
-        RHAT = np.empty(self._geometry_shape)
-        for i, (key, value) in enumerate(RHAT_xarray.items()):
-            RHAT[i] = value.to_numpy()
-        return RHAT
+        # Compute rhat (the chains are stacked for a block of variables at a time)
+        RHAT = compute_rhat([self.samples]+[chain.samples for chain in chains], **kwargs)
+        return RHAT.reshape(self._geometry_shape)
 
     def plot_violin(self, variable_indices=None, **kwargs):
         """ Create a violin plot of the samples. 
@@ -868,6 +921,264 @@ class Samples(object):
                "Shape:\n {}\n\n".format(self.shape) + \
                "Samples:\n {}\n\n".format(self.samples)
 
+class _ChunkedSamples(Samples, ABC):
+    """ Samples that are not held in memory but produced one chunk at a time by `_iter_batches`.
+
+    Statistics are computed by streaming through the chunks. The moments are computed once and
+    stored. Percentiles are computed from a store of all sample values, which is only written
+    (in a single pass over the chunks, see `_values`) when a percentile is requested. Accessing
+    the `samples` attribute loads and concatenates all chunks.
+    """
+
+    _MAX_ELEMENTS_IN_MEMORY = 10**7
+    """ Maximum number of sample values held in memory when computing percentiles. """
+
+    _moments = None # Stored result of _compute_moments
+    _store = None # Stored sample values of shape (dim, Ns), see _values
+    _store_file = None # Temporary file backing _store if it is memory-mapped
+
+    def __init__(self, geometry=None, is_par=True, is_vec=True):
+        # The samples are produced by _iter_batches, so no samples are passed to Samples
+        super().__init__(None, geometry=geometry, is_par=is_par, is_vec=is_vec)
+
+    @property
+    def samples(self):
+        """ The samples loaded (and concatenated) from all chunks. """
+        return self._load_samples()
+
+    @samples.setter
+    def samples(self, value):
+        if value is not None:
+            raise AttributeError(f"The samples of {self.__class__.__name__} are produced from chunks and cannot be set.")
+
+    @abstractmethod
+    def _iter_batches(self):
+        """ Yield the samples as arrays with the samples stacked along the last axis, one chunk at a time. """
+        pass
+
+    def _load_samples(self):
+        """ Load and concatenate the samples of all chunks. """
+        batches = list(self._iter_batches())
+        if len(batches) == 0:
+            return np.empty(self.shape)
+        return np.concatenate(batches, axis=-1)
+
+    def _iter_chunks(self, size):
+        for batch in self._iter_batches():
+            for start in range(0, batch.shape[-1], size):
+                yield batch[..., start:start+size]
+
+    def __iter__(self):
+        for batch in self._iter_batches():
+            for i in range(batch.shape[-1]):
+                yield batch[..., i]
+
+    def _compute_moments(self):
+        """ Compute the pointwise mean and sum of squared deviations of the samples by combining batch-wise moments (Chan et al.). The result is stored for later calls. """
+        if self._moments is not None:
+            return self._moments
+        n = 0
+        mean = np.zeros(self.shape[:-1])
+        M2 = np.zeros(self.shape[:-1])
+        for batch in self._iter_batches():
+            n_b = batch.shape[-1]
+            if n_b == 0:
+                continue
+            mean_b = np.mean(batch, axis=-1)
+            M2_b = np.sum(np.square(batch - mean_b[..., None]), axis=-1)
+            delta = mean_b - mean
+            mean = mean + delta*n_b/(n+n_b)
+            M2 = M2 + M2_b + np.square(delta)*n*n_b/(n+n_b)
+            n += n_b
+        if n == 0:
+            raise ValueError("Cannot compute statistics of an empty set of samples.")
+        self._moments = (mean, M2, n)
+        return self._moments
+
+    def _values(self):
+        """ All sample values as an array of shape (dim, Ns) written in a single pass over the chunks and stored for later calls. The values are held in memory if there are at most `_MAX_ELEMENTS_IN_MEMORY` of them, and otherwise in a temporary file (kept open with the store and removed when it is garbage collected). """
+        if self._store is None:
+            dim = int(np.prod(self.shape[:-1]))
+            if dim*self.Ns <= self._MAX_ELEMENTS_IN_MEMORY:
+                store = np.empty((dim, self.Ns))
+            else:
+                self._store_file = tempfile.TemporaryFile()
+                store = np.memmap(self._store_file, dtype=float, mode="w+", shape=(dim, self.Ns))
+            start = 0
+            for batch in self._iter_store_batches():
+                end = start+batch.shape[-1]
+                store[:, start:end] = batch.reshape(dim, -1)
+                start = end
+            self._store = store
+        return self._store
+
+    def _iter_store_batches(self):
+        """ Yield the chunks written to the store of sample values (see `_values`). """
+        return self._iter_batches()
+
+    def _compute_percentiles(self, q):
+        """ Compute pointwise percentiles from the stored sample values (see `_values`) for a block of coordinates at a time such that at most `_MAX_ELEMENTS_IN_MEMORY` values are loaded. """
+        values = self._values()
+        dim = values.shape[0]
+        block = max(1, self._MAX_ELEMENTS_IN_MEMORY//max(self.Ns, 1))
+        results = [np.percentile(values[i:i+block], q, axis=-1) for i in range(0, dim, block)]
+        return np.concatenate(results, axis=-1).reshape(np.shape(q)+tuple(self.shape[:-1]))
+
+    def mean(self):
+        return self._compute_moments()[0]
+
+    def variance(self):
+        _, M2, n = self._compute_moments()
+        return M2/n
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def median(self):
+        return self._compute_percentiles(50)
+
+    def compute_ci(self, percent=95):
+        lb = (100-percent)/2
+        up = 100-lb
+        return self._compute_percentiles([lb, up])
+
+
+class _BatchedSamples(_ChunkedSamples):
+    """ Samples stored on disk in batches. See :meth:`Samples.from_batches`.
+
+    The selected samples are the samples with (global) indices `start`, `start+step`, ...
+    Only one batch is loaded into memory at a time when computing statistics.
+    """
+
+    def __init__(self, files, batch_sizes, dim, geometry=None, start=0, step=1):
+        self._files = files
+        self._batch_sizes = batch_sizes
+        self._dim = dim
+        self._start = start
+        self._step = step
+        super().__init__(geometry=geometry)
+
+    @property
+    def shape(self):
+        return (self._dim, self.Ns)
+
+    @property
+    def Ns(self):
+        return len(range(self._start, sum(self._batch_sizes), self._step))
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            self._geometry = _DefaultGeometry1D(grid=self._dim)
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, inGeometry):
+        self._geometry = inGeometry
+
+    @property
+    def funvals(self):
+        if self.geometry.fun_is_array:
+            return _FunvalsSamples(self)
+        return super().funvals
+
+    def _iter_batches(self):
+        """ Yield the selected samples of each batch as arrays of shape (dim, n), loading one batch at a time. """
+        offset = 0
+        for file, size in zip(self._files, self._batch_sizes):
+            # First selected global index in this batch
+            first = self._start + max(0, -(-(offset-self._start)//self._step))*self._step
+            if first < offset+size:
+                with np.load(file) as data:
+                    batch = data["samples"].reshape(size, self._dim)
+                yield batch[first-offset::self._step].T
+            offset += size
+
+    def burnthin(self, Nb, Nt=1):
+        if Nb>=self.Ns:
+            raise ValueError(f"Number of burn-in {Nb} is greater than or equal number of samples {self.Ns}")
+        return _BatchedSamples(self._files, self._batch_sizes, self._dim,
+                               geometry=self._geometry,
+                               start=self._start+Nb*self._step,
+                               step=self._step*Nt)
+
+    def __repr__(self) -> str:
+        return "CUQIpy Samples:\n" + \
+               "---------------\n\n" + \
+               "Ns (number of samples):\n {}\n\n".format(self.Ns) + \
+               "Geometry:\n {}\n\n".format(self.geometry) + \
+               "Shape:\n {}\n\n".format(self.shape) + \
+               "Batches:\n {} files in {}\n\n".format(len(self._files), os.path.dirname(self._files[0]))
+
+
+class _FunvalsSamples(_ChunkedSamples):
+    """ Function values of parameter samples. See :attr:`Samples.funvals`.
+
+    The parameter samples are converted to function values in chunks of at most
+    :attr:`cuqi.config.BATCH_SIZE` samples (using a single call to `par2fun` per chunk if the
+    geometry supports it). The mean and variance are computed in one pass over the parameter
+    samples, converting one chunk at a time without holding all function values. The function
+    values are only stored (in memory, or in a temporary file if there are more than
+    `_MAX_ELEMENTS_IN_MEMORY` of them) when a percentile (e.g. :meth:`median`) is requested,
+    and are then reused by later statistics and the `samples` attribute.
+    """
+
+    def __init__(self, par_samples):
+        self._par_samples = par_samples
+        self._funvals = None
+        geometry = par_samples.geometry
+        super().__init__(geometry=geometry, is_par=False, is_vec=len(geometry.fun_shape) <= 1)
+
+    def _load_samples(self):
+        """ The function values of all samples (loaded into memory on first access). """
+        if self._funvals is None:
+            if self._store is not None:
+                self._funvals = np.array(self._store).reshape(self.shape)
+            else:
+                self._funvals = super()._load_samples()
+        return self._funvals
+
+    @property
+    def shape(self):
+        return tuple(self.geometry.fun_shape)+(self.Ns,)
+
+    @property
+    def Ns(self):
+        return self._par_samples.Ns
+
+    def _iter_batches(self):
+        """ Yield the function values in chunks of at most cuqi.config.BATCH_SIZE samples, read from the stored function values if available and otherwise converted from the parameter samples. """
+        if self._funvals is not None:
+            yield self._funvals
+            return
+        if self._store is None:
+            yield from self._iter_store_batches()
+            return
+        batch_size = max(int(cuqi.config.BATCH_SIZE), 1)
+        for start in range(0, self.Ns, batch_size):
+            yield self._store[:, start:start+batch_size].reshape(self.shape[:-1]+(-1,))
+
+    def _iter_store_batches(self):
+        """ Yield the function values converted from chunks of at most cuqi.config.BATCH_SIZE parameter samples. """
+        batch_size = max(int(cuqi.config.BATCH_SIZE), 1)
+        for pars in self._par_samples._iter_chunks(batch_size):
+            yield self.geometry._par2fun_batch(pars)
+
+    def burnthin(self, Nb, Nt=1):
+        return self._par_samples.burnthin(Nb, Nt).funvals
+
+
+def _read_npz_array_shape(file, key):
+    """ Read the shape of the array stored under `key` in the npz file without loading the array. """
+    with zipfile.ZipFile(file) as archive:
+        with archive.open(key+".npy") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, _ = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, _ = np.lib.format.read_array_header_2_0(f)
+    return shape
+
 class JointSamples(dict):
     """ An object used to store samples from :class:`cuqi.distribution.JointDistribution`. 
 
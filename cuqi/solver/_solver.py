@@ -3,17 +3,12 @@ from numpy import linalg as LA
 from scipy.optimize import fmin_l_bfgs_b, least_squares
 import scipy.optimize as opt
 import scipy.sparse as spa
+import scipy.linalg as splinalg
 
 from cuqi.array import CUQIarray
-from cuqi import config
+from cuqi.utilities import _PreparedLinearSolver
 eps = np.finfo(float).eps
 
-try:
-    from sksparse.cholmod import cholesky
-    has_cholmod = True
-except ImportError:
-    has_cholmod = False
-
 
 class L_BFGS_B(object):
     """Wrapper for :meth:`scipy.optimize.fmin_l_bfgs_b`.
@@ -28,8 +23,9 @@ class L_BFGS_B(object):
         Function to minimize.
     x0 : ndarray
         Initial guess.
-    gradfunc : callable f(x,*args), optional
+    gradfunc : callable f(x,*args) or True, optional
         The gradient of func. 
+        If True, func is assumed to return the function value and the gradient.
         If None, then the solver approximates the gradient.
     kwargs : keyword arguments passed to scipy's L-BFGS-B algorithm. See documentation for scipy.optimize.minimize
 
@@ -64,8 +60,10 @@ class L_BFGS_B(object):
             approx_grad = 1
         else:
             approx_grad = 0
+        # If gradfunc is True, func returns both value and gradient (fprime is None)
+        fprime = None if self.gradfunc is True else self.gradfunc
         # run solver
-        solution = fmin_l_bfgs_b(self.func,self.x0, fprime = self.gradfunc, approx_grad = approx_grad, **self.kwargs)
+        solution = fmin_l_bfgs_b(self.func,self.x0, fprime = fprime, approx_grad = approx_grad, **self.kwargs)
         if solution[2]['warnflag'] == 0:
             success = 1
             message = 'Optimization terminated successfully.'
@@ -94,8 +92,9 @@ class minimize(object):
         Function to minimize.
     x0 : ndarray
         Initial guess.
-    gradfunc : callable f(x,*args), optional
+    gradfunc : callable f(x,*args) or True, optional
         The gradient of func. 
+        If True, func is assumed to return the function value and the gradient.
         If None, then the solver approximates the gradient.
     method : str or callable, optional
         Type of solver. Should be one of
@@ -159,9 +158,14 @@ class minimize(object):
 class maximize(minimize):
     """Simply calls ::class:: cuqi.solver.minimize with -func."""
     def __init__(self,func,x0, gradfunc = None, method = None, **kwargs):
-        def nfunc(*args,**kwargs):
-            return -func(*args,**kwargs)
-        if gradfunc is not None:
+        if gradfunc is True: # func returns both value and gradient
+            def nfunc(*args,**kwargs):
+                value, gradient = func(*args,**kwargs)
+                return -value, -gradient
+        else:
+            def nfunc(*args,**kwargs):
+                return -func(*args,**kwargs)
+        if gradfunc is not None and gradfunc is not True:
             def ngradfunc(*args,**kwargs):
                 return -gradfunc(*args,**kwargs)
         else:
@@ -343,8 +347,11 @@ class PCGLS:
         Data vector.
     x0 : ndarray
         Initial guess.    
-    P : ndarray
-        Preconditioner array in sparse format.
+    P : ndarray or sparse matrix
+        (Right) preconditioner, i.e. the least squares problem is solved for A@P^{-1}.
+        A good preconditioner satisfies P^T@P ≈ A^T@A. The preconditioner is factorized
+        when the solver is created (a prepared preconditioner can be passed instead to reuse
+        the factorization for several solves).
     maxit : int
         The maximum number of iterations.
     tol : float
@@ -354,7 +361,6 @@ class PCGLS:
         self._A = A
         self._b = b
         self._x0 = x0
-        self._P = P
         self._maxit = int(maxit)
         self._tol = tol        
         self._shift = shift
@@ -363,17 +369,9 @@ class PCGLS:
             self._explicitA = True
         else:
             self._explicitA = False
-        #
-        if self._dim < config.MAX_DIM_INV:
-            self._explicitPinv = True
-            Pinv = spa.linalg.inv(P)
-        else:
-            self._explicitPinv = False
-            Pinv = None # we do cholesky.solve or sparse.solve with P
-            if has_cholmod:
-                # turn P into a cholesky object
-                P = cholesky(P, ordering_method='natural')
-        self._Pinv = Pinv # inverse of the preconditioner as a ndarray or function
+        if not isinstance(P, _PreparedLinearSolver):
+            P = _PreparedLinearSolver(P)
+        self._P = P
 
     def solve(self):
         # initial state
@@ -441,23 +439,79 @@ class PCGLS:
 
     def _apply_Pinv(self, x, flag):
         # applies the inverse of the preconditioner P: forward or adjoint (see Bjorck (1996) P. 294)
-        if self._explicitPinv:
-            if flag == 1:
-                precond = self._Pinv @ x
-            elif flag == 2:
-                 precond = self._Pinv.T @ x
+        return self._P.solve(x, trans=(flag == 2))
+
+
+def _incomplete_normal_factor(A, drop_tol=1e-4, fill_factor=10):
+    """Compute an upper triangular matrix R with R^T@R ≈ A^T@A from an incomplete LU factorization of A^T@A.
+
+    The result can be used as a (right) preconditioner for least squares solvers such as :class:`PCGLS`.
+    If the incomplete factorization breaks down (e.g. non-positive pivots), the diagonal (Jacobi)
+    preconditioner sqrt(diag(A^T@A)) is returned instead.
+
+    Parameters
+    ----------
+    A : ndarray or sparse matrix
+        The least squares system matrix.
+    drop_tol : float
+        Drop tolerance of :meth:`scipy.sparse.linalg.spilu`.
+    fill_factor : float
+        Fill factor of :meth:`scipy.sparse.linalg.spilu`.
+
+    Returns
+    -------
+    sparse matrix
+        The (approximate) factor R in CSR format.
+    """
+    A = spa.csr_matrix(A)
+    AtA = (A.T@A).tocsc()
+    diagonal = AtA.diagonal()
+    try:
+        ilu = spa.linalg.spilu(AtA, drop_tol=drop_tol, fill_factor=fill_factor,
+                               diag_pivot_thresh=0, permc_spec="NATURAL")
+        n = AtA.shape[0]
+        U = ilu.U.tocsr()
+        pivots = U.diagonal()
+        if np.array_equal(ilu.perm_r, np.arange(n)) and np.array_equal(ilu.perm_c, np.arange(n)) and np.all(pivots > 0):
+            return spa.diags(1/np.sqrt(pivots))@U
+    except RuntimeError: # Factor is exactly singular
+        pass
+    return spa.diags(np.sqrt(np.where(diagonal > 0, diagonal, 1)), format="csr")
+
+
+
+class _NormalEquationsSolver:
+    """Direct solver of the least squares problem min ||A@x - b|| through the normal equations A^T@A@x = A^T@b.
+
+    The normal matrix is factorized once such that each solve is a matrix-vector product with A^T followed
+    by two triangular solves. Dense matrices are factorized by a QR factorization of A (A^T@A = R^T@R),
+    sparse matrices by a sparse LU factorization of A^T@A with a symmetric fill-reducing ordering (which,
+    for the symmetric positive definite normal matrix, is a sparse Cholesky factorization up to scaling).
+
+    Parameters
+    ----------
+    A : ndarray or sparse matrix
+        The least squares system matrix of shape (m, n) with full column rank.
+    """
+    def __init__(self, A):
+        if spa.issparse(A):
+            A = A.tocsr()
+            self.structure = "sparse"
+            self._factor = spa.linalg.splu((A.T@A).tocsc(), permc_spec="MMD_AT_PLUS_A",
+                                           diag_pivot_thresh=0, options={"SymmetricMode": True})
         else:
-            if has_cholmod:
-                if flag == 1:
-                    precond = self._P.solve_A(x, use_LDLt_decomposition=False) 
-                elif flag == 2:
-                    precond = self._P.solve_At(x, use_LDLt_decomposition=False) 
-            else:
-                if flag == 1:
-                    precond = spa.linalg.spsolve(self._P, x) 
-                elif flag == 2:
-                    precond = spa.linalg.spsolve(self._P.T, x)
-        return precond
+            A = np.asarray(A)
+            self.structure = "dense"
+            self._factor = splinalg.qr(A, mode="r")[0][:A.shape[1]]
+        self._AT = A.T
+
+    def solve(self, b):
+        """Solve the least squares problem for b of shape (m,) or for each column of b of shape (m, k)."""
+        c = self._AT@b
+        if self.structure == "sparse":
+            return self._factor.solve(np.asarray(c, dtype=float))
+        y = splinalg.solve_triangular(self._factor, c, trans=1)
+        return splinalg.solve_triangular(self._factor, y)
 
 
 
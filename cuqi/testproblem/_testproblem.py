@@ -817,7 +817,9 @@ class Heat1D(BayesianProblem):
 
         def PDE_form(IC, t): return (Dxx, np.zeros(N), IC)
         PDE = cuqi.pde.TimeDependentLinearPDE(
-            PDE_form, time_steps, grid_sol=grid_domain, grid_obs=grid_obs)
+            PDE_form, time_steps, grid_sol=grid_domain, grid_obs=grid_obs,
+            time_invariant=True,
+            initial_condition_gradient=lambda direction, IC: direction)
 
         # Set up geometries for model
         if field_params is None:
@@ -15,4 +15,5 @@ from ._utilities import (
     plot_2D_density
 )
 
+from ._utilities import _PreparedLinearSolver
 from ._get_python_variable_name import _get_python_variable_name
@@ -2,9 +2,11 @@ from cuqi.array import CUQIarray
 from cuqi.density import Density
 import numpy as np
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from numbers import Number
-from scipy.sparse import issparse, diags
+from scipy.sparse import issparse, diags, tril, triu
 from scipy.sparse import linalg as spslinalg
+import scipy.linalg as splinalg
 from dataclasses import dataclass
 from abc import ABCMeta
 import copy
@@ -149,8 +151,58 @@ def sparse_cholesky(A):
     else:
         raise TypeError('The matrix is not positive semi-definite')
 
-def approx_derivative(func, wrt, direction=None, epsilon=np.sqrt(np.finfo(float).eps)):
-    """Approximates the derivative of callable (possibly vector-valued) function `func` evaluated at point `wrt`. If `direction` is provided, the direction-Jacobian product will be computed and returned, otherwise, the Jacobian matrix (or the gradient in case of a scalar function `func`) will be returned. The approximation is done using forward differences.
+class _PreparedLinearSolver:
+    """Square matrix A prepared for repeated solves with A and its transpose.
+
+    The structure of A is determined once: diagonal matrices are stored by their diagonal, dense
+    triangular matrices are solved by substitution and general matrices are LU factorized (using
+    :meth:`scipy.sparse.linalg.splu` for sparse matrices, without column permutation if A is triangular).
+
+    Parameters
+    ----------
+    A : ndarray or sparse matrix
+        Square matrix.
+    """
+    def __init__(self, A):
+        if issparse(A):
+            A = A.tocsc()
+            if A.shape[0] != A.shape[1]:
+                raise ValueError("Matrix must be square.")
+            if np.count_nonzero((A - diags(A.diagonal())).data) == 0:
+                self.structure = "diagonal"
+                self._factor = A.diagonal()
+            else:
+                self.structure = "sparse"
+                is_triangular = tril(A, -1).nnz == 0 or triu(A, 1).nnz == 0
+                self._factor = spslinalg.splu(A, permc_spec="NATURAL" if is_triangular else "COLAMD")
+        else:
+            A = np.asarray(A)
+            if A.ndim != 2 or A.shape[0] != A.shape[1]:
+                raise ValueError("Matrix must be square.")
+            lower = not np.any(np.triu(A, 1))
+            upper = not np.any(np.tril(A, -1))
+            if lower and upper:
+                self.structure = "diagonal"
+                self._factor = np.diag(A).copy()
+            elif lower or upper:
+                self.structure = "lower" if lower else "upper"
+                self._factor = A
+            else:
+                self.structure = "dense"
+                self._factor = splinalg.lu_factor(A)
+
+    def solve(self, x, trans=False):
+        """Solve A@y = x (or A^T@y = x if trans is True) for y. The right-hand side x can be a vector or a matrix (one system per column)."""
+        if self.structure == "diagonal":
+            return x/(self._factor[:, None] if np.ndim(x) == 2 else self._factor)
+        if self.structure == "sparse":
+            return self._factor.solve(np.asarray(x, dtype=float), trans="T" if trans else "N")
+        if self.structure in ("lower", "upper"):
+            return splinalg.solve_triangular(self._factor, x, lower=self.structure == "lower", trans=1 if trans else 0)
+        return splinalg.lu_solve(self._factor, x, trans=1 if trans else 0)
+
+def approx_derivative(func, wrt, direction=None, epsilon=np.sqrt(np.finfo(float).eps), method="forward", vectorized=False, workers=None):
+    """Approximates the derivative of callable (possibly vector-valued) function `func` evaluated at point `wrt`. If `direction` is provided, the direction-Jacobian product will be computed and returned, otherwise, the Jacobian matrix (or the gradient in case of a scalar function `func`) will be returned. The approximation is done using finite differences.
 
     Parameters
     ----------
@@ -167,6 +219,15 @@ def approx_derivative(func, wrt, direction=None, epsilon=np.sqrt(np.finfo(float)
     epsilon: float
         The spacing in the finite difference approximation.
 
+    method : str, default "forward"
+        The finite difference scheme, see :func:`approx_gradient`.
+
+    vectorized : bool, default False
+        If True, `func` is assumed to accept a block of points stacked along a trailing axis, see :func:`approx_gradient`.
+
+    workers : int, optional
+        Number of threads used to evaluate `func` at the perturbed points, see :func:`approx_gradient`.
+
     Returns
     -------
     ndarray
@@ -185,52 +246,98 @@ def approx_derivative(func, wrt, direction=None, epsilon=np.sqrt(np.finfo(float)
         raise NotImplementedError("approx_derivative is not implemented"+
                                    "for inputs of type CUQIarray")
 
-    # We compute the Jacobian matrix of func using forward differences.
+    # We compute the Jacobian matrix of func using finite differences.
     # If the function is scalar-valued, we compute the gradient instead.
     # If the direction is provided, we compute the direction-Jacobian product.
     wrt = np.asfarray(wrt)
-    f0 = func(wrt)
-    Matr = np.zeros([infer_len(wrt), infer_len(f0)])
-    dx = np.zeros(len(wrt))
+    f0 = func(wrt) if method == "forward" else None
 
     # Compute the Jacobian matrix (transpose)
-    for i in range(len(wrt)):
-        dx[i] = epsilon
-        Matr[i] = (func(wrt+dx) - f0)/epsilon
-        dx[i] = 0.0
+    Matr = _finite_differences(func, wrt, epsilon, method, f0, vectorized, workers)
+    Matr = Matr.reshape(infer_len(wrt), -1)
 
     # Return the Jacobian matrix (or the gradient)
     # or the direction-Jacobian product
     if direction is None:
-        if infer_len(f0) == 1:
+        if Matr.shape[1] == 1:
             return Matr.reshape(infer_len(wrt))
         else:
             return Matr.T
     else:
         return Matr@direction
 
-def approx_gradient(func, x, epsilon= 0.000001):
+def approx_gradient(func, x, epsilon= 0.000001, method="forward", func_x=None, vectorized=False, workers=None):
     """Approximates the gradient of callable scalar function `func` evaluated at point `x`. The approximation is done using finite differences with
-    step size `epsilon`."""
+    step size `epsilon`.
+
+    Parameters
+    ----------
+    func : callable
+        A scalar function of the form func(x).
+
+    x : ndarray or float
+        The point at which the gradient is evaluated.
+
+    epsilon : float
+        The spacing in the finite difference approximation.
+
+    method : str, default "forward"
+        The finite difference scheme. "forward" uses forward differences (dim+1 evaluations of `func`), "central" uses central differences (2*dim evaluations, second order accurate) and "complex" uses the complex-step derivative (dim evaluations, no cancellation errors), which requires `func` to be real analytic and implemented for complex input.
+
+    func_x : float, optional
+        The value of func(x) if already computed, e.g. by a previous log density evaluation. Only used by the forward differences.
+
+    vectorized : bool, default False
+        If True, `func` is assumed to accept a block of points stacked along a trailing axis, i.e. a (dim, N) array, and return the N function values. All perturbed points are then evaluated in one call.
+
+    workers : int, optional
+        If larger than one (and `func` is not vectorized), the perturbed points are evaluated concurrently by this number of threads. This is useful when `func` releases the GIL, e.g. by calling compiled linear algebra or PDE solvers.
+    """
     
-    # Derivative of a scalar function using forward differences
+    # Derivative of a scalar function
     if isinstance(x, Number):
-        return (func(x+epsilon) - func(x))/epsilon
+        return _finite_differences(lambda x: func(x[0]), np.array([x]), epsilon, method, func_x, False, None)[0]
 
-    # Initialize variables
+    # Compute the gradient component by component
     FD_gradient = x*0.0
-    eps_vec = x*0.0
-    func_x = func(x)
+    FD_gradient[:] = _finite_differences(func, x, epsilon, method, func_x, vectorized, workers).reshape(FD_gradient.shape)
+    return FD_gradient
 
-    # Compute the gradient using forward differences component by component
+def _finite_differences(func, x, epsilon, method, func_x, vectorized, workers):
+    """ Finite difference approximations of the derivatives of func at x with respect to each coordinate of x. Returns an array with the derivatives along the first axis. """
+    if method == "forward":
+        if func_x is None:
+            func_x = func(x)
+        return (_evaluate_perturbed(func, x, epsilon, vectorized, workers) - np.asarray(func_x).ravel())/epsilon
+    elif method == "central":
+        return (_evaluate_perturbed(func, x, epsilon, vectorized, workers) -
+                _evaluate_perturbed(func, x, -epsilon, vectorized, workers))/(2*epsilon)
+    elif method == "complex":
+        return np.imag(_evaluate_perturbed(func, x, 1j*epsilon, vectorized, workers))/epsilon
+    else:
+        raise ValueError(f"Unknown finite difference method {method}. Must be 'forward', 'central' or 'complex'.")
+
+def _evaluate_perturbed(func, x, step, vectorized, workers):
+    """ Evaluate func at x + step*e_i for each coordinate i of x. Returns an array with the (raveled) function values along the first axis. """
     x_len = infer_len(x)
-    for i in range(x_len):
-        eps_vec[i] = epsilon
-        x_plus_eps = x + eps_vec
-        FD_gradient[i] = (func(x_plus_eps) - func_x)/epsilon
-        eps_vec[i] = 0.0
-        
-    return FD_gradient
+
+    # All perturbed points in a single call as a block with points along the trailing axis
+    if vectorized:
+        points = np.asarray(x)[:, np.newaxis] + step*np.eye(x_len)
+        values = np.asarray(func(points))
+        return values.reshape(-1, x_len).T
+
+    def evaluate(i):
+        eps_vec = np.zeros(x_len, dtype=np.result_type(step, float))
+        eps_vec[i] = step
+        return np.asarray(func(x + eps_vec)).ravel()
+
+    if workers is not None and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            values = list(pool.map(evaluate, range(x_len)))
+    else:
+        values = [evaluate(i) for i in range(x_len)]
+    return np.array(values)
 
 
 # Function for plotting 1D density functions
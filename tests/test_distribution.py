@@ -1,4 +1,7 @@
 from math import isnan
+import pickle
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 import cuqi
 import numpy as np
 import scipy as sp
@@ -806,3 +809,145 @@ def test_Smoothed_Laplace():
 
     # gradient (vector Smoothed Laplace vs analytical)
     assert np.allclose(vector_smoothed_laplace.gradient(x), -1/scale)
+
+@pytest.mark.parametrize("kind", ["cov", "prec", "sqrtcov", "sqrtprec"])
+@pytest.mark.parametrize("dim, sparse", [(10, False), (100, False), (100, True)])
+def test_Gaussian_factorization_cache_scalar_rescaling(kind, dim, sparse):
+    """ Conditioning a Gaussian on a scalar multiple of a fixed matrix reuses the cached factorization and gives the same density as factorizing directly. """
+    L = sps.diags([-1, 2.5, -1], [-1, 0, 1], shape=(dim, dim), format="csr")
+    M = L if kind in ["cov", "prec"] else sps.csr_matrix(np.linalg.cholesky(L.toarray()))
+    if not sparse:
+        M = M.toarray()
+    x = np.random.randn(dim)
+
+    dist = cuqi.distribution.Gaussian(np.zeros(dim), **{kind: lambda s: s*M})
+    for s in [1.0, 2.5, 0.3, 2.5]:
+        conditioned = dist(s=s)
+        expected = cuqi.distribution.Gaussian(np.zeros(dim), **{kind: s*M})
+        assert np.allclose(conditioned._logupdf(x), expected._logupdf(x))
+        if expected.logdet is not None:
+            assert np.allclose(conditioned.logd(x), expected.logd(x))
+        assert conditioned.rank == expected.rank
+
+    assert dist._factorization_cache.misses == 1
+    assert dist._factorization_cache.hits == 3
+
+def test_Gaussian_factorization_cache_lru_eviction():
+    """ Matrices that are not scalar multiples of cached matrices are factorized and the least recently used factorization is evicted. """
+    cache = cuqi.distribution._gaussian._FactorizationCache(maxsize=2)
+    compute = cuqi.distribution._gaussian.get_sqrtprec_from_prec
+    P1, P2, P3 = np.diag([1., 2., 3.]), np.array([[2., 1., 0.], [1., 2., 0.], [0., 0., 1.]]), np.eye(3)
+
+    cache.get_sqrtprec("prec", compute, 3, P1, False)
+    cache.get_sqrtprec("prec", compute, 3, P2, False)
+    cache.get_sqrtprec("prec", compute, 3, 2*P1, False) # Hit, P1 most recently used
+    cache.get_sqrtprec("prec", compute, 3, P3, False) # Miss, evicts P2
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    cache.get_sqrtprec("prec", compute, 3, 3*P2, False) # Miss since P2 was evicted
+    cache.get_sqrtprec("cov", cuqi.distribution._gaussian.get_sqrtprec_from_cov, 3, P3, False) # Miss since kind differs
+    assert (cache.hits, cache.misses) == (1, 5)
+
+@pytest.mark.parametrize("kind", ["cov_scalar", "cov_vector", "cov", "prec", "sqrtcov", "sqrtprec", "sparse_cov"])
+def test_Gaussian_logd_and_gradient(kind):
+    """ The fused log density and gradient of a Gaussian matches the separate evaluations. """
+    n = 6
+    A = np.random.randn(n, n)
+    C = A@A.T + n*np.eye(n)
+    matrix = {"cov_scalar": 2.0, "cov_vector": np.arange(1, n+1.), "cov": C, "prec": C, "sqrtcov": np.linalg.cholesky(C),
+              "sqrtprec": np.linalg.cholesky(np.linalg.inv(C)).T, "sparse_cov": sps.diags(np.arange(1, n+1.))}[kind]
+    name = kind.replace("_scalar", "").replace("_vector", "").replace("sparse_", "")
+    x = cuqi.distribution.Gaussian(np.ones(n), **{name: matrix})
+    val = np.random.randn(n)
+
+    logd, gradient = x.logd_and_gradient(val)
+    assert np.allclose(logd, x.logd(val))
+    expected_gradient = -np.linalg.solve(C, val-1) if kind == "sqrtprec" else x.gradient(val)
+    assert np.allclose(gradient, expected_gradient)
+
+def test_Gaussian_factorization_cache_compares_fingerprints_before_matrices(monkeypatch):
+    """ Cached matrices are only compared in full with a matrix whose fingerprint matches. """
+    cache = cuqi.distribution._gaussian._FactorizationCache()
+    compute = cuqi.distribution._gaussian.get_sqrtprec_from_prec
+    matrices = [np.diag(np.arange(1., 11.)) + 0.1*k*(np.eye(10, k=1)+np.eye(10, k=-1)) for k in range(5)]
+    for P in matrices:
+        cache.get_sqrtprec("prec", compute, 10, P, False)
+
+    comparisons = []
+    scale_factor = cuqi.distribution._gaussian._scale_factor
+    monkeypatch.setattr(cuqi.distribution._gaussian, "_scale_factor", lambda *args: comparisons.append(1) or scale_factor(*args))
+    cache.get_sqrtprec("prec", compute, 10, 3*matrices[0], False)
+    assert (cache.hits, len(comparisons)) == (1, 1)
+
+def test_Gaussian_factorization_cache_is_bounded_by_bytes():
+    """ The stored matrices do not exceed max_bytes and matrices larger than max_bytes are not cached. """
+    compute = cuqi.distribution._gaussian.get_sqrtprec_from_prec
+    P = lambda k: np.diag(np.arange(1., 11.)) + 0.1*k*(np.eye(10, k=1)+np.eye(10, k=-1)) # 800 bytes
+    cache = cuqi.distribution._gaussian._FactorizationCache(max_bytes=2000)
+    for k in range(4):
+        cache.get_sqrtprec("prec", compute, 10, P(k), False)
+    assert len(cache._entries) == 2
+    cache.get_sqrtprec("prec", compute, 10, P(1), False) # Miss, evicted
+    cache.get_sqrtprec("prec", compute, 10, 2*P(3), False) # Hit
+    assert (cache.hits, cache.misses) == (1, 5)
+
+    cache = cuqi.distribution._gaussian._FactorizationCache(max_bytes=500)
+    cache.get_sqrtprec("prec", compute, 10, P(0), False)
+    assert len(cache._entries) == 0
+
+def test_Gaussian_factorization_cache_copies_and_threads():
+    """ The factorization cache can be deep-copied and pickled, and shared by conditioned copies used from several threads. """
+    n = 20
+    P = sps.diags([-1, 2.5, -1], [-1, 0, 1], shape=(n, n)).toarray()
+    dist = cuqi.distribution.Gaussian(np.zeros(n), prec=lambda s: s*P)
+    x = np.random.randn(n)
+
+    scales = np.linspace(0.5, 2, 40)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        logds = list(executor.map(lambda s: dist(s=s).logd(x), scales))
+    expected = [cuqi.distribution.Gaussian(np.zeros(n), prec=s*P).logd(x) for s in scales]
+    assert np.allclose(logds, expected)
+    assert len(dist._factorization_cache._entries) == 1
+
+    dist_copy = deepcopy(dist(s=2.0))
+    assert np.allclose(dist_copy.logd(x), expected[-1])
+    assert dist_copy._factorization_cache is not dist._factorization_cache
+    cache = pickle.loads(pickle.dumps(dist._factorization_cache))
+    assert len(cache._entries) == 1
+    with cache._lock:
+        pass
+
+@pytest.mark.parametrize("structure", ["upper", "lower", "dense", "diagonal", "sparse", "sparse_diagonal"])
+def test_Gaussian_sample_with_prepared_sqrtprec_solver(structure):
+    """ Samples are computed as mean + solve(sqrtprec, e) for all sqrtprec structures, using a solver that is prepared once. """
+    n = 20
+    A = np.random.randn(n, n)
+    R = np.linalg.cholesky(A@A.T + n*np.eye(n))
+    sqrtprec = {"upper": R.T, "lower": R, "dense": A + n*np.eye(n), "diagonal": np.diag(np.random.rand(n)+1),
+                "sparse": sps.csr_matrix(R.T), "sparse_diagonal": sps.diags(np.random.rand(n)+1)}[structure]
+    x = cuqi.distribution.Gaussian(np.ones(n), sqrtprec=sqrtprec)
+
+    np.random.seed(0)
+    samples = x.sample(5).samples
+    np.random.seed(0)
+    e = np.random.randn(n, 5)
+
+    matrix = sqrtprec.toarray() if sps.issparse(sqrtprec) else sqrtprec
+    assert np.allclose(matrix@(samples-1), e)
+    assert x._get_sqrtprec_solver().structure == structure.replace("sparse_", "")
+    assert x._get_sqrtprec_solver() is x._get_sqrtprec_solver() # Solver is prepared once
+
+def test_Gaussian_sqrtprec_solver_is_reused_under_scalar_rescaling():
+    """ Conditioning on a scalar multiple of a fixed precision reuses the prepared solver. """
+    n = 10
+    A = np.random.randn(n, n)
+    P = A@A.T + n*np.eye(n)
+    x = cuqi.distribution.Gaussian(np.zeros(n), prec=lambda d: d*P)
+
+    solver = x(d=1)._get_sqrtprec_solver()
+    for d in [2.0, 0.5]:
+        x_d = x(d=d)
+        solver_d = x_d._get_sqrtprec_solver()
+        assert solver_d._solver is solver._solver
+        e = np.random.randn(n, 3)
+        assert np.allclose(x_d.sqrtprec@solver_d.solve(e), e)
@@ -2,6 +2,7 @@ import numpy as np
 import scipy as sp
 import cuqi
 import pytest
+from unittest.mock import patch
 from cuqi.geometry import Continuous2D, Continuous1D
 
 
@@ -389,6 +390,72 @@ def test_create_CustomKL_geometry():
     assert np.isclose(geom.mean, mean) and\
            np.isclose(geom.std, std) and\
 	   geom.trunc_term==trunc_term
+
+def test_CustomKL_eigenpairs_and_cache(tmp_path):
+    """Check CustomKL eigenpairs for vectorized and scalar covariance functions and the on-disk cache"""
+    grid = np.linspace(0, 1, 50)
+    cov_func = lambda x, y: np.exp(-np.abs(x-y)/0.2)
+    scalar_cov_func = lambda x, y: float(np.exp(-abs(x-y)/0.2)) # Only supports scalar input
+    geom = cuqi.geometry.CustomKL(grid, std=1, cov_func=cov_func, trunc_term=5)
+
+    # Reference from the eigenvalue problem of the full (weighted) covariance matrix on the quadrature points
+    xi, w = np.polynomial.legendre.leggauss(10)
+    xi_s, w_s = (xi+1)/2, w/2
+    Sigma = np.exp(-np.abs(xi_s[:, None]-xi_s[None, :])/0.2)
+    eigval = np.sort(np.linalg.eigvalsh(np.sqrt(w_s)[:, None]*Sigma*np.sqrt(w_s)[None, :]))[::-1][:5]
+    assert np.allclose(geom.eigval, eigval)
+
+    geom_scalar = cuqi.geometry.CustomKL(grid, std=1, cov_func=scalar_cov_func, trunc_term=5)
+    assert np.allclose(geom_scalar.eigval, geom.eigval)
+    assert np.allclose(geom_scalar.eigvec, geom.eigvec)
+
+    # Eigenpairs are stored in and loaded from the cache directory
+    geom_cached = cuqi.geometry.CustomKL(grid, std=1, cov_func=cov_func, trunc_term=5, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+    geom_loaded = cuqi.geometry.CustomKL(grid, std=1, cov_func=cov_func, trunc_term=5, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert np.array_equal(geom_loaded.eigvec, geom_cached.eigvec)
+    assert np.allclose(geom_loaded.eigvec, geom.eigvec)
+
+    # A different covariance function is not loaded from the cache
+    cuqi.geometry.CustomKL(grid, std=1, cov_func=lambda x, y: np.exp(-np.abs(x-y)/0.3), trunc_term=5, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 2
+
+def test_CustomKL_cache_is_keyed_on_kernel_parameters(tmp_path):
+    """Check that a CustomKL cache hit does not evaluate the covariance function and that kernel parameters are part of the key"""
+    grid = np.linspace(0, 1, 50)
+    make_cov_func = lambda length: (lambda x, y: np.exp(-np.abs(x-y)/length))
+    evaluate_kernel = cuqi.geometry._geometry._evaluate_kernel
+
+    with patch("cuqi.geometry._geometry._evaluate_kernel", wraps=evaluate_kernel) as spy:
+        cuqi.geometry.CustomKL(grid, cov_func=make_cov_func(0.2), trunc_term=5, cache_dir=tmp_path)
+        assert spy.call_count == 2
+
+        # Cache hit: the covariance function is not evaluated
+        spy.reset_mock()
+        geom = cuqi.geometry.CustomKL(grid, cov_func=make_cov_func(0.2), trunc_term=5, cache_dir=tmp_path)
+        assert spy.call_count == 0
+
+        # Different correlation length or number of terms: cache miss
+        cuqi.geometry.CustomKL(grid, cov_func=make_cov_func(0.3), trunc_term=5, cache_dir=tmp_path)
+        assert spy.call_count == 2
+        cuqi.geometry.CustomKL(grid, cov_func=make_cov_func(0.2), trunc_term=4, cache_dir=tmp_path)
+        assert spy.call_count == 4
+
+    assert len(list(tmp_path.iterdir())) == 3
+    assert np.allclose(geom.eigvec, cuqi.geometry.CustomKL(grid, cov_func=make_cov_func(0.2), trunc_term=5).eigvec)
+
+def test_CustomKL_cache_is_skipped_for_unidentifiable_kernel(tmp_path):
+    """Check that CustomKL does not cache eigenpairs when the covariance function cannot be identified"""
+    class Kernel:
+        def __call__(self, x, y):
+            return np.exp(-np.abs(x-y)/0.2)
+
+    grid = np.linspace(0, 1, 50)
+    with pytest.warns(UserWarning, match="not cached"):
+        geom = cuqi.geometry.CustomKL(grid, cov_func=Kernel(), trunc_term=5, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 0
+    assert np.allclose(geom.eigvec, cuqi.geometry.CustomKL(grid, cov_func=lambda x, y: np.exp(-np.abs(x-y)/0.2), trunc_term=5).eigvec)
 	
 
 def test_KLExpansion_projection(copy_reference):
@@ -548,3 +615,14 @@ def test_par2fun_and_fun2par_correctness_for_multiple_values(geom):
 
     # Check plotting runs
     geom.plot(par2, is_par=True)
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_Image2D_multiple_images_fun2par(order):
+    """ fun2par of Image2D converts multiple images at once and inverts par2fun """
+    geom = cuqi.geometry.Image2D((4, 5), order=order)
+    pars = np.random.randn(geom.par_dim, 3)
+    images = geom.par2fun(pars)
+    assert images.shape == (4, 5, 3)
+    assert np.allclose(geom.fun2par(images), pars)
+    assert np.allclose(geom.fun2par(images[..., 1]), pars[:, 1])
+    assert np.allclose(geom._fun2par_batch(images), pars)
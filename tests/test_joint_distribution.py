@@ -393,3 +393,35 @@ def test_logd_consistency_when_conditioning(joint, variables):
 
         # Add current variable to the variables that need to be conditioned
         cond_vars[key] = value
+
+def test_MultipleLikelihoodPosterior_logd_and_gradient():
+    """ This tests that logd_and_gradient of MultipleLikelihoodPosterior matches separate evaluations. """
+    model1, data1, _ = cuqi.testproblem.Deconvolution1D(dim=16, phantom="sinc").get_components()
+    model2, data2, _ = cuqi.testproblem.Deconvolution1D(dim=16, phantom="sinc", PSF="Defocus").get_components()
+    x = cuqi.distribution.Gaussian(np.zeros(16), 1)
+    y1 = cuqi.distribution.Gaussian(model1, 0.01)
+    y2 = cuqi.distribution.Gaussian(model2, 0.01)
+    posterior = cuqi.distribution.JointDistribution(x, y1, y2)(y1=data1, y2=data2)
+    assert isinstance(posterior, cuqi.distribution.MultipleLikelihoodPosterior)
+
+    x_i = np.linspace(0, 1, 16)
+    logd, gradient = posterior.logd_and_gradient(x_i)
+    assert np.allclose(logd, posterior.logd(x_i))
+    assert np.allclose(gradient, posterior.gradient(x_i))
+
+def test_JointDistribution_logd_and_gradient_requires_single_parameter():
+    """ This tests that logd_and_gradient of a joint distribution of several parameters raises, while conditioning on all but one parameter gives the fused evaluation. """
+    model, data, _ = cuqi.testproblem.Deconvolution1D(dim=16, phantom="sinc").get_components()
+    d = cuqi.distribution.Gamma(1, 1e-2)
+    x = cuqi.distribution.Gaussian(np.zeros(16), lambda d: 1/d)
+    y = cuqi.distribution.Gaussian(model, 0.01)
+    joint = cuqi.distribution.JointDistribution(d, x, y)(y=data)
+
+    with pytest.raises(NotImplementedError, match="Condition on all but one parameter"):
+        joint.logd_and_gradient(d=1, x=np.zeros(16))
+
+    x_i = np.linspace(0, 1, 16)
+    posterior = joint(d=2)
+    logd, gradient = posterior.logd_and_gradient(x_i)
+    assert np.allclose(logd, joint.logd(d=2, x=x_i))
+    assert np.allclose(gradient, posterior.gradient(x_i))
@@ -138,3 +138,37 @@ def test_enable_FD_gradient(y, x_i):
     # Assert that the exact and FD gradient are close,
     # but not exactly equal (since we use a different method)
     assert np.allclose(g_exact, g_FD) and np.all(g_exact != g_FD)
+
+def test_logd_and_gradient_shares_forward_evaluation():
+    """ Test that logd_and_gradient matches separate evaluations and evaluates the forward model once. """
+    model, data, probInfo = cuqi.testproblem.Deconvolution1D(dim=32).get_components()
+    x = cuqi.distribution.GMRF(np.zeros(32), 10)
+    y = cuqi.distribution.Gaussian(model, 0.05)
+    likelihood = y.to_likelihood(data)
+    posterior = cuqi.distribution.Posterior(likelihood, x)
+    x_i = probInfo.exactSolution
+
+    for density in [likelihood, posterior, x]:
+        logd, gradient = density.logd_and_gradient(x_i)
+        assert np.allclose(logd, density.logd(x_i))
+        assert np.allclose(gradient, density.gradient(x_i))
+
+    # Count forward evaluations
+    forward_func = model._forward_func
+    num_forward = [0]
+    def counted_forward(x):
+        num_forward[0] += 1
+        return forward_func(x)
+    model._forward_func = counted_forward
+
+    posterior.logd_and_gradient(x_i)
+    assert num_forward[0] == 1
+
+def test_logd_and_gradient_with_FD_enabled():
+    """ Test that logd_and_gradient uses the FD gradient if enabled. """
+    model, data, probInfo = cuqi.testproblem.Deconvolution1D(dim=6).get_components()
+    likelihood = cuqi.distribution.Gaussian(model, 1).to_likelihood(data)
+    likelihood.enable_FD(1e-7)
+    logd, gradient = likelihood.logd_and_gradient(probInfo.exactSolution)
+    assert np.allclose(logd, likelihood.logd(probInfo.exactSolution))
+    assert np.array_equal(gradient, likelihood.gradient(probInfo.exactSolution))
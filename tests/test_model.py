@@ -5,6 +5,7 @@ import scipy as sp
 import cuqi
 import pytest
 from scipy import optimize
+from copy import copy, deepcopy
 
 
 @pytest.mark.parametrize("seed",[(0),(1),(2)])
@@ -471,3 +472,139 @@ def test_model_allows_jacobian_or_gradient():
 
     assert np.allclose(model_grad.gradient(dir, wrt), model_jac.gradient(dir, wrt))
 
+
+def test_linear_model_from_matrix_can_be_pickled():
+    """ Linear models defined from a matrix can be pickled, e.g. to sample chains in parallel processes. """
+    import pickle
+    A = np.random.randn(3, 2)
+    model = cuqi.model.LinearModel(A)
+    model_copy = pickle.loads(pickle.dumps(model))
+    x = np.random.randn(2)
+    y = np.random.randn(3)
+    assert np.allclose(model_copy.forward(x), A@x)
+    assert np.allclose(model_copy.adjoint(y), A.T@y)
+    assert np.allclose(model_copy.gradient(y, x), A.T@y)
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+@pytest.mark.parametrize("domain_geometry", [
+    cuqi.geometry.Continuous1D(4),
+    cuqi.geometry.StepExpansion(np.linspace(0, 1, 4), n_steps=2),
+])
+def test_vectorized_model_applied_to_samples_matches_loop(monkeypatch, batch_size, domain_geometry):
+    """ Test that a vectorized model applied to Samples gives the same result as applying the model to each sample. """
+    monkeypatch.setattr(cuqi.config, "BATCH_SIZE", batch_size)
+
+    A = np.random.randn(3, 4)
+    forward = lambda x: np.sin(A@x)
+    model = cuqi.model.Model(forward, 3, domain_geometry)
+    model_vectorized = cuqi.model.Model(forward, 3, domain_geometry, vectorized=True)
+
+    samples = cuqi.samples.Samples(np.random.randn(domain_geometry.par_dim, 7), geometry=domain_geometry)
+
+    expected = np.column_stack([model(s) for s in samples])
+    assert not model.vectorized and model_vectorized.vectorized
+    assert np.allclose(model(samples).samples, expected)
+    assert np.allclose(model_vectorized(samples).samples, expected)
+
+def test_vectorized_forward_receives_blocks_of_samples(monkeypatch):
+    """ Test that a vectorized model passes batches of at most cuqi.config.BATCH_SIZE samples to the forward function. """
+    monkeypatch.setattr(cuqi.config, "BATCH_SIZE", 4)
+    shapes = []
+    def forward(x):
+        shapes.append(x.shape)
+        return 2*x
+    model = cuqi.model.Model(forward, 2, 2, vectorized=True)
+
+    result = model(cuqi.samples.Samples(np.ones((2, 10))))
+
+    assert shapes == [(2, 4), (2, 4), (2, 2)]
+    assert np.allclose(result.samples, 2)
+
+def test_linear_model_from_matrix_is_vectorized():
+    """ Test that linear models defined by a matrix are vectorized by default and apply forward and adjoint to Samples correctly. """
+    A = np.random.randn(5, 3)
+    model = cuqi.model.LinearModel(A)
+    assert model.vectorized
+    assert not cuqi.model.LinearModel(lambda x: A@x, lambda y: A.T@y, 5, 3).vectorized
+
+    x = cuqi.samples.Samples(np.random.randn(3, 6))
+    y = cuqi.samples.Samples(np.random.randn(5, 6))
+    assert np.allclose(model.forward(x).samples, A@x.samples)
+    assert np.allclose(model.adjoint(y).samples, A.T@y.samples)
+
+def test_model_forward_cache():
+    """ Test that the forward cache reuses outputs at repeated inputs and counts hits and misses. """
+    calls = []
+    def forward(x):
+        calls.append(x.copy())
+        return np.array([x[0]**2, x[0]*x[1]])
+    gradient = lambda direction, wrt: direction@np.array([[2*wrt[0], 0], [wrt[1], wrt[0]]])
+    model = cuqi.model.Model(forward, 2, 2, gradient=gradient)
+    assert model.cache_info() is None
+
+    model.enable_cache(maxsize=2)
+    x1, x2, x3 = np.array([1., 2.]), np.array([3., 4.]), np.array([5., 6.])
+
+    y1 = model(x1)
+    y1[0] = 100 # Modifying the output in-place does not modify the cache
+    assert np.allclose(model(x1.copy()), [1, 2])
+    model(x2)
+    model(x3) # x1 is evicted
+    model(x1)
+    assert model.cache_info() == (1, 4, 2, 2)
+    assert len(calls) == 4
+
+    # Forward and gradient of a likelihood evaluate the forward function once
+    likelihood = cuqi.distribution.Gaussian(model, 1).to_likelihood(np.zeros(2))
+    x4 = np.array([0.5, -1.])
+    num_calls = len(calls)
+    likelihood.logd(x4)
+    likelihood.gradient(x4)
+    assert len(calls) == num_calls + 1
+
+    # Samples are not cached
+    model(cuqi.samples.Samples(np.ones((2, 3))))
+    assert len(calls) == num_calls + 4
+
+    model.disable_cache()
+    model(x4)
+    assert len(calls) == num_calls + 5
+    assert model.cache_info() is None
+
+    with pytest.raises(ValueError):
+        model.enable_cache(maxsize=0)
+
+def test_model_gradient_reuses_cached_forward_state():
+    """ The gradient of a PDE model at a cached input continues from the PDE assembled by the forward evaluation """
+    np.random.seed(0)
+    dim = 10
+    Dxx = sp.sparse.diags([np.ones(dim-1), -2*np.ones(dim), np.ones(dim-1)], [-1, 0, 1])*10
+    calls = []
+    def PDE_form(x, t):
+        calls.append(t)
+        return Dxx, x, np.zeros(dim)
+    PDE = cuqi.pde.TimeDependentLinearPDE(PDE_form, np.linspace(0, 0.1, 11), method="backward_euler",
+                                          time_invariant=True, grid_sol=np.arange(dim),
+                                          source_term_gradient=lambda direction, x, t: direction)
+    model = cuqi.model.PDEModel(PDE, range_geometry=dim, domain_geometry=dim)
+    x1, x2, direction = np.random.randn(dim), np.random.randn(dim), np.random.randn(dim)
+    grad = model.gradient(direction, x1)
+
+    model.enable_cache(maxsize=2)
+    model.forward(x1)
+    model.forward(x2)
+    num_calls = len(calls)
+    assert np.allclose(model.gradient(direction, x1), grad)
+    assert len(calls) == num_calls # The PDE is not assembled again
+
+def test_model_copies_have_own_forward_cache():
+    model = cuqi.model.Model(lambda x: x**2, 2, 2)
+    model.enable_cache()
+    model(np.ones(2))
+
+    for model_copy in [copy(model), deepcopy(model)]:
+        assert model_copy._forward_cache is not model._forward_cache
+        assert model_copy.cache_info() == (0, 0, 1, 0)
+        assert np.allclose(model_copy(np.ones(2)), 1)
+    assert model.cache_info() == (0, 1, 1, 1)
+    assert copy(cuqi.model.Model(lambda x: x, 2, 2)).cache_info() is None
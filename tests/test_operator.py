@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import cuqi
+from cuqi.operator import FirstOrderFiniteDifference, SecondOrderFiniteDifference, PrecisionFiniteDifference
+
+@pytest.mark.parametrize("operator_class, bc_type",
+                         [(FirstOrderFiniteDifference, 'zero'),
+                          (FirstOrderFiniteDifference, 'periodic'),
+                          (FirstOrderFiniteDifference, 'neumann'),
+                          (FirstOrderFiniteDifference, 'backward'),
+                          (FirstOrderFiniteDifference, 'none'),
+                          (SecondOrderFiniteDifference, 'zero'),
+                          (SecondOrderFiniteDifference, 'periodic'),
+                          (SecondOrderFiniteDifference, 'neumann')])
+def test_matrix_free_finite_difference_matches_matrix(operator_class, bc_type):
+    np.random.seed(0)
+    N = 8
+    matrix = operator_class((N, N), bc_type=bc_type).get_matrix().toarray()
+    operator = operator_class((N, N), bc_type=bc_type, matrix_free=True)
+
+    # The matrix is not assembled for the matrix-free operator
+    assert operator._matrix is None
+    assert operator.shape == matrix.shape
+
+    x = np.random.randn(N*N)
+    X = np.random.randn(N*N, 3)
+    y = np.random.randn(matrix.shape[0])
+    Y = np.random.randn(matrix.shape[0], 3)
+    assert np.allclose(operator@x, matrix@x)
+    assert np.allclose(operator@X, matrix@X)
+    assert np.allclose(operator.rmatvec(y), matrix.T@y)
+    assert np.allclose(operator.rmatvec(Y), matrix.T@Y)
+    assert np.allclose(operator.get_matrix().toarray(), matrix)
+
+@pytest.mark.parametrize("order", [0, 1, 2])
+def test_matrix_free_precision_matches_matrix(order):
+    np.random.seed(0)
+    N = 8
+    matrix = PrecisionFiniteDifference((N, N), bc_type='zero', order=order).get_matrix().toarray()
+    operator = PrecisionFiniteDifference((N, N), bc_type='zero', order=order, matrix_free=True)
+
+    X = np.random.randn(N*N, 2)
+    assert operator._matrix is None
+    assert np.allclose(operator@X, matrix@X)
+
+def test_finite_difference_matrices_are_cached_and_shared():
+    D1 = FirstOrderFiniteDifference(50, bc_type='zero')
+    D2 = FirstOrderFiniteDifference(50, bc_type='zero')
+    assert D1._get_matrix() is D2._get_matrix()
+    assert FirstOrderFiniteDifference(50, bc_type='periodic')._get_matrix() is not D1._get_matrix()
+    assert FirstOrderFiniteDifference(50, bc_type='zero', dx=0.1)._get_matrix() is not D1._get_matrix()
+
+    P1 = PrecisionFiniteDifference(50, bc_type='zero', order=1)
+    P2 = PrecisionFiniteDifference(50, bc_type='zero', order=1)
+    assert P1._get_matrix() is P2._get_matrix()
+    assert PrecisionFiniteDifference(50, bc_type='zero', order=2)._get_matrix() is not P1._get_matrix()
+
+def test_modifying_finite_difference_matrix_does_not_affect_other_operators():
+    x = np.random.randn(50)
+    D1 = FirstOrderFiniteDifference(50, bc_type='zero')
+    D2 = FirstOrderFiniteDifference(50, bc_type='zero')
+    Dx = D2@x
+
+    # The returned matrix is writeable, also in place after format conversions
+    D = D1.get_matrix()
+    D.data *= 2
+    D.tocsr().data *= 2
+    D.T.tocsc().data *= 2
+    assert np.allclose(D@x, 8*Dx)
+    assert np.allclose(D1@x, Dx)
+    assert np.allclose(D2@x, Dx)
+    assert np.allclose(FirstOrderFiniteDifference(50, bc_type='zero').get_matrix()@x, Dx)
+
+def test_MRF_priors_with_matrix_free_operator(monkeypatch):
+    """ LMRF and CMRF on large 2D grids use the matrix-free difference operator """
+    np.random.seed(0)
+    x = np.random.randn(16**2)
+    priors = [cuqi.distribution.LMRF(0, 0.1, geometry=cuqi.geometry.Image2D((16, 16))),
+              cuqi.distribution.CMRF(0, 0.1, geometry=cuqi.geometry.Image2D((16, 16)))]
+    logds = [prior.logd(x) for prior in priors]
+    gradient = priors[1].gradient(x)
+
+    monkeypatch.setattr(cuqi.config, "MIN_DIM_MATRIX_FREE", 16**2)
+    priors = [cuqi.distribution.LMRF(0, 0.1, geometry=cuqi.geometry.Image2D((16, 16))),
+              cuqi.distribution.CMRF(0, 0.1, geometry=cuqi.geometry.Image2D((16, 16)))]
+    assert all(prior._diff_op._matrix is None for prior in priors)
+    assert np.allclose([prior.logd(x) for prior in priors], logds)
+    assert np.allclose(priors[1].gradient(x), gradient)
@@ -108,6 +108,121 @@ def test_solver_signature(solve_kwargs, expected_info):
     assert (expected_info == None and info == None) \
                or np.all( [np.all(expected_info[i] == info[i]) for i in range(len(info))]) 
 
+def _create_poisson_with_diffusivity_parameter(dim=50, sparse=True, **pde_kwargs):
+    """ Poisson equation -d/dx(exp(x) d/dx u) = f where x is the log-diffusivity """
+    L = 10
+    dx = L/(dim-1)
+    grid_sol = np.linspace(dx, L, dim-1, endpoint=False)
+    D = cuqi.operator.FirstOrderFiniteDifference(dim-1, bc_type='zero', dx=dx).get_matrix()
+    if not sparse:
+        D = D.toarray()
+    source = np.exp(-50*((grid_sol - L/3)/L)**2)
+    diag = scipy.sparse.diags if sparse else np.diag
+    poisson_form = lambda x: (D.T@diag(np.exp(x))@D, source)
+    pde = cuqi.pde.SteadyStateLinearPDE(poisson_form, grid_sol=grid_sol, **pde_kwargs)
+    return pde, D, source
+
+@pytest.mark.parametrize("sparse", [True, False])
+def test_SteadyStateLinearPDE_reuses_factorization(sparse):
+    pde, D, source = _create_poisson_with_diffusivity_parameter(
+        sparse=sparse,
+        linalg_solve=scipy.sparse.linalg.spsolve if sparse else scipy.linalg.solve,
+        factorization_cache_size=2)
+    assert pde.factorize
+
+    x1, x2, x3 = np.zeros(50), np.ones(50), np.linspace(0, 1, 50)
+    for x in [x1, x2, x1, x2, x3, x1]:
+        pde.assemble(x)
+        sol, info = pde.solve()
+        A = D.T@(scipy.sparse.diags(np.exp(x)) if sparse else np.diag(np.exp(x)))@D
+        assert info is None
+        assert np.allclose(A@sol, source)
+
+    # x1 and x2 are factorized once and reused, x3 evicts x1 from the cache (size 2)
+    assert pde._factorizations.misses == 4
+    assert pde._factorizations.hits == 2
+
+def test_SteadyStateLinearPDE_without_factorization_cache_uses_current_operator():
+    """ Without a factorization cache, the operator is factorized for every assembly, so a PDE_form that
+    depends on more than the parameter is always solved with its current operator """
+    scale = [1.0]
+    A = np.diag(np.arange(1, 11.)) + np.diag(np.ones(9), 1)
+    rhs = np.arange(10.)
+    pde = cuqi.pde.SteadyStateLinearPDE(lambda x: (scale[0]*x[0]*A, rhs), factorization_cache_size=0)
+    assert pde.factorize
+
+    x = np.array([2.])
+    for scale[0] in [1.0, 3.0]:
+        pde.assemble(x)
+        sol, _ = pde.solve()
+        assert np.allclose(scale[0]*2*A@sol, rhs)
+    assert len(pde._factorizations._entries) == 0
+
+def test_SteadyStateLinearPDE_keeps_linalg_solve_kwargs():
+    """ The default direct solvers are only replaced by a factorization if no solver keyword arguments are given """
+    calls = []
+    def spsolve(A, b, **kwargs):
+        calls.append(kwargs)
+        return scipy.sparse.linalg.spsolve(A, b, **kwargs)
+    A = scipy.sparse.csr_matrix(np.diag(np.arange(1, 11.)))
+    rhs = np.arange(10.)
+
+    pde = cuqi.pde.SteadyStateLinearPDE(lambda x: (A, rhs), linalg_solve=scipy.sparse.linalg.spsolve,
+                                        linalg_solve_kwargs={"use_umfpack": False})
+    assert not pde.factorize
+
+    pde = cuqi.pde.SteadyStateLinearPDE(lambda x: (A, rhs), linalg_solve=spsolve,
+                                        linalg_solve_kwargs={"use_umfpack": False})
+    pde.assemble(np.array([1.]))
+    sol, _ = pde.solve()
+    assert np.allclose(A@sol, rhs)
+    assert calls == [{"use_umfpack": False}]
+
+@pytest.mark.parametrize("sparse", [True, False])
+def test_SteadyStateLinearPDE_solve_adjoint(sparse):
+    # Non-symmetric operator to distinguish the adjoint from the forward solve
+    A = np.diag(np.arange(1, 11.)) + np.diag(np.ones(9), 1)
+    A = scipy.sparse.csr_matrix(A) if sparse else A
+    rhs = np.arange(10.)
+    pde = cuqi.pde.SteadyStateLinearPDE(lambda x: (A*x[0], rhs))
+    pde.assemble(np.array([2.]))
+
+    A_dense = 2*(A.toarray() if sparse else A)
+    assert np.allclose(A_dense.T@pde.solve_adjoint(rhs), rhs)
+
+    # Multiple right-hand sides and same result without factorization
+    pde_no_factorization = cuqi.pde.SteadyStateLinearPDE(lambda x: (A*x[0], rhs), factorize=False,
+        linalg_solve=scipy.sparse.linalg.spsolve if sparse else scipy.linalg.solve)
+    pde_no_factorization.assemble(np.array([2.]))
+    B = np.random.randn(10, 3)
+    assert np.allclose(A_dense.T@pde.solve_adjoint(B), B)
+    assert np.allclose(pde_no_factorization.solve_adjoint(rhs), pde.solve_adjoint(rhs))
+
+def test_SteadyStateLinearPDE_adjoint_gradient_reuses_factorization():
+    """ Adjoint gradient of the Poisson model computed with the factorization of the forward solve """
+    pde, D, source = _create_poisson_with_diffusivity_parameter()
+
+    def gradient_wrt_parameter(direction, wrt):
+        # u solves A(x)u = f with A(x) = D^T diag(exp(x)) D, so
+        # grad_x <direction, u> = -exp(x)*(D u)*(D lambda) where A^T lambda = direction
+        pde.assemble(wrt)
+        u, _ = pde.solve()
+        adjoint = pde.solve_adjoint(direction)
+        return -np.exp(wrt)*(D@u)*(D@adjoint)
+    pde.gradient_wrt_parameter = gradient_wrt_parameter
+
+    model = cuqi.model.PDEModel(pde, range_geometry=49, domain_geometry=50)
+    x = np.random.randn(50)*0.1
+    direction = np.random.randn(49)
+
+    model.forward(x)
+    grad = model.gradient(direction, x)
+    # The forward solve and the adjoint solve share one factorization
+    assert pde._factorizations.misses == 1
+
+    grad_fd = cuqi.utilities.approx_gradient(lambda x: direction@model.forward(x), x, epsilon=1e-6)
+    assert np.allclose(grad, grad_fd, rtol=1e-3, atol=1e-6)
+
 def test_mixed_BCs():
     #%% Poisson equation in 1D (mixed Dirichlet and Neumann BCs):
     # d**2/(dx)**2 u = sin(x), x in (0, pi/2)
@@ -320,6 +435,179 @@ def test_TimeDependentLinearPDE_heat1D(copy_reference, method, time_steps,
         assert expected_sol == 'sol1'
 
 
+def _create_heat1D_PDE(method, time_steps, dim=50, sparse=False, **pde_kwargs):
+    """ 1D heat equation with the source term as parameter. Returns the PDE
+    and a counter of the PDE_form evaluations. """
+    L = 5
+    dx = L/(dim+1)
+    grid_sol = np.linspace(dx, L-dx, dim)
+    Dxx = (np.diag(-2*np.ones(dim)) + np.diag(np.ones(dim-1), -1) +
+           np.diag(np.ones(dim-1), 1))/dx**2
+    if sparse:
+        Dxx = scipy.sparse.csr_matrix(Dxx)
+    num_calls = [0]
+    def PDE_form(source_term, t):
+        num_calls[0] += 1
+        return (Dxx, source_term, np.sin(np.pi*grid_sol/L))
+    PDE = cuqi.pde.TimeDependentLinearPDE(
+        PDE_form, time_steps, method=method, grid_sol=grid_sol, **pde_kwargs)
+    return PDE, num_calls
+
+@pytest.mark.parametrize("method", ["forward_euler", "backward_euler", "crank_nicolson"])
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("varying_time_steps", [False, True])
+def test_TimeDependentLinearPDE_time_invariant_matches_time_dependent(method, sparse, varying_time_steps):
+    """ The time invariant fast path gives the same solution as the general path """
+    if method == "forward_euler":
+        time_steps = np.linspace(0, 0.1, 501)
+    else:
+        time_steps = np.linspace(0, 0.1, 21)
+    if varying_time_steps:
+        time_steps = np.hstack((time_steps[:-1]/2, 0.05 + time_steps[::2]/2))
+
+    parameter = np.linspace(0, 1, 50)
+    PDE, num_calls = _create_heat1D_PDE(method, time_steps, sparse=sparse)
+    PDE.assemble(parameter)
+    sol, _ = PDE.solve()
+
+    PDE_invariant, num_calls_invariant = _create_heat1D_PDE(
+        method, time_steps, sparse=sparse, time_invariant=True)
+    PDE_invariant.assemble(parameter)
+    sol_invariant, _ = PDE_invariant.solve()
+
+    assert np.allclose(sol, sol_invariant)
+    assert num_calls[0] >= len(time_steps)-1
+    assert num_calls_invariant[0] == 1
+
+    # One factorization per distinct time step size
+    if method == "forward_euler":
+        assert not hasattr(PDE_invariant, "_stepping_matrices") or len(PDE_invariant._stepping_matrices) == 0
+    else:
+        assert len(PDE_invariant._stepping_matrices) == (2 if varying_time_steps else 1)
+
+def test_TimeDependentLinearPDE_crank_nicolson_is_second_order():
+    """ Crank-Nicolson error decreases faster than backward Euler error when
+    halving the time step (compared with a fine time step reference) """
+    def final_solution(method, num_steps):
+        PDE, _ = _create_heat1D_PDE(method, np.linspace(0, 0.5, num_steps+1), time_invariant=True)
+        PDE.assemble(np.zeros(50))
+        return PDE.solve()[0][:, -1]
+
+    reference = final_solution("crank_nicolson", 2000)
+    for method, expected_ratio in [("backward_euler", 2), ("crank_nicolson", 4)]:
+        error_coarse = np.linalg.norm(final_solution(method, 20) - reference)
+        error_fine = np.linalg.norm(final_solution(method, 40) - reference)
+        assert np.isclose(error_coarse/error_fine, expected_ratio, rtol=0.2)
+
+@pytest.mark.parametrize("method", ["forward_euler", "backward_euler"])
+@pytest.mark.parametrize(
+    "grid_obs, time_obs, observation_map",
+    [(None, 'final', None),
+     (None, 'every_5', None),
+     ('half_grid', 'final', None),
+     ('half_grid', 'every_5', lambda x: x**2)])
+def test_TimeDependentLinearPDE_store_only_observed(method, grid_obs, time_obs, observation_map):
+    """ Storing only the observed time slices gives the same observations """
+    time_steps = np.linspace(0, 0.02, 101)
+    grid_sol = _create_heat1D_PDE(method, time_steps)[0].grid_sol
+    if grid_obs == 'half_grid':
+        grid_obs = grid_sol[::2]
+    if time_obs == 'every_5':
+        time_obs = time_steps[::5]
+
+    kwargs = {"grid_obs": grid_obs, "time_obs": time_obs, "observation_map": observation_map,
+              "time_invariant": True}
+    PDE, _ = _create_heat1D_PDE(method, time_steps, **kwargs)
+    PDE_observed, _ = _create_heat1D_PDE(method, time_steps, store_only_observed=True, **kwargs)
+
+    parameter = np.ones(50)
+    PDE.assemble(parameter)
+    PDE_observed.assemble(parameter)
+    sol, _ = PDE.solve()
+    sol_observed, _ = PDE_observed.solve()
+
+    assert sol_observed.shape == (50, len(PDE._time_obs))
+    assert np.allclose(PDE.observe(sol), PDE_observed.observe(sol_observed))
+
+def test_TimeDependentLinearPDE_store_only_observed_requires_observed_time_steps():
+    time_steps = np.linspace(0, 1, 11)
+    with pytest.raises(ValueError, match="subset of time_steps"):
+        _create_heat1D_PDE("backward_euler", time_steps, time_obs=np.array([0.55]),
+                           store_only_observed=True)
+
+def _observation_size(PDE, x):
+    PDE.assemble(x)
+    return PDE.observe(PDE.solve()[0]).size
+
+@pytest.mark.parametrize("method", ["forward_euler", "backward_euler", "crank_nicolson"])
+@pytest.mark.parametrize("parametrization", ["initial_condition", "source_term", "diffusivity"])
+@pytest.mark.parametrize("grid_obs, time_obs, store_only_observed",
+                         [(None, 'final', False),
+                          ('shifted_grid', 'every_5', False),
+                          ('shifted_grid', 'every_5', True)])
+def test_TimeDependentLinearPDE_gradient(method, parametrization, grid_obs, time_obs, store_only_observed):
+    """ The discrete adjoint gradient matches finite differences """
+    np.random.seed(0)
+    dim = 20
+    L = 5
+    dx = L/(dim+1)
+    grid_sol = np.linspace(dx, L-dx, dim)
+    Dxx = scipy.sparse.diags([np.ones(dim-1), -2*np.ones(dim), np.ones(dim-1)], [-1, 0, 1])/dx**2
+    num_steps = 100 if method == "forward_euler" else 20
+    time_steps = np.linspace(0, 0.05, num_steps+1)
+
+    if parametrization == "initial_condition":
+        PDE_form = lambda x, t: (Dxx, np.zeros(dim), x)
+        kwargs = {"initial_condition_gradient": lambda direction, x: direction}
+    elif parametrization == "source_term":
+        PDE_form = lambda x, t: (Dxx, x*np.cos(10*t), np.ones(dim))
+        kwargs = {"source_term_gradient": lambda direction, x, t: direction*np.cos(10*t)}
+    elif parametrization == "diffusivity":
+        # Time dependent operator (1+t)*Dxx*diag(exp(x))
+        PDE_form = lambda x, t: ((1+t)*Dxx@scipy.sparse.diags(np.exp(x)), np.ones(dim), np.sin(grid_sol))
+        kwargs = {"diff_op_gradient": lambda direction, x, t, u: (1+t)*(Dxx.T@direction)*np.exp(x)*u,
+                  "num_checkpoints": 3}
+
+    if grid_obs == 'shifted_grid':
+        grid_obs = grid_sol[2:-2:2] + dx/3
+    if time_obs == 'every_5':
+        time_obs = time_steps[::5]
+
+    PDE = cuqi.pde.TimeDependentLinearPDE(
+        PDE_form, time_steps, method=method, grid_sol=grid_sol, grid_obs=grid_obs,
+        time_obs=time_obs, store_only_observed=store_only_observed,
+        linalg_solve=scipy.sparse.linalg.spsolve, **kwargs)
+
+    x = 0.3*np.random.rand(dim)
+    model = cuqi.model.PDEModel(PDE, range_geometry=_observation_size(PDE, x), domain_geometry=dim)
+    direction = np.random.randn(model.range_dim)
+
+    grad = model.gradient(direction, x)
+    grad_fd = cuqi.utilities.approx_gradient(lambda x: direction@model.forward(x).ravel(), x, epsilon=1e-6)
+    assert np.allclose(grad, grad_fd, rtol=1e-4, atol=1e-8*np.linalg.norm(grad_fd))
+
+@pytest.mark.parametrize("num_checkpoints", [0, 1, 2, 3, 100])
+def test_TimeDependentLinearPDE_states_in_reverse(num_checkpoints):
+    """ Checkpointed states of the time stepping are equal to the solution """
+    time_steps = np.linspace(0, 0.1, 31)
+    PDE, _ = _create_heat1D_PDE("crank_nicolson", time_steps, num_checkpoints=num_checkpoints)
+    PDE.assemble(np.ones(50))
+    sol, _ = PDE.solve()
+
+    states = np.array(list(PDE._states_in_reverse(PDE._initial_state())))[::-1].T
+    assert np.allclose(states, sol)
+
+def test_TimeDependentLinearPDE_gradient_not_implemented():
+    time_steps = np.linspace(0, 0.1, 11)
+    PDE, _ = _create_heat1D_PDE("backward_euler", time_steps)
+    with pytest.raises(NotImplementedError, match="initial_condition_gradient"):
+        PDE.gradient_wrt_parameter(np.ones(50), np.ones(50))
+
+    PDE, _ = _create_heat1D_PDE("backward_euler", time_steps, observation_map=lambda u: u**2,
+                                source_term_gradient=lambda direction, x, t: direction)
+    with pytest.raises(NotImplementedError, match="observation_map"):
+        PDE.gradient_wrt_parameter(np.ones(50), np.ones(50))
+
 @pytest.mark.xfail(reason="Test fails due to difficult to compare values (1e-6 to 1e-42)")
 def test_TimeDependentLinearPDE_wave1D(copy_reference):
     """ Compute the final time solution of a 1D wave equation and
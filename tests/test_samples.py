@@ -238,6 +238,52 @@ def test_ess():
     samples = sampler.sample_adapt(500)
     assert samples.compute_ess().shape == samples.geometry.par_shape
 
+def _ar1_chains(n_chains, phi, Ns, rng):
+    """ Chains of AR(1) processes with coefficients phi (one variable per coefficient). """
+    chains = []
+    for _ in range(n_chains):
+        chain = np.zeros((len(phi), Ns))
+        noise = rng.standard_normal((len(phi), Ns))
+        for t in range(1, Ns):
+            chain[:, t] = phi*chain[:, t-1] + noise[:, t]
+        chains.append(chain)
+    return chains
+
+@pytest.mark.parametrize("method", ["bulk", "tail", "mean"])
+def test_ess_and_rhat_match_arviz(method, monkeypatch):
+    """ The native (blockwise) ESS and R-hat match arviz. """
+    arviz = pytest.importorskip("arviz")
+    rng = np.random.default_rng(0)
+    monkeypatch.setattr(cuqi.diagnostics, "_MAX_ELEMENTS_IN_MEMORY", 1000)
+    chains = _ar1_chains(3, np.array([0, 0.5, 0.9, 0.99, -0.5]), 501, rng)
+    samples = [Samples(chain) for chain in chains]
+
+    ess = samples[0].compute_ess(method=method)
+    ess_arviz = [float(arviz.ess(chains[0][i], method=method)) for i in range(5)]
+    assert np.allclose(ess, ess_arviz)
+
+    ess = cuqi.diagnostics.compute_ess(chains, method=method)
+    ess_arviz = [float(arviz.ess(np.array([chain[i] for chain in chains]), method=method)) for i in range(5)]
+    assert np.allclose(ess, ess_arviz)
+
+    rhat = samples[0].compute_rhat(samples[1:])
+    rhat_arviz = [float(arviz.rhat(np.array([chain[i] for chain in chains]))) for i in range(5)]
+    assert np.allclose(rhat, rhat_arviz)
+
+def test_ess_and_rhat_special_cases():
+    """ ESS of constant variables is the number of samples. Too few samples, chains or NaN values give NaN. """
+    rng = np.random.default_rng(0)
+    chains = _ar1_chains(2, np.array([0.5, 0.5]), 100, rng)
+    chains[0][1, 3] = np.nan
+    chains[1][0] = 1.0
+    chains[0][0] = 1.0
+    ess = cuqi.diagnostics.compute_ess(chains)
+    assert ess[0] == 200 and np.isnan(ess[1])
+    assert np.all(np.isnan(cuqi.diagnostics.compute_rhat(chains[:1])))
+    assert np.all(np.isnan(cuqi.diagnostics.compute_ess(chains[0][:, :3])))
+    with pytest.raises(ValueError, match="Unknown ESS method"):
+        cuqi.diagnostics.compute_ess(chains, method="unknown")
+
 @pytest.mark.parametrize("geometry", [cuqi.geometry.Discrete(2),
                                       cuqi.geometry.MappedGeometry(
                                           cuqi.geometry.Continuous1D(2), map=lambda x: x**2),
@@ -432,3 +478,193 @@ def test_computing_statistics_on_arbitrary_objects_raises_error(method):
     samples = cuqi.samples.Samples([object(), object()])
     with pytest.raises(TypeError, match=r"Cannot compute statistics"):
         method(samples)
+
+def _write_batches(path, samples, batch_size):
+    """ Write samples (dim, Ns) to batch files in the format used when sampling with a batch size. """
+    for batch_id, start in enumerate(range(0, samples.shape[-1], batch_size)):
+        batch = samples[:, start:start+batch_size].T
+        np.savez(path / f"batch_{batch_id:04d}.npz", samples=batch, batch_id=batch_id)
+
+@pytest.mark.parametrize("Nb, Nt", [(0, 1), (7, 1), (5, 3), (26, 4)])
+def test_samples_from_batches_matches_samples(tmp_path, monkeypatch, Nb, Nt):
+    """ Samples read lazily from batches on disk give the same statistics as Samples in memory. """
+    monkeypatch.setattr(cuqi.samples._samples._BatchedSamples, "_MAX_ELEMENTS_IN_MEMORY", 50)
+    geom = cuqi.geometry.Continuous1D(4)
+    raw = np.random.randn(4, 103)
+    _write_batches(tmp_path, raw, batch_size=10)
+
+    samples = Samples(raw, geometry=geom).burnthin(Nb, Nt)
+    samples_batched = Samples.from_batches(str(tmp_path), geometry=geom).burnthin(Nb, Nt)
+
+    assert isinstance(samples_batched, Samples)
+    assert samples_batched.Ns == samples.Ns
+    assert samples_batched.shape == samples.shape
+    assert samples_batched.geometry == geom
+    assert np.allclose(samples_batched.samples, samples.samples)
+    assert np.allclose(samples_batched.mean(), samples.mean())
+    assert np.allclose(samples_batched.variance(), samples.variance())
+    assert np.allclose(samples_batched.std(), samples.std())
+    assert np.allclose(samples_batched.median(), samples.median())
+    assert np.allclose(samples_batched.compute_ci(90), samples.compute_ci(90))
+    assert np.allclose(np.array(list(samples_batched)).T, samples.samples)
+
+def test_samples_from_batches_orders_batches_and_burnthin_twice(tmp_path):
+    """ Batches are ordered by batch id (not alphabetically) and burnthin can be applied repeatedly. """
+    raw = np.arange(24, dtype=float).reshape(2, 12)
+    # Batch ids beyond 4 digits do not sort alphabetically
+    for batch_id, start in zip([9999, 10000, 10001], [0, 4, 8]):
+        np.savez(tmp_path / f"batch_{batch_id:04d}.npz", samples=raw[:, start:start+4].T, batch_id=batch_id)
+
+    samples = Samples.from_batches(str(tmp_path))
+    assert np.allclose(samples.samples, raw)
+    assert np.allclose(samples.burnthin(1, 2).burnthin(2, 2).samples, raw[:, 1::2][:, 2::2])
+
+    (tmp_path / "empty").mkdir()
+    with pytest.raises(ValueError, match="No sample batches"):
+        Samples.from_batches(str(tmp_path / "empty"))
+
+def test_chunked_samples_are_initialized_as_samples(tmp_path, monkeypatch):
+    """ Lazy sample views run Samples.__init__ (so they get any attribute it sets) and must implement _iter_batches. """
+    samples_init = Samples.__init__
+    def init(self, *args, **kwargs):
+        samples_init(self, *args, **kwargs)
+        self._initialized_as_samples = True
+    monkeypatch.setattr(Samples, "__init__", init)
+
+    geom = cuqi.geometry.KLExpansion(np.linspace(0, 1, 10), num_modes=4)
+    raw = np.random.randn(4, 12)
+    _write_batches(tmp_path, raw, batch_size=5)
+    batched = Samples.from_batches(str(tmp_path), geometry=geom)
+    for view in [batched, batched.burnthin(2), batched.funvals, Samples(raw, geometry=geom).funvals]:
+        assert view._initialized_as_samples
+    assert (batched.is_par, batched.is_vec) == (True, True)
+    assert (batched.funvals.is_par, batched.funvals.is_vec) == (False, True)
+
+    with pytest.raises(AttributeError, match="cannot be set"):
+        batched.samples = raw
+    with pytest.raises(TypeError):
+        cuqi.samples._samples._ChunkedSamples()
+
+def test_online_statistics_matches_samples_statistics():
+    """ Online mean and variance are exact and P² quantile estimates are close to the sample quantiles. """
+    np.random.seed(0)
+    raw = np.random.randn(3, 5000)*np.array([[1], [2], [0.5]]) + np.array([[0], [1], [-3]])
+    samples = Samples(raw)
+
+    stats = cuqi.samples.OnlineStatistics(3, percent=90)
+    for idx, sample in enumerate(samples):
+        stats(sample, idx) # Can be used as callback
+
+    assert stats.Ns == 5000
+    assert np.allclose(stats.mean(), samples.mean())
+    assert np.allclose(stats.variance(), samples.variance())
+    assert np.allclose(stats.std(), samples.std())
+    assert np.allclose(stats.median(), samples.median(), atol=0.05)
+    assert np.allclose(stats.compute_ci(), samples.compute_ci(90), atol=0.1)
+
+def test_online_statistics_few_samples():
+    """ Quantiles are exact before the P² markers are initialized and errors are raised without samples. """
+    stats = cuqi.samples.OnlineStatistics(2)
+    with pytest.raises(ValueError, match="before any samples"):
+        stats.mean()
+    raw = np.random.randn(2, 3)
+    for sample in raw.T:
+        stats.update(sample)
+    assert np.allclose(stats.median(), np.median(raw, axis=-1))
+    assert np.allclose(stats.compute_autocovariance()[0], np.var(raw, axis=-1))
+
+def test_online_statistics_autocovariance_and_ess():
+    """ Running autocovariance is exact and the ESS matches the theory of an AR(1) process. """
+    np.random.seed(1)
+    Ns, phi = 20000, np.array([0.0, 0.9])
+    raw = np.zeros((2, Ns))
+    for t in range(1, Ns):
+        raw[:, t] = phi*raw[:, t-1] + np.random.randn(2)
+
+    stats = cuqi.samples.OnlineStatistics(2, max_lag=60)
+    for sample in raw.T:
+        stats.update(sample)
+
+    centered = raw - raw.mean(axis=-1, keepdims=True)
+    autocov = np.array([np.sum(centered[:, k:]*centered[:, :Ns-k], axis=-1)/Ns for k in range(61)])
+    assert np.allclose(stats.compute_autocovariance(), autocov)
+
+    ess_theory = Ns*(1-phi)/(1+phi)
+    assert np.allclose(stats.compute_ess(), ess_theory, rtol=0.2)
+
+@pytest.mark.parametrize("geom", [
+    cuqi.geometry.KLExpansion(np.linspace(0, 1, 50), num_modes=10),
+    cuqi.geometry.KLExpansion_Full(np.linspace(0, 1, 50)),
+    cuqi.geometry.CustomKL(np.linspace(0, 1, 30), trunc_term=5),
+    cuqi.geometry.StepExpansion(np.linspace(0, 1, 30), n_steps=3),
+    cuqi.geometry.Image2D((4, 5), order="F"),
+    cuqi.geometry.MappedGeometry(cuqi.geometry.Continuous1D(10), map=lambda x: x**2),
+])
+def test_samples_funvals_batched(geom, monkeypatch):
+    """ Samples.funvals converts blocks of samples and matches per-sample conversion. """
+    np.random.seed(0)
+    samples = cuqi.samples.Samples(np.random.randn(geom.par_dim, 25), geometry=geom)
+    expected = np.stack([geom.par2fun(sample) for sample in samples], axis=-1)
+    geom.fun_shape # Infer (and store) the function shape before counting calls
+
+    calls = []
+    par2fun = geom.par2fun
+    monkeypatch.setattr(geom, "par2fun", lambda p: calls.append(p.shape) or par2fun(p))
+    monkeypatch.setattr(cuqi.config, "BATCH_SIZE", 10)
+    funvals = samples.funvals
+
+    assert np.allclose(funvals.samples, expected)
+    if cuqi.geometry._geometry._has_batch_map(geom, "par2fun"):
+        assert calls == [geom.par_shape+(10,), geom.par_shape+(10,), geom.par_shape+(5,)]
+    else:
+        assert len(calls) == samples.Ns
+
+@pytest.mark.parametrize("geom", [
+    cuqi.geometry.KLExpansion(np.linspace(0, 1, 20), num_modes=5),
+    cuqi.geometry.Image2D((4, 5), order="F"),
+])
+def test_samples_lazy_funvals_statistics(geom, tmp_path, monkeypatch):
+    """ Moments of function values are streamed from the parameter samples (one chunk at a time) and function values are only stored when percentiles are requested. """
+    np.random.seed(0)
+    monkeypatch.setattr(cuqi.config, "BATCH_SIZE", 7)
+    raw = np.random.randn(geom.par_dim, 53)
+    _write_batches(tmp_path, raw, batch_size=10)
+    expected = np.stack([geom.par2fun(par) for par in raw.T], axis=-1)
+
+    calls = []
+    par2fun_batch = geom._par2fun_batch
+    monkeypatch.setattr(geom, "_par2fun_batch", lambda pars: calls.append(pars.shape) or par2fun_batch(pars))
+
+    # Function values are stored in memory or in a temporary file
+    for max_elements, store_type in [(10**7, np.ndarray), (100, np.memmap)]:
+        monkeypatch.setattr(cuqi.samples._samples._ChunkedSamples, "_MAX_ELEMENTS_IN_MEMORY", max_elements)
+        for samples in [Samples(raw, geometry=geom), Samples.from_batches(str(tmp_path), geometry=geom)]:
+            calls.clear()
+            funvals = samples.funvals
+            assert funvals.shape == expected.shape
+            assert len(calls) == 0 # Nothing is converted before it is needed
+
+            # Moments are computed in one conversion pass without storing the function values
+            assert np.allclose(funvals.mean(), np.mean(expected, axis=-1))
+            assert np.allclose(funvals.variance(), np.var(expected, axis=-1))
+            assert funvals._store is None
+            assert sum(shape[-1] for shape in calls) == samples.Ns
+
+            # Percentiles store the function values in one more conversion pass and reuse them
+            assert np.allclose(funvals.median(), np.median(expected, axis=-1))
+            assert np.allclose(funvals.compute_ci(90), np.percentile(expected, [5, 95], axis=-1))
+            assert np.allclose(funvals.samples, expected)
+            assert funvals.samples is funvals.samples
+            assert type(funvals._store) is store_type
+            assert all(shape[-1] <= 7 for shape in calls)
+            assert sum(shape[-1] for shape in calls) == 2*samples.Ns
+
+            assert np.allclose(funvals.burnthin(3, 2).mean(), np.mean(expected[..., 3::2], axis=-1))
+            assert np.allclose(funvals.parameters.samples, raw)
+
+    # The samples attribute alone converts the samples once without a store
+    calls.clear()
+    funvals = Samples(raw, geometry=geom).funvals
+    assert np.allclose(funvals.samples, expected)
+    assert funvals._store is None
+    assert sum(shape[-1] for shape in calls) == raw.shape[-1]
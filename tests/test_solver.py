@@ -1,7 +1,10 @@
+import pytest
 import numpy as np
 import scipy as sp
 
-from cuqi.solver import CGLS, LM, FISTA, ProximalL1
+from cuqi.solver import CGLS, PCGLS, LM, FISTA, ProximalL1, L_BFGS_B, minimize, maximize
+from cuqi.utilities import _PreparedLinearSolver
+from cuqi.solver._solver import _NormalEquationsSolver
 from scipy.optimize import lsq_linear
 
 
@@ -21,6 +24,38 @@ def test_CGLS():
     assert np.allclose(sol, ref_sol, rtol=1e-3)
 
 
+@pytest.mark.parametrize("structure", ["diagonal", "sparse", "lower", "upper", "dense"])
+def test_PCGLS(structure):
+    rng = np.random.default_rng(seed=0)
+    m, n = 60, 30
+    A = rng.standard_normal((m, n))
+    b = rng.standard_normal(m)
+    ref_sol = np.linalg.lstsq(A, b, rcond=None)[0]
+
+    R = np.linalg.qr(A, mode='r')
+    P = {"diagonal": np.diag(np.abs(np.diag(R))),
+         "sparse": sp.sparse.csr_matrix(R),
+         "lower": np.linalg.cholesky(A.T@A),
+         "upper": R,
+         "dense": R + 1e-3*rng.standard_normal((n, n))}[structure]
+
+    sol, it = PCGLS(A, b, np.zeros(n), _PreparedLinearSolver(P), 1000, tol=1e-12).solve()
+    assert np.allclose(sol, ref_sol)
+    if structure in ("sparse", "upper"):
+        assert it <= 3 # Exact preconditioner
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_NormalEquationsSolver(sparse):
+    rng = np.random.default_rng(seed=0)
+    m, n, k = 80, 40, 3
+    A = sp.sparse.random(m, n, density=0.2, random_state=rng) + sp.sparse.eye(m, n)
+    B = rng.standard_normal((m, k))
+    ref_sol = np.linalg.lstsq(A.toarray(), B, rcond=None)[0]
+
+    solver = _NormalEquationsSolver(A if sparse else A.toarray())
+    assert np.allclose(solver.solve(B), ref_sol)
+    assert np.allclose(solver.solve(B[:, 0]), ref_sol[:, 0])
+
 def test_LM():
     # compare to MATLAB's original code solution
     t = np.arange(1, 10, 2)
@@ -44,6 +79,20 @@ def test_LM():
     ref_opt = np.array([0.92953293909007, 0.109186388510998])
 
     assert np.allclose(MSE, ref_MSE) and np.allclose(opt, ref_opt)
+
+@pytest.mark.parametrize("solver_class", [L_BFGS_B, minimize, maximize])
+def test_solver_with_function_returning_value_and_gradient(solver_class):
+    """ Test that gradfunc=True (func returns value and gradient) gives the same solution as a separate gradient. """
+    sign = -1 if solver_class is maximize else 1
+    c = np.array([1., -2., 3.])
+    func = lambda x: sign*np.sum((x-c)**2)
+    gradfunc = lambda x: sign*2*(x-c)
+    func_and_grad = lambda x: (func(x), gradfunc(x))
+
+    sol, _ = solver_class(func, np.zeros(3), gradfunc=gradfunc).solve()
+    sol_fused, info = solver_class(func_and_grad, np.zeros(3), gradfunc=True).solve()
+    assert np.allclose(sol_fused, c)
+    assert np.allclose(sol_fused, sol)
     
 def test_FISTA():
     # Parameters
@@ -134,6 +134,16 @@ def test_Heat():
     assert np.linalg.norm(model.forward(true_kappa, is_par=False)) == approx(0.5476375563249378)
     assert np.linalg.norm(model.forward(np.ones(model.domain_dim))) == approx(0.548657107830281)
 
+def test_Heat_posterior_gradient():
+    """ Adjoint based gradient of the Heat1D posterior matches finite differences """
+    np.random.seed(0)
+    posterior = cuqi.testproblem.Heat1D(dim=32).posterior
+    x = 0.1*np.random.randn(posterior.dim)
+
+    grad = posterior.gradient(x)
+    posterior.enable_FD()
+    assert np.allclose(grad, posterior.gradient(x), rtol=1e-4)
+
 def test_Abel():
     N = 128
     L = 1
@@ -1,7 +1,7 @@
 import pytest
 from scipy.linalg import cholesky
 from scipy.sparse import diags
-from cuqi.utilities import sparse_cholesky, plot_1D_density, plot_2D_density
+from cuqi.utilities import sparse_cholesky, plot_1D_density, plot_2D_density, approx_gradient, approx_derivative
 from cuqi.model import LinearModel
 from cuqi.distribution import Gaussian, Uniform, JointDistribution
 import numpy as np
@@ -65,4 +65,53 @@ def test_plot_density(density, log_scale):
         plot_2D_density(
             density, -3, 3, -3, 3, 60, 60, cmap='gray', log_scale=log_scale)
     else:
-        raise ValueError("Density must be 1D or 2D.")
\ No newline at end of file
+        raise ValueError("Density must be 1D or 2D.")
+
+
+@pytest.mark.parametrize("method, tol", [("forward", 1e-4), ("central", 1e-7), ("complex", 1e-10)])
+@pytest.mark.parametrize("vectorized, workers", [(False, None), (True, None), (False, 3)])
+def test_approx_gradient(method, tol, vectorized, workers):
+    """ Test the finite difference schemes and evaluation strategies of approx_gradient. """
+    A = np.random.RandomState(0).randn(5, 5)
+    func = lambda x: np.sum(np.exp(A@x), axis=0)
+    x = np.linspace(-0.1, 0.2, 5)
+    exact_gradient = A.T@np.exp(A@x)
+
+    gradient = approx_gradient(func, x, epsilon=1e-6, method=method, vectorized=vectorized, workers=workers)
+    assert gradient.shape == x.shape
+    assert np.allclose(gradient, exact_gradient, rtol=tol, atol=0)
+
+def test_approx_gradient_reuses_function_value():
+    """ Test that approx_gradient does not evaluate the function at x if func_x is given. """
+    points = []
+    def func(x):
+        points.append(x)
+        return x@x
+    x = np.array([1., 2., 3.])
+    gradient = approx_gradient(func, x, func_x=func(x))
+    assert len(points) == 4
+    assert np.allclose(gradient, 2*x, atol=1e-4)
+    assert np.isclose(approx_gradient(lambda x: x**2, 3., method="central"), 6)
+
+def test_approx_derivative_vectorized():
+    """ Test that the vectorized approx_derivative evaluates all perturbed points in one call. """
+    A = np.random.RandomState(0).randn(4, 3)
+    calls = []
+    def func(x):
+        calls.append(x.shape)
+        return A@x
+    jacobian = approx_derivative(func, np.ones(3), method="central", vectorized=True)
+    assert np.allclose(jacobian, A)
+    assert calls == [(3, 3), (3, 3)]
+
+def test_density_FD_gradient_methods():
+    """ Test that the FD gradient of a density uses the given method and reuses the log density in logd_and_gradient. """
+    x = Gaussian(np.zeros(4), 2)
+    val = np.array([0.1, -0.3, 0.5, 1.])
+    x.enable_FD(1e-20, method="complex")
+    assert np.allclose(x.gradient(val), -val/2, rtol=1e-12)
+
+    x.enable_FD(1e-6, workers=2)
+    logd, gradient = x.logd_and_gradient(val)
+    assert np.allclose(logd, x.logd(val))
+    assert np.array_equal(gradient, x.gradient(val))
@@ -2,6 +2,9 @@ import cuqi
 import pytest
 import numpy as np
 import inspect
+import warnings
+import os
+import threading
 from numbers import Number
 
 def assert_true_if_sampling_is_equivalent(
@@ -199,6 +202,68 @@ def test_LinearRTO_regression_warmup(target: cuqi.density.Density):
     sampler_new = cuqi.experimental.mcmc.LinearRTO(target)
     assert_true_if_warmup_is_equivalent(sampler_old, sampler_new)
 
+@pytest.mark.parametrize("preconditioner", ["prior", "incomplete", "matrix"])
+def test_LinearRTO_preconditioner_gives_same_samples_in_fewer_iterations(preconditioner):
+    """ Preconditioned and plain CGLS should converge to the same samples, the former in fewer iterations. """
+    target = create_multiple_likelihood_posterior_target(dim=32)
+    np.random.seed(0)
+    sampler = cuqi.experimental.mcmc.LinearRTO(target, maxit=1000, tol=1e-12)
+    samples = sampler.sample(10).get_samples()
+
+    if preconditioner == "matrix": # Upper Cholesky factor of M^T M
+        M = sampler._assemble_M().toarray()
+        preconditioner = np.linalg.cholesky(M.T@M).T
+
+    np.random.seed(0)
+    sampler_pc = cuqi.experimental.mcmc.LinearRTO(target, maxit=1000, tol=1e-12, preconditioner=preconditioner)
+    samples_pc = sampler_pc.sample(10).get_samples()
+
+    assert np.allclose(samples.samples, samples_pc.samples, rtol=1e-5, atol=1e-6)
+    assert len(sampler_pc.num_iterations) == 10
+    assert np.sum(sampler_pc.num_iterations) < np.sum(sampler.num_iterations)
+
+def test_LinearRTO_invalid_preconditioner_raises():
+    target = create_multiple_likelihood_posterior_target(dim=16)
+    with pytest.raises(ValueError, match="not recognized"):
+        cuqi.experimental.mcmc.LinearRTO(target, preconditioner="ilu").sample(1)
+    with pytest.raises(ValueError, match="square matrix"):
+        cuqi.experimental.mcmc.LinearRTO(target, preconditioner=np.eye(3)).sample(1)
+
+def test_LinearRTO_cholesky_solver_matches_converged_cgls():
+    """ The direct solver should give the same samples as CGLS run to convergence. """
+    target = create_multiple_likelihood_posterior_target(dim=32)
+
+    np.random.seed(0)
+    samples_cgls = cuqi.experimental.mcmc.LinearRTO(target, maxit=1000, tol=1e-14).sample(10).get_samples()
+
+    np.random.seed(0)
+    sampler = cuqi.experimental.mcmc.LinearRTO(target, solver="cholesky")
+    samples_chol = sampler.sample(10).get_samples()
+
+    assert np.allclose(samples_cgls.samples, samples_chol.samples, rtol=1e-5, atol=1e-8)
+    assert np.all(sampler.num_iterations == 0)
+
+def test_LinearRTO_sample_block_matches_sample():
+    target = create_multiple_likelihood_posterior_target(dim=32)
+    sampler = cuqi.experimental.mcmc.LinearRTO(target, solver="cholesky")
+
+    np.random.seed(0)
+    samples = sampler.sample(25).get_samples()
+
+    np.random.seed(0)
+    samples_block = sampler.sample_block(25, block_size=10)
+
+    assert samples_block.shape == (32, 25)
+    assert np.allclose(samples.samples, samples_block.samples)
+    assert sampler.get_samples().Ns == 25 # History not modified
+
+def test_LinearRTO_invalid_solver_raises():
+    target = create_multiple_likelihood_posterior_target(dim=16)
+    with pytest.raises(ValueError, match="not recognized"):
+        cuqi.experimental.mcmc.LinearRTO(target, solver="qr").sample(1)
+    with pytest.raises(ValueError, match="direct solver"):
+        cuqi.experimental.mcmc.LinearRTO(target).sample_block(2)
+
 # ============ RegularizedLinearRTO ============
 
 def create_regularized_target(dim=16):
@@ -324,6 +389,15 @@ def test_NUTS_regression_warmup(target: cuqi.density.Density):
                                         Ns=Ns,
                                         Nb=Nb,
                                         strategy="NUTS")
+
+def test_NUTS_does_not_convert_arrays_to_scalars():
+    """ The slice variable and Hamiltonians are scalars, so NUTS does not trigger numpy's array to scalar conversion deprecation """
+    target = cuqi.distribution.Gaussian(np.zeros(2), 1)
+    sampler = cuqi.experimental.mcmc.NUTS(target)
+    np.random.seed(0)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error", message="Conversion of an array", category=DeprecationWarning)
+        sampler.warmup(10).sample(10)
     
 def create_conjugate_target(type:str):
     if type.lower() == 'gaussian-gamma':
@@ -907,6 +981,202 @@ def test_HybridGibbs_updates_state_only_after_accepting_sample():
         else:
             assert sampler_states[key] != new_state, f"Sampler {key} state was erroneously not updated in Gibbs scheme, even when new samples were accepted. State: \n {new_state}"
 
+def test_update_target_keeps_state_and_history():
+    """ Test that updating the target of an initialized sampler keeps its state and history but updates target dependent quantities. """
+    sampler = cuqi.experimental.mcmc.MH(cuqi.distribution.Gaussian(np.zeros(2), 1), scale=0.5)
+    sampler.sample(10)
+    state = sampler.get_state()
+
+    new_target = cuqi.distribution.Gaussian(np.ones(2), 2)
+    sampler.update_target(new_target)
+
+    assert sampler.target is new_target
+    assert np.allclose(sampler.current_point, state['state']['current_point'])
+    assert sampler.scale == state['state']['scale']
+    assert np.isclose(sampler.current_target_logd, new_target.logd(sampler.current_point))
+    assert sampler.get_samples().Ns == 10
+    assert len(sampler._acc) == 11
+
+def test_HybridGibbs_conditionals_only_depend_on_neighbouring_variables():
+    """ Test that the conditional of each variable only depends on the variables in the densities involving it. """
+    A, y_data, _ = cuqi.testproblem.Deconvolution1D(dim=10).get_components()
+    d = cuqi.distribution.Gamma(1, 1e-4)
+    s = cuqi.distribution.Gamma(1, 1e-4)
+    x = cuqi.distribution.GMRF(np.zeros(10), lambda d: d)
+    y = cuqi.distribution.Gaussian(A@x, lambda s: 1/s)
+    posterior = cuqi.distribution.JointDistribution(d, s, x, y)(y=y_data)
+
+    sampling_strategy = {
+        "x" : cuqi.experimental.mcmc.LinearRTO(),
+        "d" : cuqi.experimental.mcmc.Conjugate(),
+        "s" : cuqi.experimental.mcmc.Conjugate()
+    }
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, sampling_strategy)
+
+    assert sampler._conditioning_variables == {"d": ["x"], "s": ["x"], "x": ["d", "s"]}
+
+    # The target is only updated if one of the variables it is conditioned on changed
+    target_d = sampler.samplers["d"].target
+    sampler._set_current_sample("s", 2*sampler.current_samples["s"])
+    sampler._set_target("d")
+    assert sampler.samplers["d"].target is target_d
+
+    sampler._set_current_sample("x", sampler.current_samples["x"] + 1)
+    sampler._set_target("d")
+    assert sampler.samplers["d"].target is not target_d
+
+    # Conditionals agree with conditioning the full joint distribution (up to a constant)
+    sampler.sample(5)
+    sampler._set_target("d")
+    conditional = sampler.samplers["d"].target
+    full_conditional = posterior(x=sampler.current_samples["x"], s=sampler.current_samples["s"])
+    d1, d2 = np.array([1.0]), np.array([3.0])
+    assert np.isclose(conditional.logd(d1) - conditional.logd(d2), full_conditional.logd(d1) - full_conditional.logd(d2))
+
+def create_hierarchical_target_with_two_hyperparameters(dim=10):
+    A, y_data, _ = cuqi.testproblem.Deconvolution1D(dim=dim).get_components()
+    d = cuqi.distribution.Gamma(1, 1e-4)
+    s = cuqi.distribution.Gamma(1, 1e-4)
+    x = cuqi.distribution.GMRF(np.zeros(dim), lambda d: d)
+    y = cuqi.distribution.Gaussian(A@x, lambda s: 1/s)
+    return cuqi.distribution.JointDistribution(d, s, x, y)(y=y_data)
+
+@pytest.mark.parametrize("executor", ["serial", "thread"])
+def test_HybridGibbs_schedule_groups_conditionally_independent_parameters(executor):
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    sampling_strategy = {
+        "x" : cuqi.experimental.mcmc.LinearRTO(),
+        "d" : cuqi.experimental.mcmc.Conjugate(),
+        "s" : cuqi.experimental.mcmc.Conjugate()
+    }
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, sampling_strategy, executor=executor)
+
+    assert sampler.schedule == [["d", "s"], ["x"]]
+
+    samples = sampler.warmup(5).sample(10).get_samples()
+
+    assert samples["d"].Ns == 15 and samples["s"].Ns == 15 and samples["x"].Ns == 15
+    timings = sampler.get_timings()
+    assert set(timings.keys()) == {"d", "s", "x"}
+    assert all(t > 0 for t in timings.values())
+
+def test_HybridGibbs_serial_schedule_matches_sequential_sweep():
+    """ Grouping conditionally independent parameters must not change the samples of a serial Gibbs sweep. """
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    def sampling_strategy():
+        return {
+            "x" : cuqi.experimental.mcmc.LinearRTO(),
+            "d" : cuqi.experimental.mcmc.Conjugate(),
+            "s" : cuqi.experimental.mcmc.Conjugate()
+        }
+
+    np.random.seed(0)
+    samples = cuqi.experimental.mcmc.HybridGibbs(posterior, sampling_strategy()).sample(10).get_samples()
+
+    np.random.seed(0)
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, sampling_strategy())
+    sampler._schedule = [["d"], ["s"], ["x"]]
+    samples_sequential = sampler.sample(10).get_samples()
+
+    for par_name in ["d", "s", "x"]:
+        assert np.allclose(samples[par_name].samples, samples_sequential[par_name].samples)
+
+def test_HybridGibbs_invalid_executor_raises():
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    sampling_strategy = {
+        "x" : cuqi.experimental.mcmc.LinearRTO(),
+        "d" : cuqi.experimental.mcmc.Conjugate(),
+        "s" : cuqi.experimental.mcmc.Conjugate()
+    }
+    with pytest.raises(ValueError, match="not recognized"):
+        cuqi.experimental.mcmc.HybridGibbs(posterior, sampling_strategy, executor="process")
+
+def _hierarchical_sampling_strategy():
+    return {
+        "x" : cuqi.experimental.mcmc.LinearRTO(),
+        "d" : cuqi.experimental.mcmc.Conjugate(),
+        "s" : cuqi.experimental.mcmc.Conjugate()
+    }
+
+def test_HybridGibbs_thinning_stores_every_thin_sample():
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+
+    np.random.seed(0)
+    samples = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy()).sample(12).get_samples()
+
+    np.random.seed(0)
+    samples_thinned = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy()).sample(12, thin=3).get_samples()
+
+    for par_name in ["d", "s", "x"]:
+        assert samples_thinned[par_name].Ns == 4
+        assert np.allclose(samples_thinned[par_name].samples, samples[par_name].samples[:, 2::3])
+
+def test_HybridGibbs_batches_samples_to_disk(tmp_path):
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy())
+    samples = sampler.sample(10, batch_size=4, sample_path=str(tmp_path)).get_samples()
+
+    for par_name in ["d", "s", "x"]:
+        assert len(os.listdir(tmp_path / par_name)) == 3
+        samples_from_batches = cuqi.samples.Samples.from_batches(str(tmp_path / par_name))
+        assert np.allclose(samples_from_batches.mean(), samples[par_name].mean())
+
+def test_HybridGibbs_memmap_sample_store(tmp_path):
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+
+    np.random.seed(0)
+    samples = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy()).warmup(5).sample(10).get_samples()
+
+    np.random.seed(0)
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy(), sample_store=str(tmp_path))
+    samples_store = sampler.warmup(5).sample(10).get_samples()
+
+    for par_name in ["d", "s", "x"]:
+        assert os.path.isfile(tmp_path / f"{par_name}.dat")
+        assert isinstance(samples_store[par_name].samples.base, np.memmap)
+        assert np.allclose(samples_store[par_name].samples, samples[par_name].samples)
+
+def test_HybridGibbs_preallocates_samples():
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy())
+    sampler.warmup(5).sample(7)
+
+    assert sampler._samples["x"].capacity == 12
+    samples = sampler.get_samples()
+    assert samples["x"].shape == (10, 12)
+
+def test_HybridGibbs_samples_attribute_is_dict_of_lists():
+    """ HybridGibbs.samples keeps its dictionary of lists of samples although the samples are preallocated """
+    posterior = create_hierarchical_target_with_two_hyperparameters()
+    sampler = cuqi.experimental.mcmc.HybridGibbs(posterior, _hierarchical_sampling_strategy())
+    sampler.sample(5)
+
+    samples = sampler.get_samples()
+    assert set(sampler.samples.keys()) == {"d", "s", "x"}
+    for par_name in ["d", "s", "x"]:
+        assert isinstance(sampler.samples[par_name], list)
+        assert len(sampler.samples[par_name]) == 5
+        assert np.allclose(np.array(sampler.samples[par_name]).T, samples[par_name].samples)
+
+    # The returned samples are copies that can be modified without changing the stored samples
+    samples["x"].samples[:] = 0
+    sampler.samples["x"][0][:] = 0
+    assert np.allclose(np.array(sampler.samples["x"]).T, sampler.get_samples()["x"].samples)
+    assert not np.allclose(sampler.get_samples()["x"].samples, 0)
+
+def test_NUTS_within_HybridGibbs_is_stateful():
+    """ Test that NUTS keeps its step size and history between Gibbs steps. """
+    target = HybridGibbs_target_1()
+    sampling_strategy = {
+        "x" : cuqi.experimental.mcmc.NUTS(max_depth=5),
+        "s" : cuqi.experimental.mcmc.Conjugate()
+    }
+    sampler = cuqi.experimental.mcmc.HybridGibbs(target, sampling_strategy)
+    sampler.warmup(5).sample(5)
+
+    assert len(sampler.samplers["x"].epsilon_list) == 10
+    assert sampler.samplers["x"].epsilon_list[-1] == sampler.samplers["x"]._epsilon_bar
+
 def HybridGibbs_target_1():
     """ Create a target for the HybridGibbs sampler. """
     # Forward problem
@@ -925,12 +1195,26 @@ def HybridGibbs_target_1():
     return target
 
 
-def test_NUTS_within_HybridGibbs_regression_sample_and_warmup(copy_reference):
-    """ Test that using NUTS sampler within HybridGibbs sampler works as
-    expected."""
-    #TODO: This test might break in the future if the NUTS within HybridGibbs
-    # is changed to be fully stateful.
-
+class _ReinitializingHybridGibbs(cuqi.experimental.mcmc.HybridGibbs):
+    """ HybridGibbs that reinitializes the samplers in every Gibbs step (restoring the state and history,
+    except for NUTS which restarts from its current point), as HybridGibbs did before it became stateful. """
+    def _sample_conditional(self, par_name):
+        sampler = self.samplers[par_name]
+        sampler.target = self.target(**{name: self.current_samples[name] for name in self.par_names if name != par_name})
+        if isinstance(sampler, cuqi.experimental.mcmc.NUTS):
+            sampler.initial_point = sampler.current_point
+            sampler.reinitialize()
+        else:
+            state, history = sampler.get_state(), sampler.get_history()
+            sampler.reinitialize()
+            sampler.set_state(state)
+            sampler.set_history(history)
+        for _ in range(self.num_sampling_steps[par_name]):
+            sampler._acc.append(sampler.step())
+        return sampler.current_point
+
+def _sample_NUTS_within_HybridGibbs(gibbs_class):
+    """ Warmup and sample the HybridGibbs_target_1 using NUTS for x and Conjugate for s. """
     Nb=10
     Ns=10
 
@@ -947,13 +1231,21 @@ def test_NUTS_within_HybridGibbs_regression_sample_and_warmup(copy_reference):
         "s" : 1
     }
 
-    sampler = cuqi.experimental.mcmc.HybridGibbs(
+    sampler = gibbs_class(
         target, sampling_strategy, num_sampling_steps)
     
     np.random.seed(0)
     sampler.warmup(Nb)
     sampler.sample(Ns)
-    samples = sampler.get_samples()
+    return sampler.get_samples()
+
+def test_NUTS_within_HybridGibbs_regression_sample_and_warmup(copy_reference):
+    """ Test that using NUTS sampler within HybridGibbs sampler works as
+    expected. The reference was created before HybridGibbs became stateful,
+    when NUTS was reinitialized (searching a new step size) in every Gibbs
+    step, so the samples are compared for a HybridGibbs that does the same."""
+
+    samples = _sample_NUTS_within_HybridGibbs(_ReinitializingHybridGibbs)
 
     # Read samples from reference
     file = copy_reference("data/s_x_NUTS_within_HybridGibbs.npz")
@@ -965,6 +1257,37 @@ def test_NUTS_within_HybridGibbs_regression_sample_and_warmup(copy_reference):
     assert np.allclose(samples["s"].samples, reference_s, rtol=1e-3)
     assert np.allclose(samples["x"].samples, reference_x, rtol=1e-3)
 
+def test_stateful_HybridGibbs_matches_reinitializing_HybridGibbs():
+    """ Test that the stateful HybridGibbs gives the same samples as reinitializing the samplers in every
+    Gibbs step (as validated against the original reference above) when the samplers have no adaptive state. """
+    samples = []
+    for gibbs_class in [cuqi.experimental.mcmc.HybridGibbs, _ReinitializingHybridGibbs]:
+        sampling_strategy = {
+            "x" : cuqi.experimental.mcmc.LinearRTO(),
+            "s" : cuqi.experimental.mcmc.Conjugate()
+        }
+        sampler = gibbs_class(HybridGibbs_target_1(), sampling_strategy)
+        np.random.seed(0)
+        samples.append(sampler.warmup(10).sample(10).get_samples())
+
+    assert np.allclose(samples[0]["x"].samples, samples[1]["x"].samples)
+    assert np.allclose(samples[0]["s"].samples, samples[1]["s"].samples)
+
+def test_NUTS_within_stateful_HybridGibbs_regression_sample_and_warmup(copy_reference):
+    """ Regression test of NUTS within the stateful HybridGibbs, which keeps the step size of NUTS between
+    Gibbs steps. The reference was generated with the stateful HybridGibbs. It differs from the original
+    reference only because NUTS is no longer reinitialized (see the two tests above). """
+
+    samples = _sample_NUTS_within_HybridGibbs(cuqi.experimental.mcmc.HybridGibbs)
+
+    # Read samples from reference
+    file = copy_reference("data/s_x_NUTS_within_stateful_HybridGibbs.npz")
+    reference = np.load(file)
+
+    # Compare samples
+    assert np.allclose(samples["s"].samples, reference["s"], rtol=1e-3)
+    assert np.allclose(samples["x"].samples, reference["x"], rtol=1e-3)
+
 
 # ============ Test for sampling with bounded distributions ============
 sampler_instances_for_bounded_distribution = [
@@ -1050,4 +1373,256 @@ def test_nuts_acceptance_rate(sampler: cuqi.experimental.mcmc.Sampler):
     # Compute the number of accepted samples according to the sampler
     acc_rate_sum = sum(sampler._acc[2:])
 
-    assert np.isclose(counter, acc_rate_sum), "NUTS sampler does not update acceptance rate correctly: "+str(counter)+" != "+str(acc_rate_sum)
\ No newline at end of file
+    assert np.isclose(counter, acc_rate_sum), "NUTS sampler does not update acceptance rate correctly: "+str(counter)+" != "+str(acc_rate_sum)
+
+# ============ Parallel chains ============
+
+chain_samplers = [
+    cuqi.experimental.mcmc.MH(cuqi.testproblem.Deconvolution1D(dim=8).posterior, scale=0.01),
+    cuqi.experimental.mcmc.LinearRTO(cuqi.testproblem.Deconvolution1D(dim=8).posterior),
+]
+
+@pytest.mark.parametrize("sampler", chain_samplers)
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_sample_chains_returns_independent_chains(sampler, executor):
+    """ Test that sample_chains returns one Samples object per chain with warmup removed. """
+    chains = sampler.sample_chains(20, n_chains=3, Nb=10, executor=executor, seed=0)
+    assert len(chains) == 3
+    for chain in chains:
+        assert isinstance(chain, cuqi.samples.Samples)
+        assert chain.shape == (sampler.dim, 20)
+    assert not np.allclose(chains[0].samples, chains[1].samples)
+    assert chains[0].compute_rhat(chains[1:]).shape == (sampler.dim,)
+    assert not sampler._is_initialized # The sampler itself is not modified
+
+@pytest.mark.parametrize("sampler", chain_samplers)
+def test_sample_chains_is_reproducible_with_seed(sampler):
+    """ Test that chains are reproducible and equal when run serially or in processes. """
+    chains_serial = sampler.sample_chains(10, n_chains=2, executor="serial", seed=1)
+    chains_process = sampler.sample_chains(10, n_chains=2, executor="process", seed=1)
+    for chain_serial, chain_process in zip(chains_serial, chains_process):
+        assert np.allclose(chain_serial.samples, chain_process.samples)
+
+def test_sample_chains_start_from_dispersed_initial_points():
+    """ Without initial points, the chains start at independent draws from the prior """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    sampler = cuqi.experimental.mcmc.MH(target, scale=1e-4) # Chains barely move from their initial points
+    chains = sampler.sample_chains(20, n_chains=3, executor="serial", seed=0)
+    first_points = np.array([chain.samples[:, 0] for chain in chains])
+    assert not np.allclose(first_points[0], first_points[1])
+    assert not np.allclose(first_points[1], first_points[2])
+    assert np.all(chains[0].compute_rhat(chains[1:]) > 1.1)
+
+    # Targets without a distribution to draw from require initial points
+    likelihood = target.likelihood
+    with pytest.raises(ValueError, match="initial_points"):
+        cuqi.experimental.mcmc.MH(likelihood).sample_chains(5, n_chains=2)
+    chains = cuqi.experimental.mcmc.MH(likelihood).sample_chains(5, n_chains=2, executor="serial",
+                                                                  initial_points=[np.zeros(8), np.ones(8)])
+    assert len(chains) == 2 and chains[1].shape == (8, 5)
+
+def test_sample_chains_in_threads_do_not_reseed_global_random_state(monkeypatch):
+    seeds = []
+    monkeypatch.setattr(np.random, "seed", lambda seed=None: seeds.append(seed))
+    sampler = cuqi.experimental.mcmc.MH(cuqi.distribution.Gaussian(np.zeros(2), 1))
+    sampler.sample_chains(5, n_chains=3, executor="thread", seed=0)
+    assert seeds == []
+    sampler.sample_chains(5, n_chains=3, executor="serial", seed=0)
+    assert len(seeds) == 3
+
+def test_sample_chains_restores_global_random_state():
+    """ Seeding the chains does not change the global random state of the caller """
+    sampler = cuqi.experimental.mcmc.MH(cuqi.distribution.Gaussian(np.zeros(2), 1))
+    np.random.seed(3)
+    expected = np.random.rand(5)
+    np.random.seed(3)
+    sampler.sample_chains(5, n_chains=2, executor="serial", seed=0)
+    assert np.allclose(np.random.rand(5), expected)
+
+def test_sample_chains_in_threads_do_not_share_target_caches(monkeypatch):
+    """ Chains run in threads use their own copy of the target and hence their own forward model cache """
+    posterior = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    posterior.model.enable_cache()
+    cache_threads = {}
+    cache_get = cuqi.model._model._ForwardCache.get
+    def get(cache, *args, **kwargs):
+        cache_threads.setdefault(id(cache), set()).add(threading.get_ident())
+        return cache_get(cache, *args, **kwargs)
+    monkeypatch.setattr(cuqi.model._model._ForwardCache, "get", get)
+
+    sampler = cuqi.experimental.mcmc.MH(posterior, scale=0.01)
+    cache_threads.clear()
+    chains = sampler.sample_chains(50, n_chains=4, executor="thread", max_workers=4)
+    assert len(cache_threads) == 4
+    assert id(posterior.model._forward_cache) not in cache_threads # The cache of the original target is not used
+    assert all(len(threads) == 1 for threads in cache_threads.values())
+    assert all(np.all(np.isfinite(chain.samples)) for chain in chains)
+
+def test_sample_chains_initial_points_and_invalid_executor():
+    sampler = cuqi.experimental.mcmc.MH(cuqi.distribution.Gaussian(np.zeros(2), 1))
+    with pytest.raises(ValueError, match="initial points"):
+        sampler.sample_chains(5, n_chains=2, initial_points=[np.zeros(2)])
+    with pytest.raises(ValueError, match="not recognized"):
+        sampler.sample_chains(5, n_chains=2, executor="gpu")
+
+# ============ Ensemble sampling ============
+
+@pytest.mark.parametrize("sampler_class", [cuqi.experimental.mcmc.MH, cuqi.experimental.mcmc.PCN])
+def test_sample_ensemble_with_single_chain_matches_sample(sampler_class):
+    """ An ensemble of one chain consumes random numbers in the same order as a single chain. """
+    target = cuqi.testproblem.Deconvolution1D(dim=16).posterior
+    np.random.seed(0)
+    samples_ensemble = sampler_class(target, scale=0.05).sample_ensemble(20, 1)[0].samples
+    np.random.seed(0)
+    samples_single = sampler_class(target, scale=0.05).sample(20).get_samples().samples
+    assert np.allclose(samples_ensemble, samples_single)
+
+@pytest.mark.parametrize("sampler_class", [cuqi.experimental.mcmc.MH, cuqi.experimental.mcmc.PCN])
+def test_sample_ensemble_returns_chains(sampler_class):
+    target = cuqi.testproblem.Deconvolution1D(dim=16).posterior
+    sampler = sampler_class(target, scale=0.05)
+    initial_points = np.random.randn(16, 5)
+    chains = sampler.sample_ensemble(30, 5, initial_points=initial_points)
+    assert len(chains) == 5
+    assert all(chain.shape == (16, 30) for chain in chains)
+    assert not np.allclose(chains[0].samples, chains[1].samples)
+    assert sampler.get_samples().Ns == 0 # History of sampler is untouched
+    with pytest.raises(ValueError, match="Initial points must have shape"):
+        sampler.sample_ensemble(5, 4, initial_points=initial_points)
+
+@pytest.mark.parametrize("density", [
+    cuqi.testproblem.Deconvolution1D(dim=16).posterior,
+    cuqi.testproblem.Deconvolution1D(dim=16).likelihood,
+    cuqi.distribution.GMRF(np.zeros(16), 5),
+])
+def test_batched_logd_matches_logd(density):
+    from cuqi.experimental.mcmc._sampler import _batched_logd
+    X = np.random.randn(16, 4)
+    expected = [np.ravel(density.logd(X[:, k]))[0] for k in range(4)]
+    assert np.allclose(_batched_logd(density, X), expected)
+
+def test_batched_logd_applies_vectorized_model_once():
+    from cuqi.experimental.mcmc._sampler import _batched_logd
+    A = np.random.randn(6, 4)
+    calls = []
+    def forward(x):
+        calls.append(x.shape)
+        return A@x
+    model = cuqi.model.LinearModel(forward, lambda y: A.T@y, range_geometry=6, domain_geometry=4, vectorized=True)
+    likelihood = cuqi.distribution.Gaussian(model, 0.5).to_likelihood(np.random.randn(6))
+    X = np.random.randn(4, 5)
+    logds = _batched_logd(likelihood, X)
+    assert calls == [(4, 5)]
+    assert np.allclose(logds, [np.ravel(likelihood.logd(X[:, k]))[0] for k in range(5)])
+
+# ============ Memory-mapped sample store ============
+
+def test_sample_store_matches_in_memory_samples(tmp_path):
+    """ Samples written to a memory-mapped sample store equal the samples stored in memory and are read lazily. """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    store = str(tmp_path / "samples.dat")
+
+    np.random.seed(0)
+    samples_memory = cuqi.experimental.mcmc.MH(target, scale=0.1).warmup(30).sample(50).get_samples()
+
+    np.random.seed(0)
+    samples_store = cuqi.experimental.mcmc.MH(target, scale=0.1, sample_store=store).warmup(30).sample(50).get_samples()
+
+    assert isinstance(samples_store.samples.base, np.memmap)
+    assert samples_store.shape == (8, 80)
+    assert np.allclose(samples_store.samples, samples_memory.samples)
+    assert np.allclose(samples_store.burnthin(30).mean(), samples_memory.burnthin(30).mean())
+
+def test_sample_store_grows_file_when_full(tmp_path):
+    """ The memory-mapped sample store grows the preallocated file when it is full. """
+    from cuqi.experimental.mcmc._sampler import _MemmapSampleStore
+    store = _MemmapSampleStore(str(tmp_path / "samples.dat"), dim=3, chunk_size=4)
+    samples = np.random.randn(10, 3)
+    for sample in samples:
+        store.append(sample)
+    assert len(store) == 10 and store.capacity >= 10
+    assert np.allclose(store.get_array(), samples)
+    assert np.allclose(store[-1], samples[-1])
+
+def test_sample_store_does_not_overwrite_existing_file(tmp_path):
+    """ An existing sample store file is only replaced if requested, and samples returned earlier stay valid. """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    store = str(tmp_path / "samples.dat")
+
+    sampler = cuqi.experimental.mcmc.MH(target, scale=0.1, sample_store=store)
+    samples = sampler.sample(20).get_samples()
+    samples_copy = np.array(samples.samples)
+
+    with pytest.raises(FileExistsError):
+        cuqi.experimental.mcmc.MH(target, scale=0.1, sample_store=store).sample(5)
+    with pytest.raises(FileExistsError):
+        sampler.reinitialize()
+
+    sampler = cuqi.experimental.mcmc.MH(target, scale=0.1, sample_store=store, overwrite_sample_store=True)
+    sampler.sample(5)
+    sampler.reinitialize()
+    sampler.sample(3)
+    assert sampler.get_samples().shape == (8, 3)
+    assert np.array_equal(samples.samples, samples_copy)
+    assert not samples.samples.flags.writeable
+
+def test_sample_store_resumes_after_load_checkpoint(tmp_path):
+    """ Loading a checkpoint continues storing samples in the same file directly after the checkpointed samples. """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    store = str(tmp_path / "samples.dat")
+    checkpoint = str(tmp_path / "checkpoint.pickle")
+
+    sampler = cuqi.experimental.mcmc.MH(target, scale=0.1, sample_store=store)
+    sampler.sample(40)
+    sampler.save_checkpoint(checkpoint)
+    samples_before = np.array(sampler.get_samples().samples)
+
+    np.random.seed(1)
+    expected = np.array(sampler.sample(20).get_samples().samples[:, 40:])
+
+    # Resume from checkpoint in a new sampler. The samples after the checkpoint are redrawn.
+    sampler_resumed = cuqi.experimental.mcmc.MH(target, scale=0.1)
+    sampler_resumed.load_checkpoint(checkpoint)
+    assert len(sampler_resumed._samples) == 40
+
+    np.random.seed(1)
+    samples = sampler_resumed.sample(20).get_samples().samples
+
+    assert samples.shape == (8, 60)
+    assert np.allclose(samples[:, :40], samples_before)
+    assert np.allclose(samples[:, 40:], expected)
+
+def test_samples_from_batches_written_while_sampling(tmp_path):
+    """ Samples written to disk in batches while sampling can be read back with Samples.from_batches, including the last partial batch. """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+    sampler = cuqi.experimental.mcmc.MH(target, scale=0.1)
+    samples = sampler.sample(45, batch_size=10, sample_path=str(tmp_path)).get_samples()
+
+    samples_batched = cuqi.samples.Samples.from_batches(str(tmp_path), geometry=target.geometry)
+
+    assert samples_batched.Ns == 45
+    assert np.allclose(samples_batched.samples, samples.samples)
+    assert np.allclose(samples_batched.burnthin(5).mean(), samples.burnthin(5).mean())
+
+def test_sample_with_online_statistics_without_storing_samples():
+    """ Online statistics fed by the sampler match the statistics of the stored samples, also when samples are not stored. """
+    target = cuqi.testproblem.Deconvolution1D(dim=8).posterior
+
+    np.random.seed(0)
+    sampler = cuqi.experimental.mcmc.MH(target, scale=0.1)
+    stats = cuqi.samples.OnlineStatistics(sampler.dim)
+    samples = sampler.sample(200, statistics=stats).get_samples()
+
+    np.random.seed(0)
+    indices = []
+    sampler_no_store = cuqi.experimental.mcmc.MH(target, scale=0.1, callback=lambda sample, idx: indices.append(idx))
+    stats_no_store = cuqi.samples.OnlineStatistics(sampler.dim)
+    sampler_no_store.sample(200, store_samples=False, statistics=stats_no_store)
+
+    assert sampler_no_store.get_samples().Ns == 0
+    assert len(sampler_no_store._acc) == 1 # Only the initial acceptance, independent of Ns
+    assert indices == list(range(200))
+    assert stats.Ns == stats_no_store.Ns == 200
+    assert np.allclose(stats.mean(), samples.mean())
+    assert np.allclose(stats_no_store.mean(), samples.mean())
+    assert np.allclose(stats_no_store.variance(), samples.variance())